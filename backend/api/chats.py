@@ -1,10 +1,13 @@
 import os
 import json
 import base64
+import asyncio
 from typing import Optional, List
 from core.ai_services import AIServices
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
 from helpers.orchestrator import Orchestrator  
+from helpers.ingest_jobs import TERMINAL_STATUSES
+from helpers.streaming import sse
 from core.middleware import AuthManager, User
 from datetime import datetime
 from azure.cosmos import exceptions
@@ -33,6 +36,14 @@ ALLOWED_MIME_TYPES = {
 
 ALLOWED_EXTENSIONS = {".pdf", ".doc", ".docx"}
 
+
+def _user_id(user: User) -> str:
+    """Id con el que se guardan sesiones y jobs del usuario (el mismo en toda la API)."""
+    user_id = getattr(user, "email", None) or getattr(user, "id", None) or getattr(user, "user_id", None)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Usuario no autenticado.")
+    return user_id
+
 # -----------------------------------------------------------------------------
 # region           ENDPOINT: PREGUNTA GENERAL DE USUSARIO
 # -----------------------------------------------------------------------------
@@ -41,9 +52,7 @@ async def ask(
     data: ChatJSONRequest,
     user: User = Depends(auth_manager),
 ):
-    user_id = getattr(user, "email", None) or getattr(user, "id", None) or getattr(user, "user_id", None)
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Usuario no autenticado.")
+    user_id = _user_id(user)
 
     res = await orchestrator.ejecutar_agente(
         mensaje_usuario=data.question.strip(),
@@ -52,13 +61,15 @@ async def ask(
         files=None,
     )
 
-    # Si return_direct=True, reply_text puede ser dict (según versión/langchain)
-    reply = res.get("reply_text")
+    return _ask_response(res.get("reply_text"), res.get("session_id"))
 
+
+def _ask_response(reply, session_id: Optional[str]) -> dict:
+    # Si return_direct=True, reply_text puede ser dict (según versión/langchain)
     if isinstance(reply, dict) and reply.get("doc_id"):
         return {
             "answer": reply.get("message"),
-            "session_id": res.get("session_id"),
+            "session_id": session_id,
             "doc_id": reply.get("doc_id"),
             "download_url": reply.get("download_url"),
             "file_name": reply.get("file_name"),
@@ -72,7 +83,7 @@ async def ask(
             if isinstance(payload, dict) and payload.get("doc_id"):
                 return {
                     "answer": payload.get("message"),
-                    "session_id": res.get("session_id"),
+                    "session_id": session_id,
                     "doc_id": payload.get("doc_id"),
                     "download_url": payload.get("download_url"),
                     "file_name": payload.get("file_name"),
@@ -83,20 +94,54 @@ async def ask(
 
     return {
     "answer": reply if isinstance(reply, str) else json.dumps(reply, ensure_ascii=False),
-    "session_id": res.get("session_id"),
+    "session_id": session_id,
 }
 
+
+@chat_router.post("/ask/stream")
+async def ask_stream(
+    data: ChatJSONRequest,
+    user: User = Depends(auth_manager),
+):
+    """
+    Igual que /ask pero por Server-Sent Events: emite la tool elegida
+    (event: tool), los chunks recuperados (event: retrieval), la respuesta
+    token a token (event: token) y al final event: done con el mismo cuerpo
+    que /ask. Si algo falla en el camino: event: error.
+    """
+    user_id = _user_id(user)
+
+    session_id, events = await orchestrator.ejecutar_agente_stream(
+        mensaje_usuario=data.question.strip(),
+        user_id=user_id,
+        session_id=data.session_id,
+    )
+
+    async def _events():
+        async for event, payload in events:
+            if event == "done":
+                payload = _ask_response(payload.get("reply_text"), payload.get("session_id"))
+            yield sse(event, payload)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # endregion
 
+# -----------------------------------------------------------------------------
+# region           ENDPOINT: CARGA DE ARCHIVOS (JOB EN SEGUNDO PLANO)
+# -----------------------------------------------------------------------------
 @chat_router.post("/upload")
 async def upload(
     session_id: Optional[str] = None,
+    wait: bool = Query(False, description="true = esperar a que termine la ingesta (modo anterior)"),
     files: List[UploadFile] = File(...),
     user: User = Depends(auth_manager),
 ):
-    user_id = getattr(user, "email", None) or getattr(user, "id", None) or getattr(user, "user_id", None)
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Usuario no autenticado.")
+    user_id = _user_id(user)
 
     if not files:
         raise HTTPException(status_code=400, detail="Se requiere al menos un archivo.")
@@ -119,13 +164,80 @@ async def upload(
                 detail=f"Tipo de archivo no permitido: {filename} ({f.content_type}).",
             )
 
-    res = await orchestrator.ejecutar_agente(
-        mensaje_usuario="",    
+    if wait:
+        return await orchestrator.ejecutar_agente(
+            mensaje_usuario="",    
+            user_id=user_id,
+            session_id=session_id,
+            files=files,
+        )
+
+    return await orchestrator.iniciar_ingesta(
         user_id=user_id,
         session_id=session_id,
         files=files,
     )
-    return res
+
+
+async def _get_job_for_user(job_id: str, user: User) -> dict:
+    job = await asyncio.to_thread(orchestrator.ingest_jobs.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job no encontrado.")
+    if job.get("user_id") != _user_id(user):
+        raise HTTPException(status_code=403, detail="No autorizado para ver este job.")
+    return await asyncio.to_thread(orchestrator.ingest_jobs.expire_if_stale, job)
+
+
+def _job_view(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "session_id": job.get("session_id"),
+        "status": job.get("status"),
+        "files": job.get("files", []),
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at"),
+    }
+
+
+@chat_router.get("/upload/jobs/{job_id}")
+async def upload_job_status(job_id: str = Path(...), user: User = Depends(auth_manager)):
+    return _job_view(await _get_job_for_user(job_id, user))
+
+
+@chat_router.get("/upload/jobs/{job_id}/events")
+async def upload_job_events(job_id: str = Path(...), user: User = Depends(auth_manager)):
+    """
+    Server-Sent Events con el estado del job: emite cada cambio y cierra
+    cuando el job termina (done | partial | failed). Un job huérfano (sin
+    latido por más de INGEST_JOB_STALE_SECONDS) se marca failed y también cierra.
+    """
+    await _get_job_for_user(job_id, user)
+    jobs = orchestrator.ingest_jobs
+
+    async def _events():
+        last = None
+        while True:
+            job = await asyncio.to_thread(jobs.get, job_id)
+            if not job:
+                yield sse("error", {"detail": "Job no encontrado."})
+                return
+            job = await asyncio.to_thread(jobs.expire_if_stale, job)
+            view = _job_view(job)
+            if view != last:
+                last = view
+                yield sse("progress", view)
+            if view["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(1.0)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# endregion
 
 
 @download_router.get("/download/doc/{doc_id}")
@@ -52,12 +52,116 @@ class Settings:
     AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
     AZURE_OPENAI_OPENAI_VERSION=os.getenv("AZURE_OPENAI_OPENAI_VERSION")
 
+    # Dimensión de los vectores (3072 = nativa de text-embedding-3-large).
+    # Menor -> se piden vectores recortados con el parámetro `dimensions`.
+    EMBEDDING_NATIVE_DIMENSIONS = 3072
+    EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "3072"))
+    # El índice del corpus (Fabric) es externo: su dimensión se configura aparte
+    FABRIC_VECTOR_DIMENSIONS = int(os.getenv("FABRIC_VECTOR_DIMENSIONS", "3072"))
+
+    # Embeddings por lotes (límites por request)
+    EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "128"))
+    EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+
+    # Caché persistente de embeddings (SQLite local, LRU por tamaño)
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_DB_PATH = os.getenv("EMBEDDING_CACHE_DB_PATH", str(BASE_DIR / "data" / "embedding_cache.sqlite3"))
+    EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+    EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float32")
+
+    # Caché en memoria de embeddings de consultas (LRU + TTL, compartida por RAG y generación)
+    QUERY_EMBEDDING_CACHE_ENABLED = os.getenv("QUERY_EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    QUERY_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "2048"))
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+
+    # Subida de archivos: límites y spool a disco (no se cargan enteros en memoria)
+    UPLOAD_MAX_FILE_MB = int(os.getenv("UPLOAD_MAX_FILE_MB", "50"))
+    UPLOAD_MAX_REQUEST_MB = int(os.getenv("UPLOAD_MAX_REQUEST_MB", "200"))
+    UPLOAD_SPOOL_MAX_MEMORY_MB = int(os.getenv("UPLOAD_SPOOL_MAX_MEMORY_MB", "2"))
+    UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None  # None = directorio temporal del sistema
+
+    # Ingesta concurrente de archivos (por request y por proceso)
+    INGEST_MAX_CONCURRENCY_PER_REQUEST = int(os.getenv("INGEST_MAX_CONCURRENCY_PER_REQUEST", "4"))
+    INGEST_MAX_CONCURRENCY_PROCESS = int(os.getenv("INGEST_MAX_CONCURRENCY_PROCESS", "8"))
+
+    # Pipeline de ingesta: chunks por lote de embeddings y lotes en cola por etapa
+    INGEST_PIPELINE_BATCH_SIZE = int(os.getenv("INGEST_PIPELINE_BATCH_SIZE", "32"))
+    INGEST_PIPELINE_QUEUE_SIZE = int(os.getenv("INGEST_PIPELINE_QUEUE_SIZE", "2"))
+
+    # Jobs de ingesta: latido mientras corren; sin latido por más de STALE se marcan failed
+    INGEST_JOB_HEARTBEAT_SECONDS = int(os.getenv("INGEST_JOB_HEARTBEAT_SECONDS", "60"))
+    INGEST_JOB_STALE_SECONDS = int(os.getenv("INGEST_JOB_STALE_SECONDS", "600"))
+
+    # Deduplicación de contenido por hash (SQLite local: texto y vectores ya calculados)
+    INGEST_DEDUP_ENABLED = os.getenv("INGEST_DEDUP_ENABLED", "true").lower() == "true"
+    INGEST_DEDUP_DB_PATH = os.getenv("INGEST_DEDUP_DB_PATH", str(BASE_DIR / "data" / "ingest_dedup.sqlite3"))
+    INGEST_DEDUP_MAX_MB = int(os.getenv("INGEST_DEDUP_MAX_MB", "2048"))
+    # Archivos reservados en el manifiesto (ingesta en curso): vencen si el proceso murió
+    INGEST_PENDING_TTL_MINUTES = int(os.getenv("INGEST_PENDING_TTL_MINUTES", "60"))
+
     # Azure AI Search
     AZURE_SEARCH_ENDPOINT = os.getenv("AZURE_SEARCH_ENDPOINT")
     AZURE_SEARCH_KEY = os.getenv("AZURE_SEARCH_KEY")
     AZURE_SEARCH_INDEX = os.getenv("AZURE_SEARCH_INDEX")
     AZURE_SEARCH_INDEX_FABRIC = os.getenv("AZURE_SEARCH_INDEX_FABRIC")
 
+    # Upload al índice: lotes por tamaño y lotes en paralelo
+    SEARCH_UPLOAD_MAX_BATCH_BYTES = int(os.getenv("SEARCH_UPLOAD_MAX_BATCH_BYTES", str(8 * 1024 * 1024)))
+    SEARCH_UPLOAD_MAX_BATCH_DOCS = int(os.getenv("SEARCH_UPLOAD_MAX_BATCH_DOCS", "1000"))
+    SEARCH_UPLOAD_CONCURRENCY = int(os.getenv("SEARCH_UPLOAD_CONCURRENCY", "4"))
+
+    # Presupuesto de tokens del CONTEXTO en los prompts RAG (tiktoken cl100k_base)
+    CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))
+
+    # RAG por documento: búsquedas por archivo en paralelo
+    RAG_PER_FILE_SEARCH_CONCURRENCY = int(os.getenv("RAG_PER_FILE_SEARCH_CONCURRENCY", "8"))
+
+    # Camino async (agente, tools, RAG): llamadas a Azure OpenAI en vuelo y ritmo por minuto (0 = sin límite)
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+    LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+    EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "64"))
+    EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "0"))
+
+    # Memoria de conversación por sesión: resumen acumulado + últimos turnos literales
+    MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "4"))
+    MEMORY_TURN_MAX_TOKENS = int(os.getenv("MEMORY_TURN_MAX_TOKENS", "700"))
+    MEMORY_SUMMARY_MAX_TOKENS = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "600"))
+    MEMORY_HISTORY_MAX_TOKENS = int(os.getenv("MEMORY_HISTORY_MAX_TOKENS", "3000"))
+
+    # Router local de intención antes del agente (reglas + similitud con ejemplos)
+    INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+    INTENT_ROUTER_THRESHOLD = float(os.getenv("INTENT_ROUTER_THRESHOLD", "0.78"))
+    INTENT_ROUTER_MARGIN = float(os.getenv("INTENT_ROUTER_MARGIN", "0.05"))
+
+    # Generación del Word: "sections" (una llamada por sección, en paralelo) | "single" (un JSON)
+    DOC_GEN_MODE = os.getenv("DOC_GEN_MODE", "sections")
+    DOC_GEN_SECTION_CONCURRENCY = int(os.getenv("DOC_GEN_SECTION_CONCURRENCY", "8"))
+    DOC_GEN_SECTION_RETRIES = int(os.getenv("DOC_GEN_SECTION_RETRIES", "1"))
+    DOC_GEN_SECTION_CONTEXT_TOKENS = int(os.getenv("DOC_GEN_SECTION_CONTEXT_TOKENS", "3000"))
+
+    # Resumen + metadatos (tipo, radicado, partes) por archivo, en segundo plano tras la ingesta
+    DOC_SUMMARY_ENABLED = os.getenv("DOC_SUMMARY_ENABLED", "true").lower() == "true"
+    DOC_SUMMARY_CONCURRENCY = int(os.getenv("DOC_SUMMARY_CONCURRENCY", "2"))
+    DOC_SUMMARY_INPUT_MAX_TOKENS = int(os.getenv("DOC_SUMMARY_INPUT_MAX_TOKENS", "6000"))
+
+    # Índice en memoria (NumPy + BM25) de los documentos de la sesión; Azure Search es el fallback
+    SESSION_LOCAL_INDEX_ENABLED = os.getenv("SESSION_LOCAL_INDEX_ENABLED", "false").lower() == "true"
+    SESSION_LOCAL_INDEX_MAX_MB = int(os.getenv("SESSION_LOCAL_INDEX_MAX_MB", "512"))
+    SESSION_LOCAL_INDEX_MAX_CHUNKS = int(os.getenv("SESSION_LOCAL_INDEX_MAX_CHUNKS", "20000"))
+
+    # Caché semántica de respuestas del corpus (Fabric)
+    CORPUS_ANSWER_CACHE_ENABLED = os.getenv("CORPUS_ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    CORPUS_ANSWER_CACHE_THRESHOLD = float(os.getenv("CORPUS_ANSWER_CACHE_THRESHOLD", "0.95"))
+    CORPUS_ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("CORPUS_ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    CORPUS_ANSWER_CACHE_TTL_SECONDS = int(os.getenv("CORPUS_ANSWER_CACHE_TTL_SECONDS", "86400"))
+    # Versión del corpus: fija (se cambia al refrescar) o, si vacía, se deriva de las estadísticas del índice
+    CORPUS_INDEX_VERSION = os.getenv("CORPUS_INDEX_VERSION", "")
+    CORPUS_INDEX_VERSION_CHECK_SECONDS = int(os.getenv("CORPUS_INDEX_VERSION_CHECK_SECONDS", "300"))
+
+    # Almacenamiento del vector en el índice (setup_index.py)
+    SEARCH_VECTOR_COMPRESSION = os.getenv("SEARCH_VECTOR_COMPRESSION", "none")  # none | scalar | binary
+    SEARCH_VECTOR_HALF_PRECISION = os.getenv("SEARCH_VECTOR_HALF_PRECISION", "false").lower() == "true"
+
     # Cosmos DB
     AZURE_COSMOSDB_KEY= os.getenv("AZURE_COSMOSDB_KEY")
     AZURE_COSMOSDB_ENDPOINT= os.getenv("AZURE_COSMOSDB_ENDPOINT")
@@ -70,6 +174,18 @@ class Settings:
     AZURE_FORM_RECOGNIZER_ENDPOINT=os.getenv("AZURE_FORM_RECOGNIZER_ENDPOINT")
     AZURE_FORM_RECOGNIZER_API_KEY=os.getenv("AZURE_FORM_RECOGNIZER_API_KEY")
 
+    # PDFs grandes: análisis por rangos de páginas en paralelo (cada rango se sube como sub-PDF)
+    DI_SPLIT_MIN_PAGES = int(os.getenv("DI_SPLIT_MIN_PAGES", "60"))
+    DI_PAGES_PER_SEGMENT = int(os.getenv("DI_PAGES_PER_SEGMENT", "25"))
+    DI_MAX_CONCURRENT_SEGMENTS = int(os.getenv("DI_MAX_CONCURRENT_SEGMENTS", "4"))
+
+    # Extracción local (DOCX / PDF con capa de texto) antes de Document Intelligence
+    LOCAL_EXTRACTION_ENABLED = os.getenv("LOCAL_EXTRACTION_ENABLED", "true").lower() == "true"
+    LOCAL_PDF_MIN_CHARS_PER_PAGE = int(os.getenv("LOCAL_PDF_MIN_CHARS_PER_PAGE", "50"))
+    # Páginas con texto mínimas para extraer local; las páginas solo imagen van a OCR
+    # (DI, solo esas páginas). Por debajo, el PDF completo va a Document Intelligence.
+    LOCAL_PDF_MIN_TEXT_PAGE_RATIO = float(os.getenv("LOCAL_PDF_MIN_TEXT_PAGE_RATIO", "0.5"))
+
     #Rutas
     DOCX_TEMPLATE_PATH = os.getenv("DOCX_TEMPLATE_PATH")
 
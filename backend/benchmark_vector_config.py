@@ -0,0 +1,189 @@
+# benchmark_vector_config.py (en la raíz: backend/benchmark_vector_config.py)
+"""
+Compara configuraciones de almacenamiento vectorial para el índice de sesión:
+dimensión recortada (text-embedding-3), compresión (scalar/binary) y float16.
+
+Toma una muestra de chunks del índice actual (3072 / float32), crea un índice
+temporal por configuración, sube la muestra y mide:
+- tamaño total y del índice vectorial (get_index_statistics)
+- latencia de consulta p50 / p95
+- recall@k contra la búsqueda exacta con los vectores completos
+
+Uso:
+    python benchmark_vector_config.py --sample 2000 --queries 50 --k 10 \\
+        --configs 3072:none:single,1536:scalar:single,1024:scalar:half,3072:binary:single
+
+Los índices temporales se borran al terminar salvo que se pase --keep.
+"""
+from __future__ import annotations
+
+import time
+import argparse
+import numpy as np
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.models import VectorizedQuery
+
+from app.config import settings
+from setup_index import build_index
+
+
+def parse_configs(raw: str) -> list[dict]:
+    configs = []
+    for item in raw.split(","):
+        dims, compression, precision = item.strip().split(":")
+        configs.append({
+            "dimensions": int(dims),
+            "compression": compression,
+            "half_precision": precision == "half",
+            "label": item.strip(),
+        })
+    return configs
+
+
+def truncate(vectors: np.ndarray, dims: int) -> np.ndarray:
+    # recorte "Matryoshka": primeras `dims` componentes y renormalizar
+    cut = vectors[:, :dims]
+    norms = np.linalg.norm(cut, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return cut / norms
+
+
+def load_sample(client: SearchClient, size: int) -> tuple[list[dict], np.ndarray]:
+    results = client.search(
+        search_text="*",
+        top=size,
+        select=["id", "content", "content_vector"],
+    )
+    docs, vectors = [], []
+    for r in results:
+        vec = r.get("content_vector")
+        if not vec:
+            continue
+        docs.append({"id": r["id"], "content": r.get("content") or ""})
+        vectors.append(vec)
+    return docs, np.asarray(vectors, dtype=np.float32)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> list[set[int]]:
+    normed = truncate(vectors, vectors.shape[1])
+    scores = truncate(queries, queries.shape[1]) @ normed.T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+
+def run_config(
+    index_client: SearchIndexClient,
+    cfg: dict,
+    docs: list[dict],
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    truth: list[set[int]],
+    k: int,
+    keep: bool,
+) -> dict:
+    name = f"{settings.AZURE_SEARCH_INDEX}-bench-{cfg['label'].replace(':', '-')}".lower()
+    index_client.create_index(build_index(
+        name,
+        dimensions=cfg["dimensions"],
+        compression=cfg["compression"],
+        half_precision=cfg["half_precision"],
+    ))
+    client = SearchClient(
+        endpoint=settings.AZURE_SEARCH_ENDPOINT,
+        index_name=name,
+        credential=AzureKeyCredential(settings.AZURE_SEARCH_KEY),
+    )
+    try:
+        vecs = truncate(vectors, cfg["dimensions"])
+        qvecs = truncate(queries, cfg["dimensions"])
+        position = {d["id"]: i for i, d in enumerate(docs)}
+
+        batch = []
+        for d, v in zip(docs, vecs):
+            batch.append({"id": d["id"], "content": d["content"], "content_vector": v.tolist()})
+            if len(batch) >= 200:
+                client.upload_documents(documents=batch)
+                batch = []
+        if batch:
+            client.upload_documents(documents=batch)
+
+        # esperar a que el índice refleje todos los documentos
+        deadline = time.monotonic() + 120
+        while client.get_document_count() < len(docs) and time.monotonic() < deadline:
+            time.sleep(2)
+
+        latencies, recalls = [], []
+        for qv, expected in zip(qvecs, truth):
+            t0 = time.perf_counter()
+            results = list(client.search(
+                search_text=None,
+                top=k,
+                vector_queries=[VectorizedQuery(vector=qv.tolist(), k_nearest_neighbors=k, fields="content_vector")],
+                select=["id"],
+            ))
+            latencies.append((time.perf_counter() - t0) * 1000)
+            got = {position[r["id"]] for r in results if r["id"] in position}
+            recalls.append(len(got & expected) / k)
+
+        # las estadísticas del índice se actualizan con unos segundos de retraso
+        time.sleep(10)
+        stats = index_client.get_index_statistics(name)
+        return {
+            "config": cfg["label"],
+            "storage_mb": round(stats.get("storage_size", 0) / 1024 / 1024, 2),
+            "vector_index_mb": round(stats.get("vector_index_size", 0) / 1024 / 1024, 2),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+            f"recall@{k}": round(float(np.mean(recalls)), 4),
+        }
+    finally:
+        client.close()
+        if not keep:
+            index_client.delete_index(name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de configuraciones vectoriales")
+    parser.add_argument("--sample", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--configs", default="3072:none:single,1536:scalar:single,1024:scalar:half,3072:binary:single")
+    parser.add_argument("--keep", action="store_true", help="no borrar los índices temporales")
+    args = parser.parse_args()
+
+    credential = AzureKeyCredential(settings.AZURE_SEARCH_KEY)
+    source = SearchClient(
+        endpoint=settings.AZURE_SEARCH_ENDPOINT,
+        index_name=settings.AZURE_SEARCH_INDEX,
+        credential=credential,
+    )
+    index_client = SearchIndexClient(endpoint=settings.AZURE_SEARCH_ENDPOINT, credential=credential)
+
+    print("Leyendo muestra de", settings.AZURE_SEARCH_INDEX, "...")
+    docs, vectors = load_sample(source, args.sample)
+    if len(docs) <= args.queries:
+        raise SystemExit("Muestra insuficiente: sube más documentos o baja --queries")
+    if vectors.shape[1] != settings.EMBEDDING_NATIVE_DIMENSIONS:
+        print(f"Aviso: la base tiene {vectors.shape[1]} dimensiones; el recall se mide contra esa base.")
+
+    # consultas = vectores de chunks de la muestra (la verdad es la búsqueda exacta)
+    rng = np.random.default_rng(42)
+    queries = vectors[rng.choice(len(docs), size=args.queries, replace=False)]
+    truth = exact_top_k(vectors, queries, args.k)
+    print(f"Muestra: {len(docs)} chunks, {args.queries} consultas, k={args.k}")
+
+    rows = []
+    for cfg in parse_configs(args.configs):
+        print("Probando", cfg["label"], "...")
+        rows.append(run_config(index_client, cfg, docs, vectors, queries, truth, args.k, args.keep))
+
+    headers = list(rows[0].keys())
+    print()
+    print(" | ".join(headers))
+    for r in rows:
+        print(" | ".join(str(r[h]) for h in headers))
+
+
+if __name__ == "__main__":
+    main()
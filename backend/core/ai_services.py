@@ -1,13 +1,17 @@
+import time
+import random
+import asyncio
 import logging
 import uuid
 import base64
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Any
+from typing import Any, Callable, Dict, List, Optional
 from app.config import settings
 from openai import AzureOpenAI
 from langchain_openai import AzureChatOpenAI
+from azure.core import MatchConditions
 from azure.cosmos import CosmosClient, PartitionKey, exceptions
-from helpers.prompts import generate_session_title
+from helpers.prompts import generate_session_title, agenerate_session_title
 from utils.functions import Functions
 
 class AIServices:
@@ -143,11 +147,14 @@ class AIServices:
         def touch_session(self, session_id: str):
             """
             Actualiza updated_at sin tocar lo demás (si existe).
+            Con patch: no pisa la memoria que se actualiza en segundo plano.
             """
             try:
-                session = self.sessions_container.read_item(item=session_id, partition_key=session_id)
-                session["updated_at"] = AIServices._utc_iso()
-                self.sessions_container.replace_item(item=session_id, body=session)
+                self.sessions_container.patch_item(
+                    item=session_id,
+                    partition_key=session_id,
+                    patch_operations=[{"op": "set", "path": "/updated_at", "value": AIServices._utc_iso()}],
+                )
             except exceptions.CosmosResourceNotFoundError:
                 pass
 
@@ -181,14 +188,16 @@ class AIServices:
 
             created = self.messages_container.create_item(doc_message)
 
-            # Actualizar sesión (append message_id)
+            # Actualizar sesión (append message_id) con patch atómico
             session_id = message_data["session_id"]
-            session = self.sessions_container.read_item(item=session_id, partition_key=session_id)
-            session.setdefault("message", [])
-            session["message"].append(message_data["message_id"])
-            session["updated_at"] =  AIServices._utc_iso()
-
-            self.sessions_container.replace_item(item=session_id, body=session)
+            self.sessions_container.patch_item(
+                item=session_id,
+                partition_key=session_id,
+                patch_operations=[
+                    {"op": "add", "path": "/message/-", "value": message_data["message_id"]},
+                    {"op": "set", "path": "/updated_at", "value": AIServices._utc_iso()},
+                ],
+            )
             return created
 
         # =========================
@@ -272,6 +281,9 @@ class AIServices:
 
                 logging.info(f"Se eliminaron {deleted} mensajes de la sesión {session_id}")
 
+                # Manifiesto de archivos de la sesión
+                self.delete_session_manifest(session_id)
+
                 # Borrar sesión
                 try:
                     self.sessions_container.delete_item(item=session_id, partition_key=session_id)
@@ -285,23 +297,11 @@ class AIServices:
 
         def count_uploaded_files(self, session_id: str) -> int:
             """
-            Cuenta el total acumulado de archivos subidos en una sesión,
-            sumando ARRAY_LENGTH(extra.uploaded_files) por cada mensaje.
+            Total de archivos indexados en la sesión, según su manifiesto
+            (lectura puntual, sin agregaciones sobre los mensajes).
             """
-            query = """
-            SELECT VALUE SUM(
-                IIF(IS_DEFINED(c.extra.uploaded_files), ARRAY_LENGTH(c.extra.uploaded_files), 0)
-            )
-            FROM c
-            WHERE c.id_session = @id_session
-            """
-            params = [{"name": "@id_session", "value": session_id}]
-            items = list(self.messages_container.query_items(
-                query=query,
-                parameters=params,
-                enable_cross_partition_query=True
-            ))
-            return int(items[0]) if items and items[0] is not None else 0
+            manifest = self.get_session_manifest(session_id)
+            return len(manifest.get("files", [])) if manifest else 0
         
         def save_message_chat(
             self,
@@ -314,14 +314,45 @@ class AIServices:
         ):
             # Si no existe la sesión, créala (con título GPT)
             if not self.session_exists(session_id):
-                session_data = {
+                self.create_session({
                     "session_id": session_id,
                     "user_id": user_id,
                     "session_name": generate_session_title(self.llm, user_question),
                     "channel": channel
-                }
-                self.create_session(session_data)
+                })
+            self._save_chat_turn(session_id, user_question, ia_response, channel, extra)
 
+        async def asave_message_chat(
+            self,
+            session_id: str,
+            user_id: str,
+            user_question: str,
+            ia_response: str,
+            channel: str = "web",
+            extra: dict | None = None,
+        ):
+            """
+            save_message_chat para el event loop: las escrituras en Cosmos van
+            en hilos y el título de una sesión nueva es una llamada async al LLM.
+            """
+            if not await asyncio.to_thread(self.session_exists, session_id):
+                title = await agenerate_session_title(self.llm, user_question)
+                await asyncio.to_thread(self.create_session, {
+                    "session_id": session_id,
+                    "user_id": user_id,
+                    "session_name": title,
+                    "channel": channel,
+                })
+            await asyncio.to_thread(self._save_chat_turn, session_id, user_question, ia_response, channel, extra)
+
+        def _save_chat_turn(
+            self,
+            session_id: str,
+            user_question: str,
+            ia_response: str,
+            channel: str,
+            extra: dict | None,
+        ) -> None:
             message_data = {
                 "message_id": str(uuid.uuid4()),
                 "session_id": session_id,
@@ -338,8 +369,6 @@ class AIServices:
             self.save_message(message_data)
             self.touch_session(session_id)
 
-
-
         def save_generated_doc(
             self,
             *,
@@ -391,4 +420,208 @@ class AIServices:
                 query=query,
                 parameters=params,
                 enable_cross_partition_query=True 
-            ))
\ No newline at end of file
+            ))
+
+        # =========================
+        # INGEST JOBS (docs container, type = ingest_job)
+        # =========================
+        def create_ingest_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+            item = {
+                **job,
+                "type": "ingest_job",
+                "created_at": self.function._utc_iso(),
+                "updated_at": self.function._utc_iso(),
+            }
+            return self.docs_container.create_item(item)
+
+        def get_ingest_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+            try:
+                item = self.docs_container.read_item(item=job_id, partition_key=job_id)
+            except exceptions.CosmosResourceNotFoundError:
+                return None
+            return item if item.get("type") == "ingest_job" else None
+
+        def patch_ingest_job(
+            self, job_id: str, fields: Dict[str, Any], filter_predicate: Optional[str] = None
+        ) -> None:
+            """
+            Actualiza campos del job con patch (atómico por operación), p. ej.
+            {"status": "running", "files/0/status": "done"}.
+            Cosmos admite máx. 10 operaciones por patch. Con filter_predicate
+            (solo hasta 9 campos) el patch se aplica si el job lo cumple; si no,
+            CosmosAccessConditionFailedError.
+            """
+            ops = [{"op": "set", "path": f"/{k}", "value": v} for k, v in fields.items()]
+            ops.append({"op": "set", "path": "/updated_at", "value": self.function._utc_iso()})
+            if filter_predicate:
+                self.docs_container.patch_item(
+                    item=job_id,
+                    partition_key=job_id,
+                    patch_operations=ops,
+                    filter_predicate=filter_predicate,
+                )
+                return
+            for i in range(0, len(ops), 10):
+                self.docs_container.patch_item(
+                    item=job_id,
+                    partition_key=job_id,
+                    patch_operations=ops[i:i + 10],
+                )
+
+        # =========================
+        # MANIFIESTO DE ARCHIVOS (docs container, type = session_manifest)
+        # =========================
+        @staticmethod
+        def _manifest_id(session_id: str) -> str:
+            return f"manifest_{session_id}"
+
+        def get_session_manifest(self, session_id: str) -> Optional[Dict[str, Any]]:
+            manifest_id = self._manifest_id(session_id)
+            try:
+                return self.docs_container.read_item(item=manifest_id, partition_key=manifest_id)
+            except exceptions.CosmosResourceNotFoundError:
+                return None
+
+        def update_session_manifest(
+            self,
+            session_id: str,
+            user_id: str,
+            mutate: Callable[[Dict[str, Any]], Any],
+            retries: int = 10,
+        ) -> Any:
+            """
+            Lectura-modificación-escritura del manifiesto con control optimista
+            (etag): `mutate(manifest)` modifica el dict y devuelve un resultado.
+            Si otro worker lo cambió entre la lectura y la escritura (o lo creó
+            primero), se vuelve a leer y se repite; mutate debe depender solo
+            del manifiesto que recibe. Crea el manifiesto si no existe.
+            Devuelve lo que devuelva mutate (sus excepciones se propagan sin escribir).
+            """
+            manifest_id = self._manifest_id(session_id)
+            for attempt in range(retries):
+                current = self.get_session_manifest(session_id)
+                doc = current or {
+                    "id": manifest_id,
+                    "type": "session_manifest",
+                    "session_id": session_id,
+                    "user_id": user_id,
+                    "files": [],
+                    "pending": [],
+                    "created_at": self.function._utc_iso(),
+                }
+                result = mutate(doc)
+                doc["updated_at"] = self.function._utc_iso()
+                try:
+                    if current is None:
+                        self.docs_container.create_item(doc)
+                    else:
+                        self.docs_container.replace_item(
+                            item=manifest_id,
+                            body=doc,
+                            etag=current["_etag"],
+                            match_condition=MatchConditions.IfNotModified,
+                        )
+                    return result
+                except (exceptions.CosmosResourceExistsError, exceptions.CosmosAccessConditionFailedError):
+                    # otro archivo de la sesión escribió primero
+                    time.sleep(random.uniform(0.01, 0.05) * (attempt + 1))
+            raise RuntimeError(f"No se pudo actualizar el manifiesto de {session_id} (conflictos)")
+
+        def update_session_manifest_file(self, session_id: str, file_id: str, fields: Dict[str, Any]) -> bool:
+            """
+            Actualiza campos de un archivo del manifiesto (p. ej. resumen).
+            Los archivos solo se agregan al final, así que la posición no
+            cambia; el filtro confirma que sigue siendo el mismo file_id.
+            Devuelve False si el archivo ya no está.
+            """
+            manifest = self.get_session_manifest(session_id)
+            if not manifest:
+                return False
+            idx = next((i for i, f in enumerate(manifest.get("files", [])) if f.get("file_id") == file_id), None)
+            if idx is None:
+                return False
+            manifest_id = self._manifest_id(session_id)
+            ops = [{"op": "set", "path": f"/files/{idx}/{k}", "value": v} for k, v in fields.items()]
+            try:
+                self.docs_container.patch_item(
+                    item=manifest_id,
+                    partition_key=manifest_id,
+                    patch_operations=ops,
+                    filter_predicate=f"FROM c WHERE c.files[{idx}].file_id = '{file_id}'",
+                )
+            except (exceptions.CosmosResourceNotFoundError, exceptions.CosmosAccessConditionFailedError):
+                # sesión borrada mientras tanto
+                return False
+            return True
+
+        def delete_session_manifest(self, session_id: str) -> None:
+            manifest_id = self._manifest_id(session_id)
+            try:
+                self.docs_container.delete_item(item=manifest_id, partition_key=manifest_id)
+            except exceptions.CosmosResourceNotFoundError:
+                pass
+
+        # =========================
+        # MEMORIA DE CONVERSACIÓN (campo "memory" de la sesión)
+        # =========================
+        def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+            try:
+                return self.sessions_container.read_item(item=session_id, partition_key=session_id)
+            except exceptions.CosmosResourceNotFoundError:
+                return None
+
+        def init_session_memory(self, session_id: str, memory: Dict[str, Any]) -> bool:
+            """
+            Crea el campo memory si la sesión aún no lo tiene.
+            Devuelve False si ya existía (otra réplica lo creó primero).
+            """
+            try:
+                self.sessions_container.patch_item(
+                    item=session_id,
+                    partition_key=session_id,
+                    patch_operations=[{"op": "set", "path": "/memory", "value": memory}],
+                    filter_predicate="FROM c WHERE NOT IS_DEFINED(c.memory)",
+                )
+            except exceptions.CosmosAccessConditionFailedError:
+                return False
+            return True
+
+        def append_session_turn(self, session_id: str, turn: Dict[str, Any]) -> Dict[str, Any]:
+            """
+            Agrega un turno al final de memory.recent (atómico frente a otros
+            patch). Devuelve la sesión actualizada.
+            """
+            return self.sessions_container.patch_item(
+                item=session_id,
+                partition_key=session_id,
+                patch_operations=[
+                    {"op": "add", "path": "/memory/recent/-", "value": turn},
+                    {"op": "set", "path": "/memory/updated_at", "value": self.function._utc_iso()},
+                ],
+            )
+
+        def fold_session_memory(self, session_id: str, summary: str, summarized_turns: int, folded: int) -> bool:
+            """
+            Reemplaza el resumen y quita los `folded` turnos más antiguos de
+            memory.recent. Los turnos nuevos se agregan al final, así que
+            quitar desde /0 no los toca; el filtro sobre summarized_turns evita
+            que dos plegados concurrentes resuman los mismos turnos.
+            Cosmos admite máx. 10 operaciones por patch (folded <= 7).
+            Devuelve False si otro plegado ganó.
+            """
+            ops = [
+                {"op": "set", "path": "/memory/summary", "value": summary},
+                {"op": "set", "path": "/memory/summarized_turns", "value": summarized_turns + folded},
+                {"op": "set", "path": "/memory/updated_at", "value": self.function._utc_iso()},
+            ]
+            ops += [{"op": "remove", "path": "/memory/recent/0"} for _ in range(folded)]
+            try:
+                self.sessions_container.patch_item(
+                    item=session_id,
+                    partition_key=session_id,
+                    patch_operations=ops,
+                    filter_predicate=f"FROM c WHERE c.memory.summarized_turns = {int(summarized_turns)}",
+                )
+            except (exceptions.CosmosResourceNotFoundError, exceptions.CosmosAccessConditionFailedError):
+                return False
+            return True
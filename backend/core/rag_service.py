@@ -1,17 +1,46 @@
+import time
+import asyncio
+import logging
 from collections import defaultdict
-from openai import AzureOpenAI
+from concurrent.futures import ThreadPoolExecutor
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from app.config import settings
 from helpers.indexacion import EmbeddingService, AzureSearchIndexer, FabricSearchIndexer
+from helpers.session_manifest import SessionManifest
+from helpers.answer_cache import SemanticAnswerCache
+from helpers.context_packer import ContextPacker, chunk_label
+from helpers.streaming import complete_chat, acomplete_chat, emit
+from helpers.document_summary import format_summary, has_summary
 
 class RAGService:
-    def __init__(self, embedder: EmbeddingService, indexer: AzureSearchIndexer) -> None:
+    def __init__(
+        self,
+        embedder: EmbeddingService,
+        indexer: AzureSearchIndexer,
+        manifest: SessionManifest | None = None,
+        packer: ContextPacker | None = None,
+    ) -> None:
         self.embedder = embedder
         self.indexer = indexer
+        self.manifest = manifest
+        self.packer = packer or ContextPacker()
+        # búsquedas por archivo en paralelo (answer_per_document)
+        self._search_pool = ThreadPoolExecutor(
+            max_workers=settings.RAG_PER_FILE_SEARCH_CONCURRENCY,
+            thread_name_prefix="rag-search",
+        )
         self.chat = AzureOpenAI(
             api_key=settings.AZURE_OPENAI_KEY,
             azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
             api_version=settings.AZURE_OPENAI_OPENAI_VERSION,
         )
+        # camino async (aanswer): sin hilos por request
+        self.achat = AsyncAzureOpenAI(
+            api_key=settings.AZURE_OPENAI_KEY,
+            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+            api_version=settings.AZURE_OPENAI_OPENAI_VERSION,
+        )
+        self._file_search_sem = asyncio.Semaphore(settings.RAG_PER_FILE_SEARCH_CONCURRENCY)
 
     def _is_per_document_request(self, question: str) -> bool:
         q = (question or "").lower()
@@ -32,11 +61,34 @@ class RAGService:
             session_id=session_id,
             top_k=top_k
         )
+        request, chunks_used = self._answer_request(question, hits)
+        # en streaming (/api/ask/stream) los tokens salen apenas se generan
+        return {"answer": complete_chat(self.chat, **request), "chunks_used": chunks_used}
 
-        context = "\n\n".join(
-            f"[{h.get('file_name')} | chunk {h.get('chunk_id')}] {h.get('content')}"
-            for h in hits
-        ).strip()
+    async def aanswer(self, question: str, user_id: str, session_id: str, top_k: int = 6) -> dict:
+        """answer sin bloquear el loop (AsyncAzureOpenAI + búsquedas async)."""
+        if self._is_per_document_request(question):
+            return await self.aanswer_per_document(question, user_id, session_id)
+        qvec = await self.embedder.aembed(question)
+        hits = await self.indexer.ahybrid_search(
+            question=question,
+            query_vector=qvec,
+            user_id=user_id,
+            session_id=session_id,
+            top_k=top_k
+        )
+        request, chunks_used = self._answer_request(question, hits)
+        return {"answer": await acomplete_chat(self.achat, **request), "chunks_used": chunks_used}
+
+    def _answer_request(self, question: str, hits: list[dict]) -> tuple[dict, list[dict]]:
+        # chunks consecutivos unidos (sin overlap) y recortados al presupuesto de tokens
+        context, hits = self.packer.pack(
+            hits,
+            text_field="content",
+            group_field="file_id",
+            order_field="chunk_id",
+            label=lambda h, a, b: chunk_label(h.get("file_name"), a, b),
+        )
 
         system = (
             "Responde SOLO con base en el CONTEXTO. No inventes. "
@@ -45,43 +97,90 @@ class RAGService:
 
         user = f"CONTEXTO:\n{context}\n\nPREGUNTA:\n{question}"
 
-        resp = self.chat.chat.completions.create(
-            model=settings.AZURE_OPENAI_CHAT_DEPLOYMENT,
-            messages=[
+        chunks_used = [
+            {"file_name": h.get("file_name"), "chunk_id": h.get("chunk_id"), "file_id": h.get("file_id")}
+            for h in hits
+        ]
+        emit("retrieval", {"source": "userdocs", "chunks": chunks_used})
+
+        request = {
+            "model": settings.AZURE_OPENAI_CHAT_DEPLOYMENT,
+            "messages": [
                 {"role": "system", "content": system},
                 {"role": "user", "content": user},
             ],
-            temperature=0.2,
-        )
-
-        return {
-            "answer": resp.choices[0].message.content,
-            "chunks_used": [
-                {"file_name": h.get("file_name"), "chunk_id": h.get("chunk_id"), "file_id": h.get("file_id")}
-                for h in hits
-            ],
+            "temperature": 0.2,
         }
+        return request, chunks_used
 
     def answer_per_document(self, question: str, user_id: str, session_id: str) -> dict:
-        qvec = self.embedder.embed(question)
-        files = self.indexer.list_session_files(user_id=user_id, session_id=session_id)
+        files = self._session_files(user_id, session_id)
         if not files:
             return {"answer": "No encuentro documentos indexados en esta sesión.", "chunks_used": []}
-        per_doc_hits = []
-        grouped_context_parts = []
 
-        for f in files:
-            fid = f["file_id"]
-            fname = f["file_name"]
+        # Archivos con resumen de ingesta (manifiesto): van directo al contexto.
+        # Solo los que aún no lo tienen (pendiente, fallido o sesión antigua) se buscan.
+        pending = [f for f in files if not has_summary(f)]
+        qvec = self.embedder.embed(question) if pending else None
 
-            hits = self.indexer.hybrid_search_by_file(
+        def _search(f: dict) -> list[dict]:
+            return self.indexer.hybrid_search_by_file(
                 question=question,
                 query_vector=qvec,
                 user_id=user_id,
                 session_id=session_id,
-                file_id=fid,
+                file_id=f["file_id"],
                 top_k=4
             )
+
+        # Una búsqueda por archivo, en paralelo (máx. RAG_PER_FILE_SEARCH_CONCURRENCY)
+        searched = dict(zip(
+            (f["file_id"] for f in pending),
+            self._search_pool.map(_search, pending),
+        ))
+        request, chunks_used = self._per_document_request(question, files, searched)
+        return {"answer": complete_chat(self.chat, **request), "chunks_used": chunks_used}
+
+    async def aanswer_per_document(self, question: str, user_id: str, session_id: str) -> dict:
+        files = await self._asession_files(user_id, session_id)
+        if not files:
+            return {"answer": "No encuentro documentos indexados en esta sesión.", "chunks_used": []}
+
+        pending = [f for f in files if not has_summary(f)]
+        qvec = await self.embedder.aembed(question) if pending else None
+
+        async def _search(f: dict) -> list[dict]:
+            async with self._file_search_sem:
+                return await self.indexer.ahybrid_search_by_file(
+                    question=question,
+                    query_vector=qvec,
+                    user_id=user_id,
+                    session_id=session_id,
+                    file_id=f["file_id"],
+                    top_k=4
+                )
+
+        results = await asyncio.gather(*(_search(f) for f in pending))
+        searched = dict(zip((f["file_id"] for f in pending), results))
+        request, chunks_used = self._per_document_request(question, files, searched)
+        return {"answer": await acomplete_chat(self.achat, **request), "chunks_used": chunks_used}
+
+    def _per_document_request(
+        self,
+        question: str,
+        files: list[dict],
+        searched: dict[str, list[dict]],
+    ) -> tuple[dict, list[dict]]:
+        per_doc_hits = []
+        grouped_context_parts = []
+
+        # el contexto conserva el orden de los archivos
+        for f in files:
+            if has_summary(f):
+                grouped_context_parts.append(format_summary(f))
+                continue
+            fname = f["file_name"]
+            hits = searched.get(f["file_id"]) or []
             if not hits:
                 grouped_context_parts.append(f"### {fname}\n- (Sin evidencia recuperada)")
                 continue
@@ -93,6 +192,11 @@ class RAGService:
             grouped_context_parts.append(f"### {fname}\n" + "\n".join(bullets))
 
         context = "\n\n".join(grouped_context_parts).strip()
+        n_summaries = len(files) - len(searched)
+        logging.info(
+            f"answer_per_document: {n_summaries} archivos desde resumen, "
+            f"{len(searched)} con búsqueda"
+        )
 
         system = (
             "El usuario subió varios documentos. "
@@ -104,46 +208,132 @@ class RAGService:
         )
 
         user = f"CONTEXTO (por documento):\n{context}\n\nPREGUNTA:\n{question}"
-        resp = self.chat.chat.completions.create(
-            model=settings.AZURE_OPENAI_CHAT_DEPLOYMENT,
-            messages=[
+
+        chunks_used = [
+            {"file_name": h.get("file_name"), "chunk_id": h.get("chunk_id"), "file_id": h.get("file_id")}
+            for h in per_doc_hits
+        ]
+        emit("retrieval", {"source": "userdocs", "chunks": chunks_used, "summaries": n_summaries})
+
+        request = {
+            "model": settings.AZURE_OPENAI_CHAT_DEPLOYMENT,
+            "messages": [
                 {"role": "system", "content": system},
                 {"role": "user", "content": user},
             ],
-            temperature=0.2,
-        )
-
-        return {
-            "answer": resp.choices[0].message.content,
-            "chunks_used": [
-                {"file_name": h.get("file_name"), "chunk_id": h.get("chunk_id"), "file_id": h.get("file_id")}
-                for h in per_doc_hits
-            ],
+            "temperature": 0.2,
         }
+        return request, chunks_used
+
+    def _session_files(self, user_id: str, session_id: str) -> list[dict]:
+        """
+        Archivos de la sesión desde el manifiesto (una lectura puntual).
+        Sesiones sin manifiesto -> se deduplican los chunks del índice.
+        """
+        files = self.manifest.files(user_id, session_id) if self.manifest else None
+        if files is None:
+            files = self.indexer.list_session_files(user_id=user_id, session_id=session_id)
+        return files
+
+    async def _asession_files(self, user_id: str, session_id: str) -> list[dict]:
+        # el cliente de Cosmos es sync: la lectura puntual va a un hilo (breve)
+        files = await asyncio.to_thread(self.manifest.files, user_id, session_id) if self.manifest else None
+        if files is None:
+            files = await self.indexer.alist_session_files(user_id=user_id, session_id=session_id)
+        return files
 
 class RAGFabricService:
-    def __init__(self, embedder: EmbeddingService, indexer: FabricSearchIndexer) -> None:
+    def __init__(
+        self,
+        embedder: EmbeddingService,
+        indexer: FabricSearchIndexer,
+        answer_cache: SemanticAnswerCache | None = None,
+        packer: ContextPacker | None = None,
+    ) -> None:
         self.embedder = embedder
         self.indexer = indexer
+        self.packer = packer or ContextPacker()
+        # preguntas casi iguales sobre el corpus -> misma respuesta sin search ni LLM
+        self.answer_cache = answer_cache
         self.chat = AzureOpenAI(
             api_key=settings.AZURE_OPENAI_KEY,
             azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
             api_version=settings.AZURE_OPENAI_OPENAI_VERSION,
         )
+        self.achat = AsyncAzureOpenAI(
+            api_key=settings.AZURE_OPENAI_KEY,
+            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+            api_version=settings.AZURE_OPENAI_OPENAI_VERSION,
+        )
 
     def answer(self, question: str, top_k: int = 10) -> dict:
+        t0 = time.perf_counter()
         qvec = self.embedder.embed(question)
 
+        version = self._index_version() if self.answer_cache else None
+        cached = self._cached(qvec, question, version, top_k)
+        if cached is not None:
+            return cached
+
         hits = self.indexer.hybrid_search(
             question=question,
             query_vector=qvec,
             top_k=top_k
         )
+        request, chunks_used = self._answer_request(question, hits)
+        result = {"answer": complete_chat(self.chat, **request), "chunks_used": chunks_used}
+        if version is not None:
+            self.answer_cache.put(qvec, question, result, version, top_k, (time.perf_counter() - t0) * 1000)
+        return result
 
-        context = "\n\n".join(
-            f"[{h.get('tipo_documento','')} | {h.get('ACTOR','')} | chunk {h.get('chunk_order')}] {h.get('texto','')}"
-            for h in hits
-        ).strip()
+    async def aanswer(self, question: str, top_k: int = 10) -> dict:
+        """answer sin bloquear el loop (AsyncAzureOpenAI + búsqueda async)."""
+        t0 = time.perf_counter()
+        qvec = await self.embedder.aembed(question)
+
+        # index_version casi siempre sale de memoria; cuando vence consulta estadísticas (sync)
+        version = await asyncio.to_thread(self._index_version) if self.answer_cache else None
+        cached = self._cached(qvec, question, version, top_k)
+        if cached is not None:
+            return cached
+
+        hits = await self.indexer.ahybrid_search(
+            question=question,
+            query_vector=qvec,
+            top_k=top_k
+        )
+        request, chunks_used = self._answer_request(question, hits)
+        result = {"answer": await acomplete_chat(self.achat, **request), "chunks_used": chunks_used}
+        if version is not None:
+            self.answer_cache.put(qvec, question, result, version, top_k, (time.perf_counter() - t0) * 1000)
+        return result
+
+    def _index_version(self):
+        try:
+            return self.indexer.index_version()
+        except Exception:
+            # sin versión no se puede garantizar frescura: se omite la caché
+            logging.exception("No se pudo obtener la versión del índice del corpus")
+            return None
+
+    def _cached(self, qvec: list[float], question: str, version, top_k: int):
+        if version is None:
+            return None
+        cached = self.answer_cache.lookup(qvec, question, version, top_k)
+        if cached is not None:
+            logging.info(f"Caché de respuestas del corpus: {self.answer_cache.stats()}")
+            emit("retrieval", {"source": "corpus", "chunks": cached.get("chunks_used", []), "cache": True})
+            emit("token", {"text": cached.get("answer") or ""})
+        return cached
+
+    def _answer_request(self, question: str, hits: list[dict]) -> tuple[dict, list[dict]]:
+        # el corpus no trae un id de documento para unir chunks: solo presupuesto y duplicados
+        context, hits = self.packer.pack(
+            hits,
+            text_field="texto",
+            order_field="chunk_order",
+            label=lambda h, a, b: f"[{h.get('tipo_documento','')} | {h.get('ACTOR','')} | chunk {a}]",
+        )
 
         system = (
             "Responde SOLO con base en el CONTEXTO (CORPUS). No inventes. "
@@ -152,19 +342,15 @@ class RAGFabricService:
 
         user = f"CONTEXTO:\n{context}\n\nPREGUNTA:\n{question}"
 
-        resp = self.chat.chat.completions.create(
-            model=settings.AZURE_OPENAI_CHAT_DEPLOYMENT,
-            messages=[
+        chunks_used = [{"id": h.get("id"), "chunk_order": h.get("chunk_order")} for h in hits]
+        emit("retrieval", {"source": "corpus", "chunks": chunks_used})
+
+        request = {
+            "model": settings.AZURE_OPENAI_CHAT_DEPLOYMENT,
+            "messages": [
                 {"role": "system", "content": system},
                 {"role": "user", "content": user},
             ],
-            temperature=0.2,
-        )
-
-        return {
-            "answer": resp.choices[0].message.content,
-            "chunks_used": [
-                {"id": h.get("id"), "chunk_order": h.get("chunk_order")}
-                for h in hits
-            ],
-        }
\ No newline at end of file
+            "temperature": 0.2,
+        }
+        return request, chunks_used
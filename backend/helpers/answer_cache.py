@@ -0,0 +1,133 @@
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+
+
+# números e identificadores (radicados, "T-123", "ley 1437 de 2011"): dos
+# preguntas casi idénticas que difieren en uno de ellos piden cosas distintas
+_KEY_TOKEN = re.compile(r"\b(?:[a-z]{1,4}-)?\d[\w./-]*")
+
+class SemanticAnswerCache:
+    """
+    Caché de respuestas por similitud semántica de la pregunta (corpus):
+    - acierto si el coseno con una pregunta ya respondida >= threshold y
+      sus números/identificadores coinciden exactamente (el embedding casi
+      no distingue un radicado ...0123 de ...0124)
+    - cada entrada queda atada a la versión del índice y al top_k; si la
+      versión cambia (índice refrescado) se vacía la caché
+    - LRU con máximo de entradas + TTL
+    - métricas: hits, misses, hit_rate y latencia ahorrada
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000, ttl_seconds: float = 86400) -> None:
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version: Optional[str] = None
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        self._next_id = 0
+        # matriz de vectores normalizados alineada con _ids (se rearma al cambiar)
+        self._matrix: Optional[np.ndarray] = None
+        self._ids: list[int] = []
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "saved_ms": 0.0}
+
+    @staticmethod
+    def _normalize(vector: list[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    @staticmethod
+    def _normalize_question(question: str) -> str:
+        text = unicodedata.normalize("NFKD", question or "")
+        text = "".join(c for c in text if not unicodedata.combining(c))
+        return " ".join(text.lower().split())
+
+    @staticmethod
+    def _key_tokens(normalized: str) -> tuple[str, ...]:
+        return tuple(t.rstrip("./-") for t in _KEY_TOKEN.findall(normalized))
+
+    def _check_version(self, version: str) -> None:
+        # dentro del lock
+        if version != self.version:
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self._entries.clear()
+            self._matrix = None
+            self._ids = []
+            self.version = version
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._ids = []
+            self._stats["invalidations"] += 1
+
+    def lookup(self, vector: list[float], question: str, version: str, top_k: int) -> Optional[dict]:
+        q = self._normalize(vector)
+        keys = self._key_tokens(self._normalize_question(question))
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            self._purge_expired(now)
+            if self._entries:
+                if self._matrix is None:
+                    self._ids = list(self._entries.keys())
+                    self._matrix = np.vstack([self._entries[i]["vector"] for i in self._ids])
+                if self._matrix.shape[1] == q.shape[0]:
+                    sims = self._matrix @ q
+                    for idx in np.argsort(-sims):
+                        if sims[idx] < self.threshold:
+                            break
+                        entry = self._entries[self._ids[idx]]
+                        if entry["top_k"] != top_k or entry["keys"] != keys:
+                            continue
+                        self._entries.move_to_end(self._ids[idx])
+                        self._stats["hits"] += 1
+                        self._stats["saved_ms"] += entry["elapsed_ms"]
+                        return dict(entry["result"], cache={"hit": True, "similarity": round(float(sims[idx]), 4)})
+            self._stats["misses"] += 1
+        return None
+
+    def put(
+        self, vector: list[float], question: str, result: dict, version: str, top_k: int, elapsed_ms: float
+    ) -> None:
+        normalized = self._normalize_question(question)
+        with self._lock:
+            self._check_version(version)
+            self._entries[self._next_id] = {
+                "vector": self._normalize(vector),
+                "question": normalized,
+                "keys": self._key_tokens(normalized),
+                "result": result,
+                "top_k": top_k,
+                "elapsed_ms": elapsed_ms,
+                "expires": time.monotonic() + self.ttl_seconds,
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def _purge_expired(self, now: float) -> None:
+        expired = [k for k, e in self._entries.items() if e["expires"] <= now]
+        for k in expired:
+            del self._entries[k]
+        if expired:
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["version"] = self.version
+        looked_up = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / looked_up, 4) if looked_up else 0.0
+        stats["saved_ms"] = round(stats["saved_ms"], 1)
+        return stats
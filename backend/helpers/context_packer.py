@@ -0,0 +1,151 @@
+from typing import Callable, Optional
+import tiktoken
+from app.config import settings
+
+
+class ContextPacker:
+    """
+    Arma el CONTEXTO de los prompts RAG dentro de un presupuesto de tokens:
+    - une chunks consecutivos (chunk_id) del mismo archivo en un solo bloque
+      y quita el texto repetido por el overlap del Chunker
+    - ordena los bloques por el mejor ranking de sus hits
+    - agrega bloques hasta llenar max_tokens (el último se recorta si cabe
+      al menos min_block_tokens)
+    Devuelve (contexto, hits usados).
+    """
+
+    def __init__(self, max_tokens: int | None = None, min_block_tokens: int = 80) -> None:
+        self.max_tokens = max_tokens or settings.CONTEXT_MAX_TOKENS
+        self.min_block_tokens = min_block_tokens
+        self.enc = tiktoken.get_encoding("cl100k_base")
+
+    # ------------------------------------------------------------
+    # Overlap entre chunks consecutivos
+    # ------------------------------------------------------------
+    @staticmethod
+    def strip_overlap(prev: str, nxt: str, probe: int = 48, window: int = 4000) -> str | None:
+        """
+        Si `nxt` empieza con el final de `prev` (overlap del Chunker),
+        devuelve la continuación de `prev` sin la parte repetida; si no hay
+        overlap, None.
+        """
+        if not prev or not nxt:
+            return None
+        tail = prev[-window:]
+        head = nxt[:probe]
+        pos = tail.find(head)
+        while pos != -1:
+            rest = tail[pos:]
+            if nxt.startswith(rest):
+                return nxt[len(rest):]
+            pos = tail.find(head, pos + 1)
+        return None
+
+    # ------------------------------------------------------------
+    # Empaquetado
+    # ------------------------------------------------------------
+    def _blocks(
+        self,
+        hits: list[dict],
+        text_field: str,
+        group_field: Optional[str],
+        order_field: Optional[str],
+    ) -> list[dict]:
+        """Bloques {rank, hits, text, first, last} en orden de ranking."""
+        if not group_field or not order_field:
+            seen = set()
+            blocks = []
+            for rank, h in enumerate(hits):
+                text = (h.get(text_field) or "").strip()
+                if not text or text in seen:
+                    continue
+                seen.add(text)
+                order = h.get(order_field) if order_field else None
+                blocks.append({"rank": rank, "hits": [h], "text": text, "first": order, "last": order})
+            return blocks
+
+        best_rank: dict[tuple, int] = {}
+        by_group: dict = {}
+        for rank, h in enumerate(hits):
+            key = (h.get(group_field), h.get(order_field))
+            if key in best_rank:
+                continue  # mismo chunk repetido
+            best_rank[key] = rank
+            by_group.setdefault(h.get(group_field), []).append(h)
+
+        blocks = []
+        for group_hits in by_group.values():
+            group_hits.sort(key=lambda h: h.get(order_field) if h.get(order_field) is not None else -1)
+            run: list[dict] = []
+            for h in group_hits:
+                if run and (
+                    h.get(order_field) is None
+                    or run[-1].get(order_field) is None
+                    or h.get(order_field) != run[-1].get(order_field) + 1
+                ):
+                    blocks.append(self._merge_run(run, text_field, group_field, order_field, best_rank))
+                    run = []
+                run.append(h)
+            if run:
+                blocks.append(self._merge_run(run, text_field, group_field, order_field, best_rank))
+
+        blocks.sort(key=lambda b: b["rank"])
+        return [b for b in blocks if b["text"]]
+
+    def _merge_run(self, run, text_field, group_field, order_field, best_rank) -> dict:
+        text = (run[0].get(text_field) or "").strip()
+        for h in run[1:]:
+            nxt = (h.get(text_field) or "").strip()
+            rest = self.strip_overlap(text, nxt)
+            # con overlap el texto continúa tal cual; sin él, se separa con salto de línea
+            text = text + rest if rest is not None else f"{text}\n{nxt}"
+        text = text.strip()
+        return {
+            "rank": min(best_rank[(h.get(group_field), h.get(order_field))] for h in run),
+            "hits": run,
+            "text": text,
+            "first": run[0].get(order_field),
+            "last": run[-1].get(order_field),
+        }
+
+    def pack(
+        self,
+        hits: list[dict],
+        *,
+        text_field: str,
+        label: Callable[[dict, object, object], str],
+        group_field: Optional[str] = None,
+        order_field: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+    ) -> tuple[str, list[dict]]:
+        """
+        `label(primer_hit, primer_orden, último_orden)` arma la cita del bloque,
+        p. ej. "[archivo.pdf | chunks 3-5]".
+        """
+        budget = max_tokens or self.max_tokens
+        parts: list[str] = []
+        used: list[dict] = []
+        for block in self._blocks(hits, text_field, group_field, order_field):
+            header = label(block["hits"][0], block["first"], block["last"])
+            cost = len(self.enc.encode(f"{header} ")) + 2  # + separador
+            remaining = budget - cost
+            if remaining < self.min_block_tokens:
+                break
+            tokens = self.enc.encode(block["text"])
+            if len(tokens) > remaining:
+                text = self.enc.decode(tokens[:remaining]).strip()
+                budget = 0
+            else:
+                text = block["text"]
+                budget -= cost + len(tokens)
+            parts.append(f"{header} {text}")
+            used.extend(block["hits"])
+            if budget <= 0:
+                break
+        return "\n\n".join(parts).strip(), used
+
+
+def chunk_label(name: str, first, last) -> str:
+    if first == last:
+        return f"[{name} | chunk {first}]"
+    return f"[{name} | chunks {first}-{last}]"
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+from typing import Optional
+import tiktoken
+from openai import AsyncAzureOpenAI
+from app.config import settings
+from helpers.prompts import system_prompt_memoria
+from helpers.rate_limit import llm_limiter
+
+# Máx. turnos plegados por patch (Cosmos: 10 operaciones, 3 son de campos)
+_MAX_FOLD = 7
+
+
+class ConversationMemory:
+    """
+    Memoria de conversación por sesión, guardada en la sesión (campo "memory"):
+    {
+      "summary": "<resumen acumulado de los turnos antiguos>",
+      "summarized_turns": <turnos ya plegados en el resumen>,
+      "recent": [{"q", "a", "at"}, ...],   # últimos turnos literales (recortados)
+      "updated_at": "..."
+    }
+    - append(): agrega el turno con un patch puntual, en el mismo request
+    - afold(): cuando recent supera MEMORY_RECENT_TURNS, pliega los más
+      antiguos en el resumen (LLM), en segundo plano
+    - history(): historial para el prompt dentro de MEMORY_HISTORY_MAX_TOKENS
+      (resumen + turnos más recientes que quepan)
+    Sesiones anteriores a la memoria: se siembra desde los mensajes en el
+    primer turno y, mientras tanto, history() usa los mensajes recortados.
+    """
+
+    def __init__(
+        self,
+        cosmosdb,
+        recent_turns: int | None = None,
+        turn_max_tokens: int | None = None,
+        summary_max_tokens: int | None = None,
+        history_max_tokens: int | None = None,
+    ) -> None:
+        self.cosmosdb = cosmosdb
+        self.recent_turns = recent_turns or settings.MEMORY_RECENT_TURNS
+        self.turn_max_tokens = turn_max_tokens or settings.MEMORY_TURN_MAX_TOKENS
+        self.summary_max_tokens = summary_max_tokens or settings.MEMORY_SUMMARY_MAX_TOKENS
+        self.history_max_tokens = history_max_tokens or settings.MEMORY_HISTORY_MAX_TOKENS
+        self.enc = tiktoken.get_encoding("cl100k_base")
+        self.achat = AsyncAzureOpenAI(
+            api_key=settings.AZURE_OPENAI_KEY,
+            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+            api_version=settings.AZURE_OPENAI_OPENAI_VERSION,
+        )
+        # sesiones con un plegado en curso en este proceso (entre réplicas decide el filtro de Cosmos)
+        self._folding: set[str] = set()
+
+    # ------------------------------------------------------------
+    # Tokens
+    # ------------------------------------------------------------
+    def _tokens(self, text: str) -> int:
+        return len(self.enc.encode(text or ""))
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.enc.encode(text or "")
+        if len(tokens) <= max_tokens:
+            return text or ""
+        return self.enc.decode(tokens[:max_tokens]).rstrip() + " [...]"
+
+    def _turn(self, user_question: str, ia_response: str, at: Optional[str] = None) -> dict:
+        return {
+            "q": self._truncate(user_question, self.turn_max_tokens),
+            "a": self._truncate(ia_response, self.turn_max_tokens),
+            "at": at or self.cosmosdb.function._utc_iso(),
+        }
+
+    # ------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------
+    def append(self, session_id: str, user_question: str, ia_response: str) -> bool:
+        """
+        Agrega el turno (ya guardado como mensaje) a la memoria.
+        Devuelve True si hay turnos para plegar (programar afold).
+        """
+        session = self.cosmosdb.get_session(session_id)
+        if session is None:
+            return False
+        if "memory" not in session:
+            memory = self._seed(session_id)
+            if self.cosmosdb.init_session_memory(session_id, memory):
+                return len(memory["recent"]) > self.recent_turns
+        session = self.cosmosdb.append_session_turn(session_id, self._turn(user_question, ia_response))
+        return len((session.get("memory") or {}).get("recent", [])) > self.recent_turns
+
+    def _seed(self, session_id: str) -> dict:
+        # incluye el mensaje recién guardado; los turnos de más se pliegan después
+        messages = self.cosmosdb.get_session_messages(session_id) or []
+        recent = [
+            self._turn(m.get("UserQuestion", ""), m.get("IAResponse", ""), m.get("created_at"))
+            for m in messages[-(self.recent_turns + _MAX_FOLD):]
+        ]
+        return {
+            "summary": "",
+            "summarized_turns": max(0, len(messages) - len(recent)),
+            "recent": recent,
+            "updated_at": self.cosmosdb.function._utc_iso(),
+        }
+
+    async def afold(self, session_id: str) -> bool:
+        """Pliega en el resumen los turnos que exceden MEMORY_RECENT_TURNS."""
+        if session_id in self._folding:
+            return False
+        self._folding.add(session_id)
+        try:
+            session = await asyncio.to_thread(self.cosmosdb.get_session, session_id)
+            memory = (session or {}).get("memory") or {}
+            recent = memory.get("recent", [])
+            folded = min(len(recent) - self.recent_turns, _MAX_FOLD)
+            if folded <= 0:
+                return False
+            summary = await self._summarize(memory.get("summary", ""), recent[:folded])
+            ok = await asyncio.to_thread(
+                self.cosmosdb.fold_session_memory,
+                session_id,
+                summary,
+                memory.get("summarized_turns", 0),
+                folded,
+            )
+            logging.info(f"Memoria de {session_id}: {folded} turnos plegados en el resumen (ok={ok})")
+            return ok
+        except Exception:
+            # la memoria es best effort: el turno ya quedó guardado como mensaje
+            logging.exception(f"No se pudo actualizar la memoria de la sesión {session_id}")
+            return False
+        finally:
+            self._folding.discard(session_id)
+
+    async def _summarize(self, summary: str, turns: list[dict]) -> str:
+        texto_turnos = "\n".join(f"<usuario>: {t.get('q', '')}\n<asistente>: {t.get('a', '')}" for t in turns)
+        # llamada directa (no complete_chat): el plegado no debe emitir tokens al stream del request
+        async with llm_limiter:
+            resp = await self.achat.chat.completions.create(
+                model=settings.AZURE_OPENAI_CHAT_DEPLOYMENT,
+                messages=[
+                    {"role": "system", "content": system_prompt_memoria},
+                    {"role": "user", "content": f"RESUMEN ACTUAL:\n{summary or '(vacío)'}\n\nTURNOS:\n{texto_turnos}"},
+                ],
+                temperature=0.0,
+                max_tokens=self.summary_max_tokens,
+            )
+        return (resp.choices[0].message.content or "").strip() or summary
+
+    # ------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------
+    def history(self, session_id: str) -> str:
+        """Historial para el prompt (una lectura puntual de la sesión)."""
+        session = self.cosmosdb.get_session(session_id) or {}
+        memory = session.get("memory")
+        if memory is None and session:
+            # sesión anterior a la memoria: mensajes recortados con el mismo presupuesto
+            messages = (self.cosmosdb.get_session_messages(session_id) or [])[-20:]
+            memory = {
+                "recent": [self._turn(m.get("UserQuestion", ""), m.get("IAResponse", ""), "") for m in messages],
+            }
+        return self.render(memory or {})
+
+    def render(self, memory: dict) -> str:
+        """Resumen + turnos más recientes, hasta MEMORY_HISTORY_MAX_TOKENS."""
+        budget = self.history_max_tokens
+        head = ""
+        summary = (memory.get("summary") or "").strip()
+        if summary:
+            head = "Resumen de la conversación anterior:\n"
+            head += self._truncate(summary, min(self.summary_max_tokens, budget)) + "\n\n"
+            budget -= self._tokens(head)
+
+        turns: list[str] = []
+        for t in reversed(memory.get("recent", [])):
+            block = f"<usuario>: {t.get('q', '')}\n<asistente>: {t.get('a', '')}\n"
+            n = self._tokens(block)
+            if n > budget:
+                break
+            turns.append(block)
+            budget -= n
+        return head + "".join(reversed(turns))
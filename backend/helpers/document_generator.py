@@ -3,6 +3,7 @@ from docx import Document
 from docx.shared import Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 import json
+from helpers.context_packer import ContextPacker, chunk_label
 
 class DocxTemplateBuilder:
     def __init__(self, template_path: str):
@@ -95,15 +96,73 @@ class DocxTemplateBuilder:
 
 
 import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Dict, Any, List, Optional
+from app.config import settings
+from helpers.prompts import build_prompt
+
+
+# Secciones del template generadas por separado (modo "sections").
+# consulta = qué buscar para esa sección (se suma a las instrucciones del usuario)
+SECCIONES_NARRATIVAS: List[Dict[str, str]] = [
+    {
+        "key": "introduccion",
+        "titulo": "INTRODUCCIÓN",
+        "consulta": "objeto de la decisión, tipo de actuación, autoridades involucradas",
+        "descripcion": "Un párrafo breve que presente el asunto que se decide.",
+    },
+    {
+        "key": "antecedentes",
+        "titulo": "ANTECEDENTES",
+        "consulta": "hechos, demanda, pretensiones, antecedentes del caso",
+        "descripcion": "Hechos relevantes y pretensiones, en orden cronológico.",
+    },
+    {
+        "key": "actuacion_procesal",
+        "titulo": "ACTUACIÓN PROCESAL",
+        "consulta": "trámite procesal, autos, remisiones, fechas de las actuaciones",
+        "descripcion": "Trámite surtido: autos, remisiones y decisiones previas, con sus fechas.",
+    },
+    {
+        "key": "argumentos_partes",
+        "titulo": "ARGUMENTOS DE LAS PARTES",
+        "consulta": "argumentos, alegatos, posición de las partes, intervenciones",
+        "descripcion": "Posición y argumentos de cada parte e interviniente.",
+    },
+    {
+        "key": "consideraciones",
+        "titulo": "CONSIDERACIONES",
+        "consulta": "competencia, problema jurídico, fundamentos normativos, análisis del caso",
+        "descripcion": "Competencia, problema jurídico y análisis que sustenta la decisión.",
+    },
+    {
+        "key": "recomendaciones_agente",
+        "titulo": "RECOMENDACIONES",
+        "consulta": "aspectos pendientes, pruebas faltantes, riesgos procesales",
+        "descripcion": "Recomendaciones breves para quien revisa el proyecto.",
+    },
+]
+# Campos cortos del encabezado: una sola llamada con JSON pequeño
+CAMPOS_ENCABEZADO = ["ciudad_fecha", "consejero_ponente", "numero_unico", "referencia", "partes", "asunto"]
+CONSULTA_ENCABEZADO = "radicado, número único, referencia, partes, demandante, demandado, magistrado ponente, asunto"
+CONSULTA_RESUELVE = "decisión, resuelve, declara, ordena, remite, competencia asignada"
+SECCION_FALLIDA = "No fue posible generar esta sección."
 
 
 class DocumentGeneratorService:
     """
     Genera un DOCX (bytes) usando:
     - Retrieval (userdocs o corpus)
-    - LLM -> JSON estructurado según template
+    - LLM -> contenido según template
     - Builder -> rellena plantilla DOCX con placeholders
+
+    Modos (DOC_GEN_MODE):
+    - "sections" (por defecto): cada sección hace su retrieval y su llamada
+      al LLM en paralelo, con un prompt enfocado; una sección fallida se
+      reintenta sola. El tiempo total se acerca al de la sección más lenta.
+    - "single": un solo JSON con todas las secciones (modo anterior).
     """
 
     def __init__(
@@ -116,14 +175,30 @@ class DocumentGeneratorService:
         *,
         top_k_userdocs: int = 12,
         top_k_corpus: int = 12,
+        embedder_corpus=None,
+        manifest=None,
+        mode: Optional[str] = None,
+        max_workers: Optional[int] = None,
     ):
         self.llm_chat = llm_chat
         self.embedder = embedder
+        # embedder con la dimensión del índice del corpus (si difiere)
+        self.embedder_corpus = embedder_corpus or embedder
+        # manifiesto de archivos por sesión (SessionManifest)
+        self.manifest = manifest
+        self.packer = ContextPacker()
         self.indexer_userdocs = indexer_userdocs
         self.indexer_corpus = indexer_corpus
         self.docx_builder = docx_builder
         self.top_k_userdocs = top_k_userdocs
         self.top_k_corpus = top_k_corpus
+        self.mode = mode or settings.DOC_GEN_MODE
+        self.section_retries = settings.DOC_GEN_SECTION_RETRIES
+        self.section_context_tokens = settings.DOC_GEN_SECTION_CONTEXT_TOKENS
+        self._section_pool = ThreadPoolExecutor(
+            max_workers=max_workers or settings.DOC_GEN_SECTION_CONCURRENCY,
+            thread_name_prefix="doc-section",
+        )
 
     def _build_resuelve_text(self, items: List[Dict[str, Any]]) -> str:
         """
@@ -167,11 +242,14 @@ class DocumentGeneratorService:
         Si existen docs en sesión => userdocs, si no => corpus.
         """
         try:
-            files = self.indexer_userdocs.list_session_files(user_id=user_id, session_id=session_id)
+            files = self.manifest.files(user_id, session_id) if self.manifest else None
+            if files is None:
+                # sesión sin manifiesto (anterior a él): se consulta el índice
+                files = self.indexer_userdocs.list_session_files(user_id=user_id, session_id=session_id)
             if files:
                 return "userdocs"
         except Exception:
-            # si falla list_session_files, no bloqueamos generación
+            # si falla la consulta de archivos, no bloqueamos generación
             pass
         return "corpus"
 
@@ -182,15 +260,15 @@ class DocumentGeneratorService:
         user_id: str,
         session_id: str,
         source: str,
+        max_tokens: Optional[int] = None,
     ) -> Tuple[str, List[Dict[str, Any]]]:
         """
         Devuelve:
         - context_str (con citas doc|chunk)
         - hits (para trazabilidad)
         """
-        qvec = self.embedder.embed(instrucciones)
-
         if source == "userdocs":
+            qvec = self.embedder.embed(instrucciones)
             hits = self.indexer_userdocs.hybrid_search(
                 question=instrucciones,
                 query_vector=qvec,
@@ -198,24 +276,30 @@ class DocumentGeneratorService:
                 session_id=session_id,
                 top_k=self.top_k_userdocs,
             )
-            parts = []
-            for h in hits:
-                parts.append(
-                    f"[{h.get('file_name')}|chunk {h.get('chunk_id')}] {h.get('content','')}"
-                )
-            return "\n\n".join(parts).strip(), hits
+            return self.packer.pack(
+                hits,
+                text_field="content",
+                group_field="file_id",
+                order_field="chunk_id",
+                label=lambda h, a, b: chunk_label(h.get("file_name"), a, b),
+                max_tokens=max_tokens,
+            )
 
         # corpus
+        qvec = self.embedder_corpus.embed(instrucciones)
         hits = self.indexer_corpus.hybrid_search(
             question=instrucciones,
             query_vector=qvec,
             top_k=self.top_k_corpus,
         )
-        parts = []
-        for h in hits:
-            # en tu corpus el texto se llama "texto" y el id de chunk es "chunk_order"
-            parts.append(f"[CORPUS|chunk {h.get('chunk_order','')}] {h.get('texto','')}")
-        return "\n\n".join(parts).strip(), hits
+        # en tu corpus el texto se llama "texto" y el id de chunk es "chunk_order"
+        return self.packer.pack(
+            hits,
+            text_field="texto",
+            order_field="chunk_order",
+            label=lambda h, a, b: f"[CORPUS | chunk {a}]",
+            max_tokens=max_tokens,
+        )
 
     def _build_prompt(self, *, context: str, instrucciones: str) -> str:
         """
@@ -255,6 +339,196 @@ INSTRUCCIONES:
 {instrucciones}
 """.strip()
 
+    def _fuentes(self, hits: List[Dict[str, Any]], source: str) -> List[Dict[str, str]]:
+        fuentes = []
+        for h in hits[:8]:
+            if source == "userdocs":
+                fuentes.append({"doc": h.get("file_name", ""), "chunk": str(h.get("chunk_id", ""))})
+            else:
+                fuentes.append({"doc": "CORPUS", "chunk": str(h.get("chunk_order", ""))})
+        return fuentes
+
+    # --------------------------
+    # Generación por secciones
+    # --------------------------
+    def _build_encabezado_prompt(self, *, context: str, instrucciones: str) -> str:
+        esquema = json.dumps({k: "" for k in CAMPOS_ENCABEZADO}, ensure_ascii=False, indent=2)
+        return f"""
+Devuelve SOLO JSON válido (sin texto extra, sin markdown, sin comillas triples).
+Usa SOLO el CONTEXTO. Si falta un dato, deja el campo vacío.
+
+ESQUEMA:
+{esquema}
+
+CONTEXTO:
+{context}
+
+INSTRUCCIONES:
+{instrucciones}
+""".strip()
+
+    def _build_resuelve_prompt(self, *, context: str, instrucciones: str) -> str:
+        return f"""
+Devuelve SOLO JSON válido (sin texto extra, sin markdown, sin comillas triples).
+Redacta la parte RESOLUTIVA de la providencia usando SOLO el CONTEXTO.
+Cada numeral es una orden concreta; no repitas las consideraciones.
+
+ESQUEMA:
+{{
+  "resuelve": [
+    {{"ordinal": "PRIMERO", "texto": ""}},
+    {{"ordinal": "SEGUNDO", "texto": ""}}
+  ]
+}}
+
+CONTEXTO:
+{context}
+
+INSTRUCCIONES:
+{instrucciones}
+""".strip()
+
+    def _generate_section(
+        self,
+        key: str,
+        *,
+        instrucciones: str,
+        user_id: str,
+        session_id: str,
+        source: str,
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Retrieval + LLM de una sección. Devuelve (campos del payload, hits).
+        Lanza ValueError si el modelo no devuelve contenido utilizable.
+        """
+        narrativa = next((sec for sec in SECCIONES_NARRATIVAS if sec["key"] == key), None)
+        if narrativa:
+            consulta = narrativa["consulta"]
+        elif key == "encabezado":
+            consulta = CONSULTA_ENCABEZADO
+        else:
+            consulta = CONSULTA_RESUELVE
+
+        context, hits = self._retrieve_context(
+            instrucciones=f"{instrucciones}\n{consulta}",
+            user_id=user_id,
+            session_id=session_id,
+            source=source,
+            max_tokens=self.section_context_tokens,
+        )
+
+        if narrativa:
+            prompt = build_prompt(
+                f"{narrativa['titulo']}: {narrativa['descripcion']}\n\nINSTRUCCIONES DEL USUARIO:\n{instrucciones}",
+                context,
+            )
+        elif key == "encabezado":
+            prompt = self._build_encabezado_prompt(context=context, instrucciones=instrucciones)
+        else:
+            prompt = self._build_resuelve_prompt(context=context, instrucciones=instrucciones)
+
+        resp = self.llm_chat.invoke(prompt)
+        raw = (getattr(resp, "content", None) or str(resp)).strip()
+
+        if narrativa:
+            if not raw:
+                raise ValueError(f"Sección {key} vacía")
+            return {key: raw}, hits
+
+        data = self._safe_json_loads(raw)
+        if key == "encabezado":
+            if not data:
+                raise ValueError("Encabezado sin JSON válido")
+            return {k: self._texto_campo(k, data.get(k)) for k in CAMPOS_ENCABEZADO}, hits
+        if not isinstance(data.get("resuelve"), list):
+            raise ValueError("Resuelve sin JSON válido")
+        return {"resuelve": data["resuelve"]}, hits
+
+    @staticmethod
+    def _texto_campo(key: str, value: Any) -> str:
+        """
+        Texto de un campo del encabezado para el template. El modelo a veces
+        devuelve listas (p. ej. partes: ["A", "B"]): se unen con ", ".
+        Lanza ValueError si el tipo no sirve (objetos, listas anidadas).
+        """
+        if value is None:
+            return ""
+        if isinstance(value, str):
+            return value.strip()
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        if isinstance(value, (list, tuple)):
+            if not all(isinstance(v, (str, int, float)) and not isinstance(v, bool) for v in value):
+                raise ValueError(f"Campo {key} con elementos inválidos: {value!r}")
+            return ", ".join(t for t in (str(v).strip() for v in value) if t)
+        raise ValueError(f"Campo {key} con tipo inválido: {type(value).__name__}")
+
+    def _generate_section_with_retry(self, key: str, **kwargs) -> Tuple[Dict[str, Any], List[Dict[str, Any]], bool]:
+        """Reintenta solo esta sección; si se agotan los intentos devuelve el texto de fallo."""
+        for attempt in range(self.section_retries + 1):
+            try:
+                fields, hits = self._generate_section(key, **kwargs)
+                return fields, hits, True
+            except Exception:
+                logging.exception(f"Sección {key} falló (intento {attempt + 1})")
+        if key == "encabezado":
+            return {k: "" for k in CAMPOS_ENCABEZADO}, [], False
+        if key == "resuelve":
+            return {"resuelve": []}, [], False
+        return {key: SECCION_FALLIDA}, [], False
+
+    def _generate_sections(
+        self,
+        keys: List[str],
+        *,
+        instrucciones: str,
+        user_id: str,
+        session_id: str,
+        source: str,
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]], List[str]]:
+        """Genera las secciones en paralelo. Devuelve (campos, hits, secciones fallidas)."""
+        t0 = time.perf_counter()
+        futures = {
+            key: self._section_pool.submit(
+                self._generate_section_with_retry,
+                key,
+                instrucciones=instrucciones,
+                user_id=user_id,
+                session_id=session_id,
+                source=source,
+            )
+            for key in keys
+        }
+        data: Dict[str, Any] = {}
+        hits: List[Dict[str, Any]] = []
+        failed: List[str] = []
+        for key in keys:
+            fields, section_hits, ok = futures[key].result()
+            data.update(fields)
+            hits.extend(section_hits)
+            if not ok:
+                failed.append(key)
+        logging.info(
+            f"Documento por secciones: {len(keys)} secciones en {time.perf_counter() - t0:.1f}s, "
+            f"fallidas={failed}"
+        )
+        return data, hits, failed
+
+    @staticmethod
+    def _unique_hits(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        seen = set()
+        out = []
+        for h in hits:
+            key = h.get("id") or (h.get("file_id"), h.get("chunk_id"), h.get("chunk_order"))
+            if key in seen:
+                continue
+            seen.add(key)
+            out.append(h)
+        return out
+
+    def _all_section_keys(self) -> List[str]:
+        return ["encabezado"] + [sec["key"] for sec in SECCIONES_NARRATIVAS] + ["resuelve"]
+
     # --------------------------
     # Public API
     # --------------------------
@@ -269,7 +543,8 @@ INSTRUCCIONES:
         """
         Retorna:
         - docx_bytes: DOCX listo
-        - payload: JSON usado para llenar el template (con resuelve_texto)
+        - payload: JSON usado para llenar el template (con resuelve_texto;
+          en modo "sections" también secciones_fallidas)
         """
         instrucciones = (instrucciones or "").strip()
         if not instrucciones:
@@ -278,6 +553,42 @@ INSTRUCCIONES:
         if source is None:
             source = self._detect_source(user_id=user_id, session_id=session_id)
 
+        if self.mode != "sections":
+            return self._generate_single(
+                instrucciones=instrucciones, user_id=user_id, session_id=session_id, source=source
+            )
+
+        # 1) Retrieval + LLM por sección, en paralelo
+        data, hits, failed = self._generate_sections(
+            self._all_section_keys(),
+            instrucciones=instrucciones,
+            user_id=user_id,
+            session_id=session_id,
+            source=source,
+        )
+        data["secciones_fallidas"] = failed
+        data["fuentes"] = self._fuentes(self._unique_hits(hits), source)
+
+        # 2) resuelve_texto para el placeholder
+        data["resuelve_texto"] = self._build_resuelve_text(data.get("resuelve", []))
+
+        # 3) Builder DOCX (mantiene logo/estilos)
+        docx_bytes = self.docx_builder.build(data)
+
+        return docx_bytes, data
+
+    def shutdown(self) -> None:
+        self._section_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _generate_single(
+        self,
+        *,
+        instrucciones: str,
+        user_id: str,
+        session_id: str,
+        source: str,
+    ) -> Tuple[bytes, Dict[str, Any]]:
+        """Modo "single": un solo JSON con todas las secciones."""
         # 1) Retrieval
         context, hits = self._retrieve_context(
             instrucciones=instrucciones,
@@ -311,15 +622,16 @@ INSTRUCCIONES:
                 "fuentes": [],
             }
 
+        for k in CAMPOS_ENCABEZADO:
+            try:
+                data[k] = self._texto_campo(k, data.get(k))
+            except ValueError:
+                logging.warning(f"Campo {k} descartado: tipo inválido en la respuesta del modelo")
+                data[k] = ""
+
         # 3) Fuentes (auto) si no vienen
         if not data.get("fuentes"):
-            fuentes = []
-            for h in hits[:8]:
-                if source == "userdocs":
-                    fuentes.append({"doc": h.get("file_name", ""), "chunk": str(h.get("chunk_id", ""))})
-                else:
-                    fuentes.append({"doc": "CORPUS", "chunk": str(h.get("chunk_order", ""))})
-            data["fuentes"] = fuentes
+            data["fuentes"] = self._fuentes(hits, source)
 
         # 4) resuelve_texto para el placeholder 
         data["resuelve_texto"] = self._build_resuelve_text(data.get("resuelve", []))
@@ -328,4 +640,3 @@ INSTRUCCIONES:
         docx_bytes = self.docx_builder.build(data)
 
         return docx_bytes, data
-
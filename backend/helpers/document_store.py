@@ -0,0 +1,190 @@
+import time
+import hashlib
+import sqlite3
+import threading
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+class DocumentHashStore:
+    """
+    Store local (SQLite) para deduplicar ingestas por hash de contenido:
+    - documents:     hash + modelo de embeddings -> texto extraído
+    - chunks:        chunks del documento con su vector (float32 binario)
+
+    Los duplicados dentro de una sesión se detectan en el manifiesto de la
+    sesión (Cosmos), no aquí: este store es local a cada contenedor.
+
+    `model` identifica el espacio vectorial (deployment:dimensiones) para no
+    reutilizar vectores de otro modelo.
+
+    Tamaño máximo en bytes (texto + chunks + vectores de los documentos
+    completos) con expulsión LRU por documento, como EmbeddingCache.
+    """
+
+    def __init__(self, db_path: str, max_bytes: int) -> None:
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as con:
+            con.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    text TEXT,
+                    n_chunks INTEGER NOT NULL DEFAULT 0,
+                    complete INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT,
+                    nbytes INTEGER NOT NULL DEFAULT 0,
+                    last_used REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (hash, model)
+                );
+                CREATE TABLE IF NOT EXISTS chunks (
+                    hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    chunk_id INTEGER NOT NULL,
+                    content TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (hash, model, chunk_id)
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    total_bytes INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO meta (id, total_bytes) VALUES (1, 0);
+                """
+            )
+            # bases creadas antes del límite: columnas nuevas en 0 (primeras en expulsarse)
+            columns = {row[1] for row in con.execute("PRAGMA table_info(documents)")}
+            for name, ddl in (("nbytes", "INTEGER NOT NULL DEFAULT 0"), ("last_used", "REAL NOT NULL DEFAULT 0")):
+                if name not in columns:
+                    con.execute(f"ALTER TABLE documents ADD COLUMN {name} {ddl}")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_documents_last_used ON documents (last_used)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # una conexión por hilo (la ingesta corre en varios hilos)
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.db_path, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    @staticmethod
+    def hash_bytes(file_bytes: bytes) -> str:
+        return hashlib.sha256(file_bytes).hexdigest()
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    # =========================
+    # DOCUMENTOS
+    # =========================
+    def get_document(self, file_hash: str, model: str) -> Optional[dict]:
+        con = self._conn()
+        row = con.execute(
+            "SELECT text, n_chunks FROM documents WHERE hash = ? AND model = ? AND complete = 1",
+            (file_hash, model),
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            with con:
+                con.execute(
+                    "UPDATE documents SET last_used = ? WHERE hash = ? AND model = ?",
+                    (time.time(), file_hash, model),
+                )
+        except sqlite3.OperationalError:
+            # el "touch" LRU es best-effort si la base está ocupada
+            pass
+        return {"text": row[0], "n_chunks": row[1]}
+
+    def add_chunks(self, file_hash: str, model: str, rows: list[tuple[int, str, list[float]]]) -> None:
+        with self._conn() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO chunks (hash, model, chunk_id, content, vector) VALUES (?, ?, ?, ?, ?)",
+                [(file_hash, model, cid, content, array("f", vec).tobytes()) for cid, content, vec in rows],
+            )
+
+    def complete_document(self, file_hash: str, model: str, text: str, n_chunks: int) -> None:
+        con = self._conn()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            chunk_bytes = con.execute(
+                "SELECT COALESCE(SUM(LENGTH(CAST(content AS BLOB)) + LENGTH(vector)), 0) "
+                "FROM chunks WHERE hash = ? AND model = ?",
+                (file_hash, model),
+            ).fetchone()[0]
+            nbytes = len((text or "").encode("utf-8")) + chunk_bytes
+            replaced = con.execute(
+                "SELECT COALESCE(SUM(nbytes), 0) FROM documents WHERE hash = ? AND model = ?",
+                (file_hash, model),
+            ).fetchone()[0]
+            con.execute(
+                "INSERT OR REPLACE INTO documents (hash, model, text, n_chunks, complete, created_at, nbytes, last_used) "
+                "VALUES (?, ?, ?, ?, 1, ?, ?, ?)",
+                (file_hash, model, text, n_chunks, self._now(), nbytes, time.time()),
+            )
+            con.execute("UPDATE meta SET total_bytes = total_bytes + ? WHERE id = 1", (nbytes - replaced,))
+            total = con.execute("SELECT total_bytes FROM meta WHERE id = 1").fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(con, total, keep=(file_hash, model))
+            con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+
+    def _evict(self, con: sqlite3.Connection, total: int, keep: tuple[str, str]) -> None:
+        """
+        Expulsa los documentos menos usados (con sus chunks) hasta quedar en
+        ~90% del máximo. Se ejecuta dentro de la transacción de escritura.
+        """
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        victims: list[tuple[str, str]] = []
+        cur = con.execute("SELECT hash, model, nbytes FROM documents ORDER BY last_used ASC")
+        try:
+            for file_hash, model, nbytes in cur:
+                if total - freed <= target:
+                    break
+                if (file_hash, model) == keep:
+                    continue
+                victims.append((file_hash, model))
+                freed += nbytes
+        finally:
+            cur.close()
+        con.executemany("DELETE FROM chunks WHERE hash = ? AND model = ?", victims)
+        con.executemany("DELETE FROM documents WHERE hash = ? AND model = ?", victims)
+        con.execute("UPDATE meta SET total_bytes = total_bytes - ? WHERE id = 1", (freed,))
+
+    def stats(self) -> dict:
+        con = self._conn()
+        entries = con.execute("SELECT COUNT(*) FROM documents WHERE complete = 1").fetchone()[0]
+        total = con.execute("SELECT total_bytes FROM meta WHERE id = 1").fetchone()[0]
+        return {"entries": entries, "bytes": total, "max_bytes": self.max_bytes}
+
+    def iter_chunks(
+        self, file_hash: str, model: str, n_chunks: int, batch_size: int
+    ) -> Iterator[tuple[int, list[str], list[list[float]]]]:
+        """
+        Recorre los chunks guardados por lotes: (chunk_id inicial, textos, vectores).
+        """
+        for start in range(0, n_chunks, batch_size):
+            rows = self._conn().execute(
+                "SELECT chunk_id, content, vector FROM chunks "
+                "WHERE hash = ? AND model = ? AND chunk_id >= ? AND chunk_id < ? ORDER BY chunk_id",
+                (file_hash, model, start, min(start + batch_size, n_chunks)),
+            ).fetchall()
+            if not rows:
+                continue
+            yield (
+                rows[0][0],
+                [r[1] for r in rows],
+                [array("f", r[2]).tolist() for r in rows],
+            )
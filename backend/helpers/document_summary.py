@@ -0,0 +1,170 @@
+import json
+import asyncio
+import logging
+from concurrent.futures import Future
+from typing import Any, Optional
+import tiktoken
+from openai import AsyncAzureOpenAI
+from app.config import settings
+from helpers.prompts import system_prompt_resumen_documento
+from helpers.rate_limit import llm_limiter
+from helpers.session_manifest import SessionManifest
+
+
+def _texto(value: Any) -> Optional[str]:
+    """Texto de un metadato escalar (tipo, radicado); None si el modelo devolvió otra cosa."""
+    if isinstance(value, str):
+        return value.strip() or None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+
+def _partes(value: Any) -> list[str]:
+    """
+    Lista de partes como textos. El modelo a veces devuelve un solo string
+    (o números, u objetos): un string es una parte, lo demás se descarta.
+    """
+    if isinstance(value, (list, tuple)):
+        items = value
+    elif value is None:
+        items = []
+    else:
+        items = [value]
+    return [t for t in (_texto(v) for v in items) if t]
+
+
+class DocumentSummarizer:
+    """
+    Resumen corto + metadatos (tipo de documento, radicado, partes) por
+    archivo, para responder "de qué trata cada documento" sin recuperar
+    chunks de nuevo.
+    - Se genera en segundo plano cuando la ingesta del archivo termina: la
+      latencia de la subida no cambia. Corre como tarea en el event loop de
+      la app (bind_loop), con máx. DOC_SUMMARY_CONCURRENCY a la vez y la
+      llamada al LLM bajo llm_limiter, como el resto del chat.
+    - El LLM recibe el inicio y el final del texto (DOC_SUMMARY_INPUT_MAX_TOKENS):
+      partes y radicado suelen estar al inicio, la decisión al final. El
+      recorte se hace al encolar: lo pendiente nunca retiene el texto completo.
+    - El resultado se guarda en la entrada del archivo en el manifiesto.
+    """
+
+    def __init__(
+        self,
+        manifest: SessionManifest,
+        max_input_tokens: int | None = None,
+        max_workers: int | None = None,
+    ) -> None:
+        self.manifest = manifest
+        self.max_input_tokens = max_input_tokens or settings.DOC_SUMMARY_INPUT_MAX_TOKENS
+        self.enc = tiktoken.get_encoding("cl100k_base")
+        self.achat = AsyncAzureOpenAI(
+            api_key=settings.AZURE_OPENAI_KEY,
+            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+            api_version=settings.AZURE_OPENAI_OPENAI_VERSION,
+        )
+        self.max_workers = max_workers or settings.DOC_SUMMARY_CONCURRENCY
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._tasks: set[Future] = set()
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Loop donde corren los resúmenes (el de la app; lo fija la ingesta)."""
+        self._loop = loop
+
+    def submit(self, user_id: str, session_id: str, file_id: str, file_name: str, text: str) -> Future:
+        """
+        Encola el resumen desde cualquier hilo (la ingesta corre en su pool).
+        Solo el extracto acotado queda retenido hasta que el resumen corre.
+        """
+        excerpt = self._excerpt(text)
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            fut: Future = Future()
+            fut.set_exception(RuntimeError("DocumentSummarizer sin event loop (bind_loop)"))
+            logging.warning(f"Resumen de {file_name} omitido: no hay event loop para correrlo")
+            self._mark_failed(session_id, file_id)
+            return fut
+        fut = asyncio.run_coroutine_threadsafe(self._run(session_id, file_id, file_name, excerpt), loop)
+        self._tasks.add(fut)
+        fut.add_done_callback(self._tasks.discard)
+        return fut
+
+    async def _run(self, session_id: str, file_id: str, file_name: str, excerpt: str) -> None:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_workers)
+        try:
+            async with self._sem:
+                result = await self.summarize(file_name, excerpt)
+            metadata = {
+                "tipo_documento": _texto(result.get("tipo_documento")),
+                "radicado": _texto(result.get("radicado")),
+                "partes": _partes(result.get("partes")),
+            }
+            resumen = _texto(result.get("resumen")) or ""
+            await asyncio.to_thread(self.manifest.set_summary, session_id, file_id, "done", resumen, metadata)
+            logging.info(f"Resumen de {file_name} guardado en el manifiesto de {session_id}")
+        except Exception:
+            logging.exception(f"No se pudo resumir {file_name} (sesión {session_id})")
+            await asyncio.to_thread(self._mark_failed, session_id, file_id)
+
+    def _mark_failed(self, session_id: str, file_id: str) -> None:
+        try:
+            self.manifest.set_summary(session_id, file_id, "failed")
+        except Exception:
+            logging.exception("No se pudo marcar el resumen como fallido")
+
+    def _excerpt(self, text: str) -> str:
+        tokens = self.enc.encode(text or "")
+        if len(tokens) <= self.max_input_tokens:
+            return text or ""
+        head = int(self.max_input_tokens * 0.75)
+        tail = self.max_input_tokens - head
+        return (
+            self.enc.decode(tokens[:head])
+            + "\n\n[...]\n\n"
+            + self.enc.decode(tokens[-tail:])
+        )
+
+    async def summarize(self, file_name: str, excerpt: str) -> dict:
+        """Resumen + metadatos de un extracto ya recortado (_excerpt)."""
+        async with llm_limiter:
+            resp = await self.achat.chat.completions.create(
+                model=settings.AZURE_OPENAI_CHAT_DEPLOYMENT,
+                messages=[
+                    {"role": "system", "content": system_prompt_resumen_documento},
+                    {"role": "user", "content": f"ARCHIVO: {file_name}\n\nTEXTO:\n{excerpt}"},
+                ],
+                temperature=0.0,
+                response_format={"type": "json_object"},
+            )
+        content = resp.choices[0].message.content or "{}"
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            # sin JSON válido: al menos el texto como resumen
+            data = {"resumen": content.strip()}
+        return data if isinstance(data, dict) else {"resumen": str(data)}
+
+    def shutdown(self) -> None:
+        for fut in list(self._tasks):
+            fut.cancel()
+
+
+def format_summary(file: dict) -> str:
+    """Bloque de CONTEXTO de un archivo a partir de su resumen en el manifiesto."""
+    meta = file.get("metadata") or {}
+    lines = [f"### {file.get('file_name')}"]
+    tipo, radicado, partes = _texto(meta.get("tipo_documento")), _texto(meta.get("radicado")), _partes(meta.get("partes"))
+    if tipo:
+        lines.append(f"Tipo: {tipo}")
+    if radicado:
+        lines.append(f"Radicado: {radicado}")
+    if partes:
+        lines.append("Partes: " + "; ".join(partes))
+    lines.append(f"Resumen: {file.get('summary')}")
+    return "\n".join(lines)
+
+
+def has_summary(file: Optional[dict]) -> bool:
+    return bool(file and file.get("summary_status") == "done" and file.get("summary"))
@@ -0,0 +1,314 @@
+import os
+import re
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Caché persistente de embeddings en disco (SQLite), compartida por todos
+    los workers del proceso/contenedor.
+    - Clave: sha256(texto normalizado + deployment + dimensiones)
+    - Vector en binario (float32 o float16), no JSON
+    - Tamaño máximo en bytes con expulsión LRU (last_used)
+    - Concurrencia entre procesos vía locks de SQLite (WAL + BEGIN IMMEDIATE)
+    """
+
+    def __init__(self, db_path: str, max_bytes: int, dtype: str = "float32") -> None:
+        if dtype not in ("float32", "float16"):
+            raise ValueError("dtype debe ser 'float32' o 'float16'")
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self._local = threading.local()
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        con = self._conn()
+        con.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used);
+            CREATE TABLE IF NOT EXISTS meta (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_bytes INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO meta (id, total_bytes) VALUES (1, 0);
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # una conexión por hilo y por proceso
+        con = getattr(self._local, "con", None)
+        if con is None or getattr(self._local, "pid", None) != os.getpid():
+            con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", (text or "").strip())
+
+    @classmethod
+    def make_key(cls, text: str, deployment: str, dimensions: int) -> str:
+        raw = f"{deployment}:{dimensions}\x00{cls.normalize(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # =========================
+    # LECTURA
+    # =========================
+    def get_many(self, keys: Iterable[str]) -> dict[str, list[float]]:
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        con = self._conn()
+        found: dict[str, list[float]] = {}
+        # SQLite limita variables por sentencia
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            marks = ",".join("?" * len(part))
+            rows = con.execute(
+                f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({marks})", part
+            ).fetchall()
+            for key, dtype, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32).tolist()
+
+        if found:
+            try:
+                now = time.time()
+                con.execute("BEGIN")
+                con.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                con.execute("COMMIT")
+            except sqlite3.OperationalError:
+                # el "touch" LRU es best-effort si la base está ocupada
+                if con.in_transaction:
+                    con.execute("ROLLBACK")
+        return found
+
+    def get(self, key: str) -> list[float] | None:
+        return self.get_many([key]).get(key)
+
+    # =========================
+    # ESCRITURA
+    # =========================
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, vec in items.items():
+            blob = np.asarray(vec, dtype=self.dtype).tobytes()
+            rows.append((key, self.dtype.name, blob, len(blob), now))
+
+        con = self._conn()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            replaced = 0
+            for i in range(0, len(rows), 500):
+                part = [r[0] for r in rows[i:i + 500]]
+                marks = ",".join("?" * len(part))
+                replaced += con.execute(
+                    f"SELECT COALESCE(SUM(nbytes), 0) FROM embeddings WHERE key IN ({marks})", part
+                ).fetchone()[0]
+            con.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dtype, vector, nbytes, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            added = sum(r[3] for r in rows) - replaced
+            con.execute("UPDATE meta SET total_bytes = total_bytes + ? WHERE id = 1", (added,))
+            total = con.execute("SELECT total_bytes FROM meta WHERE id = 1").fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(con, total)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def put(self, key: str, vector: list[float]) -> None:
+        self.put_many({key: vector})
+
+    def _evict(self, con: sqlite3.Connection, total: int) -> None:
+        """
+        Expulsa las entradas menos usadas hasta quedar en ~90% del máximo.
+        Se ejecuta dentro de la transacción de escritura.
+        """
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        victims: list[tuple[str]] = []
+        cur = con.execute("SELECT key, nbytes FROM embeddings ORDER BY last_used ASC")
+        try:
+            for key, nbytes in cur:
+                if total - freed <= target:
+                    break
+                victims.append((key,))
+                freed += nbytes
+        finally:
+            cur.close()
+        con.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        con.execute("UPDATE meta SET total_bytes = total_bytes - ? WHERE id = 1", (freed,))
+
+    def stats(self) -> dict:
+        con = self._conn()
+        entries = con.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = con.execute("SELECT total_bytes FROM meta WHERE id = 1").fetchone()[0]
+        return {"entries": entries, "bytes": total, "max_bytes": self.max_bytes}
+
+
+class _OwnerCancelled(Exception):
+    """El llamador que calculaba la clave fue cancelado: los que esperaban reintentan."""
+
+
+class QueryEmbeddingCache:
+    """
+    Caché en memoria (por proceso) para embeddings de consultas:
+    - LRU con máximo de entradas + TTL por entrada
+    - clave: la misma de EmbeddingCache (texto normalizado + deployment + dimensiones)
+    - single-flight: pedidos concurrentes de la misma clave esperan una sola llamada
+    - contadores hits / misses / coalesced
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 3600) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._items: OrderedDict[str, tuple[float, list[float]]] = OrderedDict()
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    def _claim(self, key: str):
+        """(vector en caché | None, future, ¿este llamador calcula?)"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                expires, vec = item
+                if expires > time.monotonic():
+                    self._items.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return vec, None, False
+                del self._items[key]
+
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self._stats["coalesced"] += 1
+                return None, fut, False
+            fut = Future()
+            self._inflight[key] = fut
+            self._stats["misses"] += 1
+            return None, fut, True
+
+    def _resolve(self, key: str, fut: Future, vec: list[float]) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, vec)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+            self._inflight.pop(key, None)
+        fut.set_result(vec)
+
+    def _fail(self, key: str, fut: Future, e: BaseException) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        fut.set_exception(e)
+
+    def get_or_compute(self, key: str, compute: Callable[[], list[float]]) -> list[float]:
+        while True:
+            vec, fut, owner = self._claim(key)
+            if vec is not None:
+                return vec
+            if not owner:
+                try:
+                    return fut.result()
+                except _OwnerCancelled:
+                    continue
+
+            try:
+                vec = compute()
+            except BaseException as e:
+                self._fail(key, fut, e)
+                raise
+            self._resolve(key, fut, vec)
+            return vec
+
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[list[float]]]) -> list[float]:
+        """
+        Versión async: comparte entradas y single-flight con get_or_compute.
+        La cancelación de un llamador no se propaga a los demás: si se cancela
+        el que calcula, la clave se libera y uno de los que esperaban la
+        recalcula; si se cancela uno que espera, el cálculo sigue (shield).
+        """
+        while True:
+            vec, fut, owner = self._claim(key)
+            if vec is not None:
+                return vec
+            if not owner:
+                try:
+                    return await asyncio.shield(asyncio.wrap_future(fut))
+                except _OwnerCancelled:
+                    continue
+
+            try:
+                vec = await compute()
+            except asyncio.CancelledError:
+                self._fail(key, fut, _OwnerCancelled())
+                raise
+            except BaseException as e:
+                self._fail(key, fut, e)
+                raise
+            self._resolve(key, fut, vec)
+            return vec
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._items)
+        looked_up = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = round((stats["hits"] + stats["coalesced"]) / looked_up, 4) if looked_up else 0.0
+        return stats
+
+
+class CachedQueryEmbedder:
+    """
+    Envuelve un EmbeddingService para las consultas (RAG, generación):
+    embed() pasa por la QueryEmbeddingCache compartida. El resto de
+    atributos se delega al embedder original.
+    """
+
+    def __init__(self, embedder, cache: QueryEmbeddingCache) -> None:
+        self.embedder = embedder
+        self.cache = cache
+
+    def embed(self, text: str) -> list[float]:
+        text = (text or "").strip()
+        if not text:
+            return self.embedder.embed(text)
+        key = EmbeddingCache.make_key(text, self.embedder.deployment, self.embedder.dimensions)
+        return self.cache.get_or_compute(key, lambda: self.embedder.embed(text))
+
+    async def aembed(self, text: str) -> list[float]:
+        text = (text or "").strip()
+        if not text:
+            return await self.embedder.aembed(text)
+        key = EmbeddingCache.make_key(text, self.embedder.deployment, self.embedder.dimensions)
+        return await self.cache.aget_or_compute(key, lambda: self.embedder.aembed(text))
+
+    def __getattr__(self, name):
+        return getattr(self.embedder, name)
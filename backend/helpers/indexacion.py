@@ -1,12 +1,153 @@
 import time
-from typing import List, Dict
+import json
+import random
+import logging
+import asyncio
+import threading
+import concurrent.futures
+from typing import List, Dict, Iterable, Iterator
 from azure.core.exceptions import ServiceRequestError, HttpResponseError
 import tiktoken
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.models import VectorizedQuery
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
+from azure.search.documents.indexes import SearchIndexClient
 from app.config import settings
+from helpers.embedding_cache import EmbeddingCache
+from helpers.rate_limit import embedding_limiter
+
+
+RETRYABLE_STATUS = {409, 422, 429, 500, 502, 503, 504}
+
+
+def _log_cache_error(fut) -> None:
+    if not fut.cancelled() and fut.exception() is not None:
+        logging.warning(f"No se pudo guardar el embedding en la caché: {fut.exception()}")
+
+
+def _check_dimensions(vector: list[float], expected: int, index_name: str) -> None:
+    # un vector de otra dimensión falla en Search con un 400 poco claro
+    if len(vector) != expected:
+        raise ValueError(
+            f"El vector de consulta tiene {len(vector)} dimensiones y el índice "
+            f"'{index_name}' espera {expected}. Revisa EMBEDDING_DIMENSIONS / FABRIC_VECTOR_DIMENSIONS."
+        )
+
+
+class _AsyncAdaptiveLimiter:
+    """
+    Límite de concurrencia AIMD compartido por todos los uploads del indexer:
+    baja a la mitad ante un 429/503 y sube de a uno con cada lote exitoso.
+    Vive en el loop de uploads del indexer: la condición se crea en el
+    primer uso, dentro de ese loop.
+    """
+
+    def __init__(self, max_limit: int) -> None:
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._cond: asyncio.Condition | None = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self) -> None:
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, throttled: bool) -> None:
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+            elif self.limit < self.max_limit:
+                self.limit += 1
+            cond.notify_all()
+
+
+class _BackgroundLoop:
+    """
+    Event loop propio en un hilo daemon, creado en el primer uso. Los uploads
+    del indexer (sync o async) corren siempre aquí, vengan del hilo o loop
+    que vengan: un solo cliente aio y un solo límite AIMD para todos.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, coro) -> "concurrent.futures.Future":
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+            return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def stop(self) -> None:
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=10)
+        loop.close()
+
+
+class _AsyncSearchClient:
+    """
+    Clientes aio de larga vida para un índice, uno por event loop (la sesión
+    HTTP queda atada al loop donde se creó). Se crea en el primer uso dentro
+    de cada loop y close() los cierra todos, cada uno en su propio loop.
+    """
+
+    def __init__(self, index_name: str) -> None:
+        self.index_name = index_name
+        self._clients: dict[asyncio.AbstractEventLoop, AsyncSearchClient] = {}
+        self._lock = threading.Lock()
+
+    def get(self) -> AsyncSearchClient:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # loops ya cerrados (p. ej. un asyncio.run que terminó): su cliente
+            # no se puede cerrar desde otro loop, solo soltarlo
+            for dead in [l for l in self._clients if l.is_closed()]:
+                logging.warning(f"Cliente aio de {self.index_name} sin cerrar: su event loop ya terminó")
+                del self._clients[dead]
+            client = self._clients.get(loop)
+            if client is None:
+                client = AsyncSearchClient(
+                    endpoint=settings.AZURE_SEARCH_ENDPOINT,
+                    index_name=self.index_name,
+                    credential=AzureKeyCredential(settings.AZURE_SEARCH_KEY),
+                )
+                self._clients[loop] = client
+            return client
+
+    async def close(self) -> None:
+        current = asyncio.get_running_loop()
+        with self._lock:
+            clients = list(self._clients.items())
+            self._clients.clear()
+        for loop, client in clients:
+            try:
+                if loop is current:
+                    await client.close()
+                elif not loop.is_closed() and loop.is_running():
+                    fut = asyncio.run_coroutine_threadsafe(client.close(), loop)
+                    await asyncio.wait_for(asyncio.wrap_future(fut), timeout=10)
+            except Exception:
+                logging.exception(f"No se pudo cerrar el cliente aio de {self.index_name}")
 
 
 class AzureSearchIndexer:
@@ -16,43 +157,246 @@ class AzureSearchIndexer:
             index_name=settings.AZURE_SEARCH_INDEX,
             credential=AzureKeyCredential(settings.AZURE_SEARCH_KEY),
         )
+        self.max_batch_bytes = settings.SEARCH_UPLOAD_MAX_BATCH_BYTES
+        self.max_batch_docs = settings.SEARCH_UPLOAD_MAX_BATCH_DOCS
+        self.concurrency = settings.SEARCH_UPLOAD_CONCURRENCY
+        self.dimensions = settings.EMBEDDING_DIMENSIONS
+        # variantes async (a*): no ocupan hilos mientras esperan a Search
+        self.aclient = _AsyncSearchClient(settings.AZURE_SEARCH_INDEX)
+        self._alimiter = _AsyncAdaptiveLimiter(self.concurrency)
+        self._upload_loop = _BackgroundLoop("search-upload")
+
+    def upload(self, docs: List[Dict], retries: int = 5) -> dict:
+        """
+        Sube documentos al índice:
+        - Lotes por tamaño serializado (los vectores pesan) y máx. de docs por lote.
+        - Varios lotes en paralelo, con límite adaptativo ante throttling.
+        - Solo se reintentan las keys fallidas; 429/503 respetan Retry-After.
+        Devuelve estadísticas por documento; si al final quedan fallidos, lanza
+        HttpResponseError (con las estadísticas en `e.upload_stats`).
+        Los lotes corren en el loop de uploads del indexer (ver aupload): el
+        hilo que llama solo espera el resultado.
+        """
+        return self._upload_loop.submit(self._aupload(docs, retries)).result()
 
-    def upload(self, docs: List[Dict], batch_size: int = 25, retries: int = 5) -> None:
+    async def aupload(self, docs: List[Dict], retries: int = 5) -> dict:
+        """
+        Igual que upload(), con el cliente async: los lotes corren como
+        tareas en el loop de uploads del indexer, con el mismo límite
+        adaptativo (AIMD ante 429/503) y esperas con asyncio.sleep.
+        """
+        return await asyncio.wrap_future(self._upload_loop.submit(self._aupload(docs, retries)))
+
+    async def _aupload(self, docs: List[Dict], retries: int) -> dict:
+        stats = self._new_upload_stats(docs)
         if not docs:
-            return
+            return stats
+
+        batches = self._size_batches(docs)
+        stats["batches"] = len(batches)
+        results = await asyncio.gather(*(self._aupload_batch(b, retries) for b in batches))
+        return self._merge_upload_stats(stats, results)
+
+    @staticmethod
+    def _new_upload_stats(docs: List[Dict]) -> dict:
+        return {
+            "documents": len(docs),
+            "batches": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retried": 0,
+            "throttled": 0,
+            "failed_keys": [],
+            "errors": [],
+        }
+
+    @staticmethod
+    def _merge_upload_stats(stats: dict, results: list[dict]) -> dict:
+        for r in results:
+            for k in ("succeeded", "failed", "retried", "throttled"):
+                stats[k] += r[k]
+            stats["failed_keys"].extend(r["failed_keys"])
+            stats["errors"].extend(r["errors"])
+
+        if stats["failed"]:
+            err = HttpResponseError(
+                message=f"Fallaron {stats['failed']} de {stats['documents']} docs: {stats['errors'][:3]} ..."
+            )
+            err.upload_stats = stats
+            raise err
+        return stats
 
-        for i in range(0, len(docs), batch_size):
-            batch = docs[i:i + batch_size]
+    def _size_batches(self, docs: List[Dict]) -> list[list[Dict]]:
+        batches: list[list[Dict]] = []
+        batch: list[Dict] = []
+        batch_bytes = 0
+        for d in docs:
+            size = len(json.dumps(d, default=str))
+            if batch and (len(batch) >= self.max_batch_docs or batch_bytes + size > self.max_batch_bytes):
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append(d)
+            batch_bytes += size
+        if batch:
+            batches.append(batch)
+        return batches
 
-            last_err = None
-            for attempt in range(1, retries + 1):
+    @staticmethod
+    def _retry_after(e: HttpResponseError, attempt: int) -> float:
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+        for name, scale in (("retry-after-ms", 0.001), ("Retry-After", 1.0)):
+            value = headers.get(name)
+            if value:
                 try:
-                    res = self.client.upload_documents(documents=batch)
-                    failed = [r for r in res if not r.succeeded]
-                    if failed:
-                        raise HttpResponseError(message=f"Fallaron docs: {failed[:3]} ...")
-                    break  # OK
-                except (ServiceRequestError, HttpResponseError) as e:
-                    last_err = e
-                    # backoff simple
-                    time.sleep(min(2 ** attempt, 10))
-
-            if last_err:
-                raise last_err
+                    return min(float(value) * scale, 60.0)
+                except ValueError:
+                    pass
+        return min(2 ** attempt, 10) + random.uniform(0, 0.5)
+
+    async def _aupload_batch(self, batch: List[Dict], retries: int) -> dict:
+        out = {"succeeded": 0, "failed": 0, "retried": 0, "throttled": 0, "failed_keys": [], "errors": []}
+        pending = {d["id"]: d for d in batch}
+        client = self.aclient.get()
+
+        for attempt in range(1, retries + 1):
+            wait = 0.0
+            throttled = False
+            await self._alimiter.acquire()
+            try:
+                res = await client.upload_documents(documents=list(pending.values()))
+                throttled, wait = self._apply_results(res, pending, out, attempt, retries)
+            except (ServiceRequestError, HttpResponseError) as e:
+                status = getattr(e, "status_code", None)
+                if isinstance(e, HttpResponseError) and status not in RETRYABLE_STATUS:
+                    raise
+                throttled = status in (429, 503)
+                out["retried"] += len(pending)
+                wait = self._retry_after(e, attempt)
+            finally:
+                await self._alimiter.release(throttled)
+
+            if throttled:
+                out["throttled"] += 1
+            if not pending:
+                break
+            if attempt < retries:
+                await asyncio.sleep(wait)
+
+        return self._finish_batch(out, pending, retries)
+
+    @staticmethod
+    def _apply_results(res, pending: dict, out: dict, attempt: int, retries: int) -> tuple[bool, float]:
+        """
+        Procesa el resultado por documento de un upload: saca de `pending` los
+        confirmados y los fallidos definitivos. Devuelve (throttled, espera).
+        """
+        throttled = False
+        retry_keys = []
+        for r in res:
+            if r.succeeded:
+                out["succeeded"] += 1
+                pending.pop(r.key, None)
+            elif r.status_code in RETRYABLE_STATUS and attempt < retries:
+                retry_keys.append(r.key)
+                throttled = throttled or r.status_code in (429, 503)
+            else:
+                out["failed"] += 1
+                out["failed_keys"].append(r.key)
+                out["errors"].append(f"{r.key}: {r.status_code} {r.error_message}")
+                pending.pop(r.key, None)
+        wait = 0.0
+        if retry_keys:
+            out["retried"] += len(retry_keys)
+            wait = min(2 ** attempt, 10) + random.uniform(0, 0.5)
+        return throttled, wait
+
+    @staticmethod
+    def _finish_batch(out: dict, pending: dict, retries: int) -> dict:
+        if pending:
+            out["failed"] += len(pending)
+            out["failed_keys"].extend(pending.keys())
+            out["errors"].append(f"{len(pending)} docs sin confirmar tras {retries} intentos")
+        return out
+
+    def delete_documents(self, ids: List[str], batch_size: int = 500) -> None:
+        for i in range(0, len(ids), batch_size):
+            self.client.delete_documents(documents=[{"id": d} for d in ids[i:i + batch_size]])
             
     def list_session_files(self, user_id: str, session_id: str, top: int = 2000) -> list[dict]:
         """
         Devuelve lista única de archivos dentro de una sesión: [{file_id, file_name}, ...]
         """
-        filter_expr = f"user_id eq '{user_id}' and session_id eq '{session_id}'"
+        results = self.client.search(**self._files_query(user_id, session_id, top))
+        return self._unique_files(results)
+
+    async def alist_session_files(self, user_id: str, session_id: str, top: int = 2000) -> list[dict]:
+        results = await self.aclient.get().search(**self._files_query(user_id, session_id, top))
+        return self._unique_files([r async for r in results])
 
+    def get_session_chunks(self, user_id: str, session_id: str) -> list[dict]:
+        """
+        Todos los chunks de la sesión con su vector (para el índice en memoria).
+        """
         results = self.client.search(
             search_text="*",
-            filter=filter_expr,
-            top=top,
-            select=["file_id", "file_name"]
+            filter=f"user_id eq '{user_id}' and session_id eq '{session_id}'",
+            select=["id", "content", "file_name", "chunk_id", "file_id", "content_vector"],
         )
+        return [r for r in results]
 
+    def hybrid_search_by_file(
+        self,
+        question: str,
+        query_vector: list[float],
+        user_id: str,
+        session_id: str,
+        file_id: str,
+        top_k: int = 4
+    ) -> list[dict]:
+        results = self.client.search(**self._by_file_query(question, query_vector, user_id, session_id, file_id, top_k))
+        return [r for r in results]
+
+    async def ahybrid_search_by_file(
+        self,
+        question: str,
+        query_vector: list[float],
+        user_id: str,
+        session_id: str,
+        file_id: str,
+        top_k: int = 4
+    ) -> list[dict]:
+        results = await self.aclient.get().search(
+            **self._by_file_query(question, query_vector, user_id, session_id, file_id, top_k)
+        )
+        return [r async for r in results]
+
+    def hybrid_search(self, question: str, query_vector: list[float], user_id: str, session_id: str, top_k: int = 6) -> list[dict]:
+        results = self.client.search(**self._session_query(question, query_vector, user_id, session_id, top_k))
+        return [r for r in results]
+
+    async def ahybrid_search(self, question: str, query_vector: list[float], user_id: str, session_id: str, top_k: int = 6) -> list[dict]:
+        results = await self.aclient.get().search(**self._session_query(question, query_vector, user_id, session_id, top_k))
+        return [r async for r in results]
+
+    async def aclose(self) -> None:
+        # cierra también el cliente del loop de uploads (en ese loop) y luego el loop
+        await self.aclient.close()
+        await asyncio.to_thread(self._upload_loop.stop)
+
+    # ------------------------------------------------------------
+    # Consultas (mismos parámetros para el cliente sync y el async)
+    # ------------------------------------------------------------
+    @staticmethod
+    def _files_query(user_id: str, session_id: str, top: int) -> dict:
+        return {
+            "search_text": "*",
+            "filter": f"user_id eq '{user_id}' and session_id eq '{session_id}'",
+            "top": top,
+            "select": ["file_id", "file_name"],
+        }
+
+    @staticmethod
+    def _unique_files(results) -> list[dict]:
         seen = set()
         files = []
         for r in results:
@@ -67,17 +411,11 @@ class AzureSearchIndexer:
             files.append({"file_id": fid, "file_name": fname})
 
         return files
-    
-    def hybrid_search_by_file(
-        self,
-        question: str,
-        query_vector: list[float],
-        user_id: str,
-        session_id: str,
-        file_id: str,
-        top_k: int = 4
-    ) -> list[dict]:
 
+    def _by_file_query(
+        self, question: str, query_vector: list[float], user_id: str, session_id: str, file_id: str, top_k: int
+    ) -> dict:
+        _check_dimensions(query_vector, self.dimensions, settings.AZURE_SEARCH_INDEX)
         filter_expr = (
             f"user_id eq '{user_id}' and session_id eq '{session_id}' and file_id eq '{file_id}'"
         )
@@ -88,18 +426,19 @@ class AzureSearchIndexer:
             fields="content_vector",
         )
 
-        results = self.client.search(
-            search_text=question,
-            search_mode="any",
-            filter=filter_expr,
-            top=top_k,
-            vector_queries=[vq],
-            select=["content", "file_name", "chunk_id", "file_id"]
-        )
+        return {
+            "search_text": question,
+            "search_mode": "any",
+            "filter": filter_expr,
+            "top": top_k,
+            "vector_queries": [vq],
+            "select": ["content", "file_name", "chunk_id", "file_id"],
+        }
 
-        return [r for r in results]
-
-    def hybrid_search(self, question: str, query_vector: list[float], user_id: str, session_id: str, top_k: int = 6) -> list[dict]:
+    def _session_query(
+        self, question: str, query_vector: list[float], user_id: str, session_id: str, top_k: int
+    ) -> dict:
+        _check_dimensions(query_vector, self.dimensions, settings.AZURE_SEARCH_INDEX)
         filter_expr = f"user_id eq '{user_id}' and session_id eq '{session_id}'"
 
         vq = VectorizedQuery(
@@ -108,16 +447,14 @@ class AzureSearchIndexer:
             fields="content_vector",
         )
 
-        results = self.client.search(
-            search_text=question,     
-            filter=filter_expr,
-            top=top_k,
-            vector_queries=[vq],     
-            select=["content", "file_name", "chunk_id", "file_id"]
-        )
+        return {
+            "search_text": question,
+            "filter": filter_expr,
+            "top": top_k,
+            "vector_queries": [vq],
+            "select": ["content", "file_name", "chunk_id", "file_id"],
+        }
 
-        return [r for r in results]
-    
 
 class FabricSearchIndexer:
     def __init__(self) -> None:
@@ -126,43 +463,205 @@ class FabricSearchIndexer:
             index_name=settings.AZURE_SEARCH_INDEX_FABRIC,
             credential=AzureKeyCredential(settings.AZURE_SEARCH_KEY),
         )
+        self.dimensions = settings.FABRIC_VECTOR_DIMENSIONS
+        self.aclient = _AsyncSearchClient(settings.AZURE_SEARCH_INDEX_FABRIC)
+        self.index_client = SearchIndexClient(
+            endpoint=settings.AZURE_SEARCH_ENDPOINT,
+            credential=AzureKeyCredential(settings.AZURE_SEARCH_KEY),
+        )
+        self._version: str | None = None
+        self._version_checked = 0.0
+        self._version_lock = threading.Lock()
+
+    def index_version(self) -> str:
+        """
+        Versión del índice del corpus para invalidar cachés:
+        - CORPUS_INDEX_VERSION si está configurada (se sube al refrescar el corpus)
+        - si no, n° de documentos + tamaño del índice, consultado como máximo
+          cada CORPUS_INDEX_VERSION_CHECK_SECONDS
+        """
+        if settings.CORPUS_INDEX_VERSION:
+            return settings.CORPUS_INDEX_VERSION
+        with self._version_lock:
+            now = time.monotonic()
+            if self._version is None or now - self._version_checked >= settings.CORPUS_INDEX_VERSION_CHECK_SECONDS:
+                stats = self.index_client.get_index_statistics(settings.AZURE_SEARCH_INDEX_FABRIC)
+                self._version = f"{stats.get('document_count')}:{stats.get('storage_size')}"
+                self._version_checked = now
+            return self._version
 
     def hybrid_search(self, question: str, query_vector: list[float], top_k: int = 10) -> list[dict]:
+        results = self.client.search(**self._query(question, query_vector, top_k))
+        return [r for r in results]
+
+    async def ahybrid_search(self, question: str, query_vector: list[float], top_k: int = 10) -> list[dict]:
+        results = await self.aclient.get().search(**self._query(question, query_vector, top_k))
+        return [r async for r in results]
+
+    async def aclose(self) -> None:
+        await self.aclient.close()
+
+    def _query(self, question: str, query_vector: list[float], top_k: int) -> dict:
+        _check_dimensions(query_vector, self.dimensions, settings.AZURE_SEARCH_INDEX_FABRIC)
         vq = VectorizedQuery(
             vector=query_vector,
             k_nearest_neighbors=top_k,
             fields="texto_vector",
         )
 
-        results = self.client.search(
-            search_text=question,
-            search_mode="any",
-            top=top_k,
-            vector_queries=[vq],
-            select=[
+        return {
+            "search_text": question,
+            "search_mode": "any",
+            "top": top_k,
+            "vector_queries": [vq],
+            "select": [
                 "id", "texto", "chunk_order",
                 "tipo_documento", "NaturalezaProceso", "claseProceso",
                 "ACTOR", "DEMANDADO", "DECISION", "ProblemaJuridico"
             ],
-        )
-        return [r for r in results]
+        }
 
 
 class EmbeddingService:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        max_batch_inputs: int | None = None,
+        max_batch_tokens: int | None = None,
+        cache: EmbeddingCache | None = None,
+        dimensions: int | None = None,
+    ) -> None:
         self.client = AzureOpenAI(
             api_key=settings.AZURE_OPENAI_KEY,
             azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
             api_version=settings.AZURE_OPENAI_OPENAI_VERSION,
         )
+        # cliente async para el camino de consultas (aembed)
+        self.aclient = AsyncAzureOpenAI(
+            api_key=settings.AZURE_OPENAI_KEY,
+            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+            api_version=settings.AZURE_OPENAI_OPENAI_VERSION,
+        )
         self.deployment = settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT
+        # text-embedding-3 permite pedir vectores más cortos (debe coincidir con el índice)
+        self.dimensions = dimensions or settings.EMBEDDING_DIMENSIONS
+        # Límites por request de embeddings (n° de inputs y tokens totales)
+        self.max_batch_inputs = max_batch_inputs or settings.EMBEDDING_BATCH_MAX_INPUTS
+        self.max_batch_tokens = max_batch_tokens or settings.EMBEDDING_BATCH_MAX_TOKENS
+        self.enc = tiktoken.get_encoding("cl100k_base")
+        # Caché en disco delante de todas las llamadas (ingesta, RAG, generación)
+        self.cache = cache
+
+    def _cache_key(self, text: str) -> str:
+        return EmbeddingCache.make_key(text, self.deployment, self.dimensions)
 
     def embed(self, text: str) -> list[float]:
         text = (text or "").strip()
         if not text:
-            return [0.0] * 3072
-        resp = self.client.embeddings.create(model=self.deployment, input=text)
-        return resp.data[0].embedding
+            return [0.0] * self.dimensions
+        if self.cache:
+            key = self._cache_key(text)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        resp = self.client.embeddings.create(model=self.deployment, input=text, **self._dims_kwargs())
+        vec = resp.data[0].embedding
+        if self.cache:
+            self.cache.put(key, vec)
+        return vec
+
+    async def aembed(self, text: str) -> list[float]:
+        """
+        Igual que embed, sin bloquear el loop (limitado por embedding_limiter).
+        La caché en disco es SQLite sync (y la ingesta escribe en ella): la
+        lectura va a un hilo y la escritura se deja en segundo plano.
+        """
+        text = (text or "").strip()
+        if not text:
+            return [0.0] * self.dimensions
+        if self.cache:
+            key = self._cache_key(text)
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached
+        async with embedding_limiter:
+            resp = await self.aclient.embeddings.create(model=self.deployment, input=text, **self._dims_kwargs())
+        vec = resp.data[0].embedding
+        if self.cache:
+            self._put_background(key, vec)
+        return vec
+
+    def _put_background(self, key: str, vec: list[float]) -> None:
+        # la respuesta no espera a la escritura (puede esperar el lock de SQLite)
+        fut = asyncio.get_running_loop().run_in_executor(None, self.cache.put, key, vec)
+        fut.add_done_callback(_log_cache_error)
+
+    def embed_many(self, texts: List[str]) -> list[list[float]]:
+        """
+        Embeddings de varios textos agrupados en pocos requests.
+        - Respeta max_batch_inputs y max_batch_tokens por request.
+        - Mantiene el orden de entrada.
+        - Textos vacíos -> vector de ceros (igual que embed).
+        - Con caché, solo se envían a la API los textos que no están en ella.
+        """
+        out: list[list[float] | None] = [None] * len(texts)
+
+        pending: list[tuple[int, str]] = []
+        for i, t in enumerate(texts):
+            t = (t or "").strip()
+            if not t:
+                out[i] = [0.0] * self.dimensions
+            else:
+                pending.append((i, t))
+
+        keys: dict[int, str] = {}
+        if self.cache and pending:
+            keys = {i: self._cache_key(t) for i, t in pending}
+            cached = self.cache.get_many(keys.values())
+            still: list[tuple[int, str]] = []
+            for i, t in pending:
+                vec = cached.get(keys[i])
+                if vec is not None:
+                    out[i] = vec
+                else:
+                    still.append((i, t))
+            pending = still
+
+        for batch in self._batches(pending):
+            resp = self.client.embeddings.create(
+                model=self.deployment,
+                input=[t for _, t in batch],
+                **self._dims_kwargs(),
+            )
+            # la API devuelve "index" por item; no asumimos el orden
+            for item in sorted(resp.data, key=lambda d: d.index):
+                out[batch[item.index][0]] = item.embedding
+
+            if self.cache:
+                self.cache.put_many({keys[i]: out[i] for i, _ in batch})
+
+        return out
+
+    def _dims_kwargs(self) -> dict:
+        # solo se manda "dimensions" si difiere de la nativa del modelo
+        if self.dimensions != settings.EMBEDDING_NATIVE_DIMENSIONS:
+            return {"dimensions": self.dimensions}
+        return {}
+
+    def _batches(self, items: list[tuple[int, str]]):
+        batch: list[tuple[int, str]] = []
+        batch_tokens = 0
+        for i, t in items:
+            n = len(self.enc.encode(t))
+            if batch and (
+                len(batch) >= self.max_batch_inputs
+                or batch_tokens + n > self.max_batch_tokens
+            ):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append((i, t))
+            batch_tokens += n
+        if batch:
+            yield batch
 
 
 class Chunker:
@@ -187,3 +686,36 @@ class Chunker:
                 break
             start = max(0, end - self.overlap)
         return chunks
+
+
+    def iter_split(self, texts: Iterable[str]) -> Iterator[str]:
+        """
+        Igual que split(), pero consume el texto por partes (p. ej. por página)
+        y entrega cada chunk apenas se completa, sin tokenizar todo el documento.
+        """
+        buf: list[int] = []
+        fresh = 0  # tokens del buffer que todavía no salieron en ningún chunk
+        first = True
+        for text in texts:
+            text = (text or "").strip()
+            if not text:
+                continue
+            if not first:
+                text = "\n" + text
+            first = False
+
+            toks = self.enc.encode(text)
+            buf.extend(toks)
+            fresh += len(toks)
+
+            while len(buf) > self.max_tokens:
+                chunk = self.enc.decode(buf[:self.max_tokens]).strip()
+                if chunk:
+                    yield chunk
+                buf = buf[max(1, self.max_tokens - self.overlap):]
+                fresh = len(buf) - self.overlap
+
+        if fresh > 0:
+            chunk = self.enc.decode(buf).strip()
+            if chunk:
+                yield chunk
@@ -0,0 +1,136 @@
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Callable
+from azure.cosmos import exceptions
+from app.config import settings
+
+TERMINAL_STATUSES = {"done", "partial", "failed"}
+
+
+class IngestJobTracker:
+    """
+    Estado de los jobs de ingesta en segundo plano, guardado en Cosmos
+    (docs container) para que cualquier worker de la API pueda consultarlo.
+
+    Documento:
+    {
+      "id": "job_...", "type": "ingest_job", "user_id", "session_id",
+      "status": "queued" | "running" | "done" | "partial" | "failed",
+      "files": [
+        {"file_name", "status", "pages_extracted", "chunks_embedded",
+         "docs_indexed", "file_id", "chunks", "error"}
+      ],
+      "error", "created_at", "updated_at"
+    }
+    Mientras corre, el worker escribe un latido (updated_at). Un job sin
+    terminar y sin latido por más de `stale_seconds` quedó huérfano (el
+    proceso murió o se reinició) y se marca failed al consultarlo.
+    """
+
+    def __init__(self, cosmosdb, min_interval: float = 1.0, stale_seconds: float | None = None) -> None:
+        self.cosmosdb = cosmosdb
+        # mínimo de segundos entre escrituras de progreso por archivo
+        self.min_interval = min_interval
+        self.stale_seconds = stale_seconds or settings.INGEST_JOB_STALE_SECONDS
+
+    def create(self, user_id: str, session_id: str, file_names: list[str]) -> dict:
+        job = {
+            "id": f"job_{uuid.uuid4().hex}",
+            "user_id": user_id,
+            "session_id": session_id,
+            "status": "queued",
+            "files": [
+                {
+                    "file_name": name,
+                    "status": "queued",
+                    "pages_extracted": 0,
+                    "chunks_embedded": 0,
+                    "docs_indexed": 0,
+                    "file_id": None,
+                    "chunks": 0,
+                    "error": None,
+                }
+                for name in file_names
+            ],
+        }
+        return self.cosmosdb.create_ingest_job(job)
+
+    def get(self, job_id: str) -> dict | None:
+        return self.cosmosdb.get_ingest_job(job_id)
+
+    def set_status(self, job_id: str, status: str) -> None:
+        self._patch(job_id, {"status": status})
+
+    def touch(self, job_id: str) -> None:
+        """Latido: solo actualiza updated_at."""
+        self._patch(job_id, {})
+
+    def is_stale(self, job: dict) -> bool:
+        if job.get("status") in TERMINAL_STATUSES:
+            return False
+        try:
+            updated = datetime.fromisoformat(job.get("updated_at") or job["created_at"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return (datetime.now(timezone.utc) - updated).total_seconds() > self.stale_seconds
+
+    def expire_if_stale(self, job: dict) -> dict:
+        """
+        Si el job quedó huérfano lo marca failed y devuelve el estado nuevo.
+        El patch es condicional a que updated_at no haya cambiado: si el
+        worker escribió entretanto, el job sigue vivo y no se toca.
+        """
+        if not self.is_stale(job):
+            return job
+        try:
+            self.cosmosdb.patch_ingest_job(
+                job["id"],
+                {"status": "failed", "error": "El job dejó de reportar avance."},
+                filter_predicate=f"FROM c WHERE c.updated_at = '{job['updated_at']}'",
+            )
+            logging.warning(f"Job de ingesta {job['id']} sin avance desde {job['updated_at']}: marcado failed")
+        except exceptions.CosmosAccessConditionFailedError:
+            pass
+        return self.get(job["id"]) or job
+
+    def update_file(self, job_id: str, idx: int, **fields) -> None:
+        self._patch(job_id, {f"files/{idx}/{k}": v for k, v in fields.items()})
+
+    def file_reporter(self, job_id: str, idx: int) -> Callable[[dict], None]:
+        """
+        Callback de progreso para IngestionService.ingest: escribe como máximo
+        una vez cada `min_interval` segundos. Thread-safe.
+        """
+        lock = threading.Lock()
+        last = {"t": 0.0}
+
+        def _report(counters: dict) -> None:
+            now = time.monotonic()
+            with lock:
+                if now - last["t"] < self.min_interval:
+                    return
+                last["t"] = now
+            self.update_file(job_id, idx, status="processing", **counters)
+
+        return _report
+
+    def finish(self, job_id: str, report: list[dict]) -> str:
+        ok = sum(1 for r in report if r.get("ok"))
+        if ok == len(report):
+            status = "done"
+        elif ok:
+            status = "partial"
+        else:
+            status = "failed"
+        self.set_status(job_id, status)
+        return status
+
+    def _patch(self, job_id: str, fields: dict) -> None:
+        try:
+            self.cosmosdb.patch_ingest_job(job_id, fields)
+        except Exception:
+            # el estado es informativo: un fallo al escribirlo no detiene la ingesta
+            logging.exception(f"No se pudo actualizar el job de ingesta {job_id}")
@@ -1,55 +1,362 @@
 import uuid
+import queue
+import logging
+import threading
 from datetime import datetime, timezone
-from helpers.read_service import DocumentIntelligenceExtractor, TextCleaner
+from typing import Callable, Optional
+from app.config import settings
+from helpers.read_service import DocumentIntelligenceExtractor, TextExtractionRouter, TextCleaner, FileSource
 from helpers.indexacion import Chunker,EmbeddingService,AzureSearchIndexer
+from helpers.document_store import DocumentHashStore
+from helpers.upload_spool import SpooledUpload
+from helpers.session_manifest import SessionManifest
+from helpers.document_summary import DocumentSummarizer
+
+_DONE = object()
+
+
+class _PipelineAborted(Exception):
+    pass
+
 
 class IngestionService:
+    """
+    Ingesta en pipeline:
+        extracción -> limpieza -> chunking  (hilo que llama a ingest)
+        -> embeddings por lotes             (hilo "embed")
+        -> upload al índice                 (hilo "upload")
+    Entre etapas hay colas acotadas (queue_size lotes), así que mientras se
+    chunkean las últimas páginas ya se están embebiendo las primeras, y en
+    memoria nunca hay más de unos pocos lotes de vectores.
+
+    Con `dedup_store`, un archivo ya ingestado (mismo hash de contenido) no
+    vuelve a pasar por extracción ni embeddings: solo se escriben documentos
+    nuevos en el índice para la sesión.
+
+    Con `manifest`, el archivo se reserva en el manifiesto de la sesión antes
+    de ingestarlo (si el mismo contenido ya está en la sesión, o lo está
+    ingestando otra réplica, se omite) y al terminar queda registrado
+    (file_id, nombre, chunks, hash).
+
+    Con `summarizer`, después de registrarlo se encola (en segundo plano)
+    su resumen + metadatos, que también quedan en el manifiesto.
+    """
+
     def __init__(
         self,
-        extractor: DocumentIntelligenceExtractor,
+        extractor: TextExtractionRouter | DocumentIntelligenceExtractor,
         cleaner: TextCleaner,
         chunker: Chunker,
         embedder: EmbeddingService,
         indexer: AzureSearchIndexer,
+        batch_embeddings: bool = True,
+        batch_size: int | None = None,
+        queue_size: int | None = None,
+        dedup_store: DocumentHashStore | None = None,
+        manifest: SessionManifest | None = None,
+        summarizer: DocumentSummarizer | None = None,
     ) -> None:
         self.extractor = extractor
         self.cleaner = cleaner
         self.chunker = chunker
         self.embedder = embedder
         self.indexer = indexer
+        self.batch_embeddings = batch_embeddings
+        self.batch_size = batch_size or settings.INGEST_PIPELINE_BATCH_SIZE
+        self.queue_size = queue_size or settings.INGEST_PIPELINE_QUEUE_SIZE
+        self.dedup_store = dedup_store
+        self.manifest = manifest
+        self.summarizer = summarizer if manifest else None
+
+        self._stats_lock = threading.Lock()
+        self._stats = {"files": 0, "dedup_hits": 0, "dedup_misses": 0, "session_duplicates": 0}
 
     def ingest(
         self,
-        file_bytes: bytes,
+        file_bytes: FileSource,
         content_type: str,
         file_name: str,
         user_id: str,
         session_id: str,
+        progress: Optional[Callable[[dict], None]] = None,
+        file_id: Optional[str] = None,
     ) -> dict:
-        raw_text = self.extractor.extract_text(file_bytes, content_type)
-        text = self.cleaner.clean(raw_text)
+        """
+        `file_bytes` puede ser un SpooledUpload: la extracción lo lee desde
+        disco y el hash ya viene calculado, así el archivo nunca se carga
+        entero en memoria.
+        `progress`, si se pasa, recibe los contadores acumulados
+        {pages_extracted, chunks_embedded, docs_indexed} cada vez que avanzan.
+        Se llama desde los hilos del pipeline: debe ser thread-safe y rápido.
+        `file_id`, si se pasa, es el de una reserva ya hecha en el manifiesto
+        (el orquestador reserva el cupo al aceptar la subida): no se reserva
+        de nuevo, pero la reserva se libera igual si la ingesta falla.
+        """
+        reserved = file_id is not None
+        file_id = file_id or str(uuid.uuid4())
+        now = datetime.now(timezone.utc)
 
-        if not text:
-            return {"file_name": file_name, "file_id": None, "chunks": 0}
+        counters = {"pages_extracted": 0, "chunks_embedded": 0, "docs_indexed": 0}
+        counters_lock = threading.Lock()
 
-        chunks = self.chunker.split(text)
-        file_id = str(uuid.uuid4())
-        now = datetime.now(timezone.utc)
+        def _advance(key: str, n: int) -> None:
+            if progress is None:
+                return
+            with counters_lock:
+                counters[key] += n
+                snapshot = dict(counters)
+            try:
+                progress(snapshot)
+            except Exception:
+                # el reporte de progreso nunca debe tumbar la ingesta
+                logging.exception("Error reportando progreso de ingesta")
+
+        store = self.dedup_store
+        model = f"{self.embedder.deployment}:{self.embedder.dimensions}"
+        file_hash = None
+        if store or self.manifest:
+            if isinstance(file_bytes, SpooledUpload):
+                file_hash = file_bytes.sha256
+            else:
+                file_hash = DocumentHashStore.hash_bytes(file_bytes)
+
+        if self.manifest and not reserved:
+            previous = self.manifest.reserve(
+                user_id, session_id, [{"file_id": file_id, "file_name": file_name, "hash": file_hash}]
+            )[0]
+            if previous is not None:
+                self._count("session_duplicates")
+                logging.info(f"Ingesta omitida: {file_name} ya está en la sesión {session_id}")
+                return {
+                    "file_name": file_name,
+                    "file_id": previous.get("file_id"),
+                    "chunks": previous.get("chunks", 0),
+                    "dedup": "session_duplicate",
+                }
+
+        def _make_docs(start: int, batch_chunks: list[str], vectors: list[list[float]]) -> list[dict]:
+            return [
+                {
+                    "id": str(uuid.uuid4()),
+                    "user_id": user_id,
+                    "session_id": session_id,
+                    "file_id": file_id,
+                    "file_name": file_name,
+                    "chunk_id": start + j,
+                    "content": ch,
+                    "content_vector": vec,
+                    "created_at": now,
+                }
+                for j, (ch, vec) in enumerate(zip(batch_chunks, vectors))
+            ]
+
+        uploaded_ids: list[str] = []
+
+        def _upload(docs: list[dict]) -> None:
+            self.indexer.upload(docs)
+            uploaded_ids.extend(d["id"] for d in docs)
+            _advance("docs_indexed", len(docs))
+
+        cached = store.get_document(file_hash, model) if store else None
+        dedup = "hit" if cached else ("miss" if store else None)
+        extraction = "dedup" if cached else None
+
+        total = 0
+        full_text = ""
+        try:
+            if cached:
+                # Mismo contenido ya procesado: sin extracción ni embeddings
+                stored = store.iter_chunks(file_hash, model, cached["n_chunks"], self.batch_size)
+                total = self._run_pipeline(stored, lambda b: _make_docs(*b), _upload)
+                full_text = cached.get("text") or ""
+            else:
+                extraction, pages = self.extractor.route(file_bytes, content_type)
+                pages_text: list[str] = []
+
+                def _texts():
+                    for p in pages:
+                        t = self.cleaner.clean(p)
+                        pages_text.append(t)
+                        _advance("pages_extracted", 1)
+                        yield t
+
+                chunks = self.chunker.iter_split(_texts())
+
+                def _embed(batch: tuple[int, list[str]]) -> list[dict]:
+                    start, batch_chunks = batch
+                    if self.batch_embeddings:
+                        vectors = self.embedder.embed_many(batch_chunks)
+                    else:
+                        vectors = [self.embedder.embed(ch) for ch in batch_chunks]
+                    if store:
+                        store.add_chunks(
+                            file_hash, model,
+                            [(start + j, ch, vec) for j, (ch, vec) in enumerate(zip(batch_chunks, vectors))],
+                        )
+                    _advance("chunks_embedded", len(batch_chunks))
+                    return _make_docs(start, batch_chunks, vectors)
+
+                total = self._run_pipeline(self._batches(chunks), _embed, _upload)
+                full_text = "\n".join(pages_text).strip()
+
+                if store:
+                    store.complete_document(file_hash, model, full_text, total)
+
+            if self.manifest and total:
+                # dentro del try: si no queda en el manifiesto, se deshace la ingesta
+                self.manifest.add_file(
+                    user_id=user_id,
+                    session_id=session_id,
+                    file_id=file_id,
+                    file_name=file_name,
+                    chunks=total,
+                    file_hash=file_hash,
+                    content_type=content_type,
+                    extraction=extraction,
+                    summary_status="pending" if self.summarizer else None,
+                )
+        except Exception:
+            if self.manifest:
+                self._release(user_id, session_id, file_id)
+            # no dejar el archivo indexado a medias
+            if uploaded_ids:
+                try:
+                    self.indexer.delete_documents(uploaded_ids)
+                except Exception:
+                    pass
+            raise
+
+        if dedup:
+            self._count("dedup_hits" if dedup == "hit" else "dedup_misses")
+        else:
+            self._count()
+        if self.manifest and not total:
+            self._release(user_id, session_id, file_id)
+
+        if self.summarizer and total:
+            # no bloquea la respuesta de la subida
+            self.summarizer.submit(user_id, session_id, file_id, file_name, full_text)
+
+        logging.info(f"Ingesta {file_name}: extracción={extraction} dedup={dedup} chunks={total}")
+        if not total:
+            return {"file_name": file_name, "file_id": None, "chunks": 0, "dedup": dedup, "extraction": extraction}
+        return {"file_name": file_name, "file_id": file_id, "chunks": total, "dedup": dedup, "extraction": extraction}
+
+    def _release(self, user_id: str, session_id: str, file_id: str) -> None:
+        try:
+            self.manifest.release(user_id, session_id, file_id)
+        except Exception:
+            # la reserva vence sola (INGEST_PENDING_TTL_MINUTES)
+            logging.exception(f"No se pudo liberar la reserva de {file_id} en {session_id}")
+
+    # ------------------------------------------------------------
+    # Métricas
+    # ------------------------------------------------------------
+    def _count(self, key: str | None = None) -> None:
+        with self._stats_lock:
+            self._stats["files"] += 1
+            if key:
+                self._stats[key] += 1
+
+    def metrics(self) -> dict:
+        """
+        Contadores de ingesta desde que arrancó el proceso.
+        hit_rate = archivos servidos desde el store / archivos consultados en el store.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        looked_up = stats["dedup_hits"] + stats["dedup_misses"]
+        stats["hit_rate"] = round(stats["dedup_hits"] / looked_up, 4) if looked_up else 0.0
+        return stats
+
+    # ------------------------------------------------------------
+    # Pipeline
+    # ------------------------------------------------------------
+    def _batches(self, chunks):
+        batch: list[str] = []
+        start = 0
+        for ch in chunks:
+            batch.append(ch)
+            if len(batch) >= self.batch_size:
+                yield start, batch
+                start += len(batch)
+                batch = []
+        if batch:
+            yield start, batch
+
+    def _run_pipeline(
+        self,
+        batches,
+        embed_stage: Callable[[tuple], list[dict]],
+        upload_stage: Callable[[list[dict]], None],
+    ) -> int:
+        """
+        Ejecuta productor (este hilo) -> embed -> upload con colas acotadas.
+        Si una etapa falla, las demás se detienen y se relanza el error.
+        Devuelve el total de chunks producidos.
+        """
+        embed_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        upload_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        errors: list[BaseException] = []
+
+        def _put(q: queue.Queue, item) -> None:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+            raise _PipelineAborted()
+
+        def _get(q: queue.Queue):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+            raise _PipelineAborted()
+
+        def _worker(fn, in_q: queue.Queue, out_q: Optional[queue.Queue]) -> None:
+            try:
+                while True:
+                    item = _get(in_q)
+                    if item is _DONE:
+                        break
+                    res = fn(item)
+                    if out_q is not None:
+                        _put(out_q, res)
+                if out_q is not None:
+                    _put(out_q, _DONE)
+            except _PipelineAborted:
+                pass
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+
+        workers = [
+            threading.Thread(target=_worker, args=(embed_stage, embed_q, upload_q), name="ingest-embed", daemon=True),
+            threading.Thread(target=_worker, args=(upload_stage, upload_q, None), name="ingest-upload", daemon=True),
+        ]
+        for w in workers:
+            w.start()
+
+        total = 0
+        try:
+            for item in batches:
+                # item = (chunk_id inicial, chunks, ...)
+                total = item[0] + len(item[1])
+                _put(embed_q, item)
+            _put(embed_q, _DONE)
+        except _PipelineAborted:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            for w in workers:
+                w.join()
 
-        docs: list[dict] = []
-        for i, ch in enumerate(chunks):
-            vec = self.embedder.embed(ch)
-            docs.append({
-                "id": str(uuid.uuid4()),
-                "user_id": user_id,
-                "session_id": session_id,
-                "file_id": file_id,
-                "file_name": file_name,
-                "chunk_id": i,
-                "content": ch,
-                "content_vector": vec,
-                "created_at": now,
-            })
-
-        self.indexer.upload(docs)
-        return {"file_name": file_name, "file_id": file_id, "chunks": len(chunks)}
+        if errors:
+            raise errors[0]
+        return total
@@ -0,0 +1,221 @@
+import re
+import time
+import asyncio
+import logging
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Optional
+import numpy as np
+
+TOOL_USERDOCS = "tool_rag_userdocs"
+TOOL_CORPUS = "tool_rag_corpus"
+TOOL_CONVERSACIONAL = "tool_conversacional"
+TOOL_WORD = "tool_generar_word"
+
+# Ejemplos etiquetados para el clasificador por similitud (ampliar con los
+# casos que aparezcan en los logs del router)
+EJEMPLOS: dict[str, list[str]] = {
+    TOOL_CONVERSACIONAL: [
+        "hola", "buenos días", "buenas tardes", "gracias", "muchas gracias por la ayuda",
+        "hasta luego", "chao", "cómo estás", "qué puedes hacer", "perfecto, gracias",
+    ],
+    TOOL_WORD: [
+        "genera el word", "descárgalo en word", "créame un documento word con el análisis",
+        "exporta la providencia a docx", "quiero descargar el documento", "hazme el proyecto de auto en word",
+    ],
+    TOOL_USERDOCS: [
+        "resume el documento que subí", "qué dice el archivo adjunto sobre las pretensiones",
+        "de qué trata cada documento", "cuáles son los hechos de la demanda que adjunté",
+        "quiénes son las partes en el documento", "extrae las fechas del archivo",
+        "qué solicita el demandante en el escrito que cargué",
+    ],
+    TOOL_CORPUS: [
+        "qué dice la jurisprudencia sobre conflictos de competencia",
+        "busca sentencias de la corte sobre tutela contra providencias judiciales",
+        "hay precedentes sobre competencia por factor territorial",
+        "qué ha resuelto la sala en casos de pensión de sobrevivientes",
+        "busca en el corpus el radicado 11001020300020230012300",
+        "qué problema jurídico se ha planteado en casos similares",
+    ],
+}
+
+_SALUDO = re.compile(
+    r"^(hola|buen[oa]s( d[ií]as| tardes| noches)?|gracias|muchas gracias|chao|adi[oó]s|hasta luego|ok|listo)"
+    r"[\s!¡.,]*$"
+)
+_WORD = re.compile(r"\b(genera|generar|crea|crear|descarga|descargar|exporta|exportar|hazme)\b.*\b(word|docx)\b")
+_POR_DOCUMENTO = re.compile(r"\b(cada documento|cada archivo|por documento|por archivo)\b")
+# depende del historial (memoria del agente) o es seguimiento de la respuesta anterior
+_HISTORIAL = re.compile(
+    r"(te (he )?pregunt|me llamo|c[oó]mo me llamo|lo anterior|lo que dijiste|tu respuesta|"
+    r"^(y |pero |entonces |eso|esa|ese|m[aá]s |otra vez|contin[uú]a|sigue))"
+)
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFC", (text or "").strip().lower())
+
+
+class IntentRouter:
+    """
+    Enrutador local antes del agente (evita la ida y vuelta del
+    function-calling cuando el caso es obvio):
+    1) reglas: saludos, "genera el word", pregunta que nombra un archivo
+       subido, "cada documento", y referencias al historial (-> agente)
+    2) similitud de embeddings contra EJEMPLOS: se toma el mejor ejemplo
+       por tool; se despacha si score >= threshold y supera a la segunda
+       tool por al menos `margin`
+    Si no hay confianza suficiente devuelve tool=None (lo resuelve el agente).
+    Cada decisión se registra con su confianza para ajustar el umbral.
+    """
+
+    def __init__(self, embedder, threshold: float = 0.78, margin: float = 0.05, examples: Optional[dict] = None) -> None:
+        self.embedder = embedder
+        self.threshold = threshold
+        self.margin = margin
+        self.examples = examples or EJEMPLOS
+        self._labels: list[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._init_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats: dict[str, int] = {"rule": 0, "embedding": 0, "fallback": 0}
+
+    # ------------------------------------------------------------
+    # Ejemplos (se embeben una vez, al primer uso)
+    # ------------------------------------------------------------
+    def _load_examples(self) -> np.ndarray:
+        with self._init_lock:
+            if self._matrix is None:
+                labels, texts = [], []
+                for tool, items in self.examples.items():
+                    for text in items:
+                        labels.append(tool)
+                        texts.append(text)
+                vectors = np.asarray(self.embedder.embed_many(texts), dtype=np.float32)
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                self._labels = labels
+                self._matrix = vectors / norms
+        return self._matrix
+
+    # ------------------------------------------------------------
+    # Reglas
+    # ------------------------------------------------------------
+    @staticmethod
+    def _mentions_file(q: str, file_names: list[str]) -> Optional[str]:
+        for name in file_names or []:
+            stem = _normalize(Path(name).stem)
+            if len(stem) >= 4 and (stem in q or _normalize(name) in q):
+                return name
+        return None
+
+    def _rules(self, q: str, file_names: list[str]) -> Optional[dict]:
+        if _HISTORIAL.search(q):
+            return {"tool": None, "confidence": 1.0, "reason": "historial"}
+        if _SALUDO.match(q):
+            return {"tool": TOOL_CONVERSACIONAL, "confidence": 1.0, "reason": "saludo"}
+        if _WORD.search(q):
+            return {"tool": TOOL_WORD, "confidence": 1.0, "reason": "word"}
+        if file_names:
+            if _POR_DOCUMENTO.search(q):
+                return {"tool": TOOL_USERDOCS, "confidence": 1.0, "reason": "por_documento"}
+            name = self._mentions_file(q, file_names)
+            if name:
+                return {"tool": TOOL_USERDOCS, "confidence": 1.0, "reason": f"archivo:{name}"}
+        return None
+
+    # ------------------------------------------------------------
+    # Decisión
+    # ------------------------------------------------------------
+    def route(self, question: str, file_names: Optional[list[str]] = None) -> dict:
+        """
+        Devuelve {"tool", "confidence", "method", "reason", "candidate", "elapsed_ms"}.
+        tool=None -> usar el agente. `candidate` es la mejor tool aunque no
+        alcance el umbral (para calibrar).
+        """
+        t0 = time.perf_counter()
+        file_names = file_names or []
+        decision = self._rule_decision(question, file_names)
+        if decision is None:
+            try:
+                matrix = self._load_examples()
+                qv = self.embedder.embed(question)
+            except Exception:
+                decision = self._embed_error()
+            else:
+                decision = self._classify(matrix, qv, has_files=bool(file_names))
+        return self._record(decision, t0)
+
+    async def aroute(self, question: str, file_names: Optional[list[str]] = None) -> dict:
+        """route sin bloquear el loop: las reglas no hacen I/O y la pregunta se embebe con aembed."""
+        t0 = time.perf_counter()
+        file_names = file_names or []
+        decision = self._rule_decision(question, file_names)
+        if decision is None:
+            try:
+                # los ejemplos se embeben una sola vez (en un hilo, con el lote sync)
+                matrix = self._matrix if self._matrix is not None else await asyncio.to_thread(self._load_examples)
+                qv = await self.embedder.aembed(question)
+            except Exception:
+                decision = self._embed_error()
+            else:
+                decision = self._classify(matrix, qv, has_files=bool(file_names))
+        return self._record(decision, t0)
+
+    def _rule_decision(self, question: str, file_names: list[str]) -> Optional[dict]:
+        decision = self._rules(_normalize(question), file_names)
+        if decision is not None:
+            decision.update(method="rule" if decision["tool"] else "fallback", candidate=decision["tool"])
+        return decision
+
+    @staticmethod
+    def _embed_error() -> dict:
+        logging.exception("Router: no se pudo embeber la pregunta; se usa el agente")
+        return {"tool": None, "confidence": 0.0, "method": "fallback", "reason": "error", "candidate": None}
+
+    def _record(self, decision: dict, t0: float) -> dict:
+        decision["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        with self._lock:
+            self._stats[decision["method"]] += 1
+        logging.info(
+            f"Router: tool={decision['tool']} método={decision['method']} "
+            f"confianza={decision['confidence']} candidata={decision.get('candidate')} "
+            f"motivo={decision.get('reason')} ({decision['elapsed_ms']} ms)"
+        )
+        return decision
+
+    def _classify(self, matrix: np.ndarray, query_vector: list[float], has_files: bool) -> dict:
+        qv = np.asarray(query_vector, dtype=np.float32)
+        n = np.linalg.norm(qv)
+        if n:
+            qv = qv / n
+        if matrix.shape[1] != qv.shape[0]:
+            return {"tool": None, "confidence": 0.0, "method": "fallback", "reason": "dimensiones", "candidate": None}
+
+        sims = matrix @ qv
+        best: dict[str, float] = {}
+        for label, sim in zip(self._labels, sims.tolist()):
+            if sim > best.get(label, -1.0):
+                best[label] = sim
+        ranked = sorted(best.items(), key=lambda kv: kv[1], reverse=True)
+        tool, score = ranked[0]
+        second = ranked[1][1] if len(ranked) > 1 else -1.0
+        confidence = round(score, 4)
+
+        if score < self.threshold:
+            reason = "umbral"
+        elif score - second < self.margin:
+            reason = "margen"
+        elif tool == TOOL_USERDOCS and not has_files:
+            reason = "sin_archivos"
+        else:
+            return {"tool": tool, "confidence": confidence, "method": "embedding", "reason": "similitud", "candidate": tool}
+        return {"tool": None, "confidence": confidence, "method": "fallback", "reason": reason, "candidate": tool}
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        total = sum(stats.values())
+        stats["fast_path_rate"] = round((stats["rule"] + stats["embedding"]) / total, 4) if total else 0.0
+        return stats
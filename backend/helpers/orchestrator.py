@@ -3,22 +3,37 @@
 # -----------------------------------------------------------------------------
 import uuid
 import asyncio
+import contextvars
 import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, AsyncIterator
 from fastapi import UploadFile, HTTPException
 from dotenv import load_dotenv, find_dotenv
 from langchain_openai import AzureChatOpenAI
+from langchain_core.rate_limiters import InMemoryRateLimiter
 from langchain.agents import initialize_agent, Tool
 from langchain.agents.agent_types import AgentType
 from app.config import settings
 from helpers.tools import Tools
 from core.ai_services import AIServices
 from helpers.prompts import system_prompt_agente
-from helpers.read_service import DocumentIntelligenceExtractor, TextCleaner
+from helpers.read_service import DocumentIntelligenceExtractor, TextExtractionRouter, TextCleaner
 from helpers.indexacion import AzureSearchIndexer, FabricSearchIndexer, Chunker
 from helpers.document_generator import  DocxTemplateBuilder, DocumentGeneratorService
 from helpers.ingestion import IngestionService
+from helpers.document_store import DocumentHashStore
+from helpers.embedding_cache import EmbeddingCache, QueryEmbeddingCache, CachedQueryEmbedder
+from helpers.answer_cache import SemanticAnswerCache
+from helpers.ingest_jobs import IngestJobTracker
+from helpers.upload_spool import SpooledUpload, spool_uploads
+from helpers.session_manifest import SessionManifest, SessionFileLimitError
+from helpers.session_index import build_local_first_indexer
+from helpers.document_summary import DocumentSummarizer
+from helpers.intent_router import IntentRouter
+from helpers.conversation_memory import ConversationMemory
+from helpers.streaming import StreamEmitter, AgentStreamHandler, bind_emitter, reset_emitter
 from core.rag_service import RAGFabricService, RAGService
 from helpers.indexacion import EmbeddingService  
 from utils.functions import Functions
@@ -52,38 +67,102 @@ class Orchestrator:
     # 1) Funciones de inicializacion
     # ------------------------------------------------------------
     def __init__(self): 
+        # Límite de ritmo de las llamadas del agente (LangChain); las de RAG
+        # pasan por helpers.rate_limit.llm_limiter
+        self.llm_rate_limiter = InMemoryRateLimiter(
+            requests_per_second=settings.LLM_REQUESTS_PER_MINUTE / 60,
+            max_bucket_size=max(1, settings.LLM_REQUESTS_PER_MINUTE // 60),
+        ) if settings.LLM_REQUESTS_PER_MINUTE > 0 else None
         self.llm = AzureChatOpenAI(
             api_key=settings.AZURE_OPENAI_KEY,
             azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
             api_version=settings.AZURE_OPENAI_OPENAI_VERSION,
             deployment_name=settings.AZURE_OPENAI_CHAT_DEPLOYMENT,
             temperature=0.4,
+            rate_limiter=self.llm_rate_limiter,
         ) 
-        self.extractor = DocumentIntelligenceExtractor()
+        self.extractor = TextExtractionRouter(remote=DocumentIntelligenceExtractor())
         self.cleaner = TextCleaner()
         self.chunker = Chunker(max_tokens=900, overlap=150)
-        self.embedder = EmbeddingService()
+        embedding_cache = EmbeddingCache(
+            settings.EMBEDDING_CACHE_DB_PATH,
+            max_bytes=settings.EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+            dtype=settings.EMBEDDING_CACHE_DTYPE,
+        ) if settings.EMBEDDING_CACHE_ENABLED else None
+        self.embedder = EmbeddingService(cache=embedding_cache)
+        # El índice del corpus (Fabric) puede tener otra dimensión que el de sesión
+        if settings.FABRIC_VECTOR_DIMENSIONS != self.embedder.dimensions:
+            self.embedder_corpus = EmbeddingService(
+                cache=embedding_cache, dimensions=settings.FABRIC_VECTOR_DIMENSIONS
+            )
+        else:
+            self.embedder_corpus = self.embedder
+        # Consultas: una misma pregunta enrutada a varias tools se embebe una vez
+        if settings.QUERY_EMBEDDING_CACHE_ENABLED:
+            self.query_cache = QueryEmbeddingCache(
+                max_entries=settings.QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+                ttl_seconds=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+            )
+            query_embedder = CachedQueryEmbedder(self.embedder, self.query_cache)
+            query_embedder_corpus = CachedQueryEmbedder(self.embedder_corpus, self.query_cache)
+        else:
+            self.query_cache = None
+            query_embedder, query_embedder_corpus = self.embedder, self.embedder_corpus
         self.function = Functions()
         self.cosmosdb = AIServices.AzureCosmosDB()
+        # Manifiesto de archivos por sesión (lectura puntual en Cosmos)
+        self.manifest = SessionManifest(self.cosmosdb)
+        # Memoria de conversación en la sesión (resumen + últimos turnos)
+        self.memory = ConversationMemory(self.cosmosdb)
         self.corpus_indexer = FabricSearchIndexer()
         self.search_manager = AzureSearchIndexer()
-        self.rag_corpus = RAGFabricService(embedder=self.embedder, indexer=self.corpus_indexer)
-        self.rag_userdocs = RAGService(embedder=self.embedder, indexer=self.search_manager)
+        # Búsquedas sobre documentos de la sesión: en memoria si está habilitado
+        self.userdocs_search = build_local_first_indexer(self.search_manager, self.manifest)
+        self.corpus_answer_cache = SemanticAnswerCache(
+            threshold=settings.CORPUS_ANSWER_CACHE_THRESHOLD,
+            max_entries=settings.CORPUS_ANSWER_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.CORPUS_ANSWER_CACHE_TTL_SECONDS,
+        ) if settings.CORPUS_ANSWER_CACHE_ENABLED else None
+        self.rag_corpus = RAGFabricService(
+            embedder=query_embedder_corpus,
+            indexer=self.corpus_indexer,
+            answer_cache=self.corpus_answer_cache,
+        )
+        self.rag_userdocs = RAGService(embedder=query_embedder, indexer=self.userdocs_search, manifest=self.manifest)
         self.doc = DocxTemplateBuilder (str(template_path))
         self.doc_generator = DocumentGeneratorService(
             llm_chat=self.llm,
-            embedder=self.embedder,
-            indexer_userdocs=self.search_manager,
+            embedder=query_embedder,
+            embedder_corpus=query_embedder_corpus,
+            indexer_userdocs=self.userdocs_search,
             indexer_corpus=self.corpus_indexer,
             docx_builder=self.doc,
+            manifest=self.manifest,
         )
+        # Resumen + metadatos por archivo en segundo plano (manifiesto)
+        self.summarizer = DocumentSummarizer(self.manifest) if settings.DOC_SUMMARY_ENABLED else None
         self.ingestor = IngestionService(
             extractor=self.extractor,
             cleaner=self.cleaner,
             chunker=self.chunker,
             embedder=self.embedder,
             indexer=self.search_manager,
+            dedup_store=DocumentHashStore(
+                settings.INGEST_DEDUP_DB_PATH,
+                max_bytes=settings.INGEST_DEDUP_MAX_MB * 1024 * 1024,
+            ) if settings.INGEST_DEDUP_ENABLED else None,
+            manifest=self.manifest,
+            summarizer=self.summarizer,
+        )
+        # Pool propio para ingesta: limita archivos en paralelo por proceso
+        # y no compite con el executor por defecto (agente, llm_detect).
+        self.ingest_executor = ThreadPoolExecutor(
+            max_workers=settings.INGEST_MAX_CONCURRENCY_PROCESS,
+            thread_name_prefix="ingest",
         )
+        # Jobs de ingesta en segundo plano (estado en Cosmos)
+        self.ingest_jobs = IngestJobTracker(self.cosmosdb)
+        self._background_tasks: set[asyncio.Task] = set()
         self.tools_class = Tools(
             rag_userdocs=self.rag_userdocs,  
             rag_corpus=self.rag_corpus,       
@@ -95,32 +174,96 @@ class Orchestrator:
         # ------------------------------------------------------------
         # 2) Tools - decisiones
         # ------------------------------------------------------------
-        self.tools = [
+        self.tools = self._build_tools()
+
+        # Router local: casos obvios van directo a la tool, sin el agente
+        self.router = IntentRouter(
+            query_embedder,
+            threshold=settings.INTENT_ROUTER_THRESHOLD,
+            margin=settings.INTENT_ROUTER_MARGIN,
+        ) if settings.INTENT_ROUTER_ENABLED else None
+        self.router_tools = {
+            "tool_rag_userdocs": self.tools_class.atool_rag_userdocs,
+            "tool_rag_corpus": self.tools_class.atool_rag_fabric,
+            "tool_conversacional": self.tools_class.atool_conversacional,
+            "tool_generar_word": self.tools_class.atool_word,
+        }
+
+        # ------------------------------------------------------------
+        # 3) Inicializacion de agente - tipo de agente
+        # ------------------------------------------------------------
+        self.agent = initialize_agent(
+            tools=self.tools,
+            llm=self.llm,
+            agent=AgentType.OPENAI_FUNCTIONS,
+            verbose=True,
+            handle_parsing_errors=True,
+            agent_kwargs={"system_message": system_prompt_agente},
+        )
+
+        # ------------------------------------------------------------
+        # 4) Agente de streaming (/api/ask/stream)
+        # ------------------------------------------------------------
+        # LLM con streaming=True para recibir on_llm_new_token, y tools con
+        # return_direct: la respuesta de la tool (que ya se emitió token a
+        # token) es la respuesta final, sin una segunda pasada del agente.
+        self.llm_stream = AzureChatOpenAI(
+            api_key=settings.AZURE_OPENAI_KEY,
+            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+            api_version=settings.AZURE_OPENAI_OPENAI_VERSION,
+            deployment_name=settings.AZURE_OPENAI_CHAT_DEPLOYMENT,
+            temperature=0.4,
+            streaming=True,
+            rate_limiter=self.llm_rate_limiter,
+        )
+        self.agent_stream = initialize_agent(
+            tools=self._build_tools(direct_answers=True),
+            llm=self.llm_stream,
+            agent=AgentType.OPENAI_FUNCTIONS,
+            verbose=True,
+            handle_parsing_errors=True,
+            agent_kwargs={"system_message": system_prompt_agente},
+        )
+
+    def _build_tools(self, direct_answers: bool = False) -> list[Tool]:
+        """
+        Tools del agente. direct_answers=True devuelve tal cual la respuesta
+        de las tools RAG / conversacional (agente de streaming).
+        `coroutine` es la versión que usa ainvoke; `func` queda para invoke.
+        """
+        return [
             Tool.from_function(
                 func=self.tools_class.tool_rag_userdocs,
+                coroutine=self.tools_class.atool_rag_userdocs,
                 name="tool_rag_userdocs",
                 description=(
                     "Usa esta herramienta cuando la pregunta sea sobre documentos SUBIDOS por el usuario "
                     "en la sesión actual. Ej: 'este documento', 'lo que subí', 'adjunto', "
                     "'resume el archivo', 'qué dice el documento sobre...'."
                 ),
+                return_direct=direct_answers,
             ),
             Tool.from_function(
                 func=self.tools_class.tool_rag_fabric,
+                coroutine=self.tools_class.atool_rag_fabric,
                 name="tool_rag_corpus",
                 description=(
                     "Usa esta herramienta cuando la pregunta sea sobre el CORPUS/JURISPRUDENCIA "
                     "(índice del compa). Ej: 'CSJ', 'jurisprudencia', 'sentencia', 'radicado', "
                     "'actor demandado', 'problema jurídico'."
                 ),
+                return_direct=direct_answers,
             ),
             Tool.from_function(
                 func=self.tools_class.tool_conversacional,
+                coroutine=self.tools_class.atool_conversacional,
                 name="tool_conversacional",
-                description="Usa esta herramienta para saludos, despedidas o charla que NO requiera consultar índices."
+                description="Usa esta herramienta para saludos, despedidas o charla que NO requiera consultar índices.",
+                return_direct=direct_answers,
             ),
             Tool.from_function(
                 func=self.tools_class.tool_word,
+                coroutine=self.tools_class.atool_word,
                 name="tool_generar_word",
                 description=(
                     "Usa esta herramienta ÚNICAMENTE cuando el usuario pida descargar/crear/generar/exportar "
@@ -130,17 +273,14 @@ class Orchestrator:
             ),
         ]
 
-        # ------------------------------------------------------------
-        # 3) Inicializacion de agente - tipo de agente
-        # ------------------------------------------------------------
-        self.agent = initialize_agent(
-            tools=self.tools,
-            llm=self.llm,
-            agent=AgentType.OPENAI_FUNCTIONS,
-            verbose=True,
-            handle_parsing_errors=True,
-            agent_kwargs={"system_message": system_prompt_agente},
-        )
+    async def aclose(self) -> None:
+        """Libera recursos de larga vida al apagar la app."""
+        await self.search_manager.aclose()
+        await self.corpus_indexer.aclose()
+        self.ingest_executor.shutdown(wait=False, cancel_futures=True)
+        self.doc_generator.shutdown()
+        if self.summarizer:
+            self.summarizer.shutdown()
 #endregion
 
 # -----------------------------------------------------------------------------
@@ -163,28 +303,17 @@ class Orchestrator:
         # ------------------------------------------------------------
         # 2) Sesión nueva + límite 10 conversaciones
         # ------------------------------------------------------------
-        if not session_id:
-            user_sessions = self.cosmosdb.get_user_sessions(user_id)
-            if len(user_sessions) >= MAX_CONVERSATIONS_PER_USER:
-                raise HTTPException(
-                    status_code=409,
-                    detail=f"Límite alcanzado: máximo {MAX_CONVERSATIONS_PER_USER} conversaciones por usuario."
-                )
-            session_id = str(uuid.uuid4())
+        session_id = await asyncio.to_thread(self._resolver_sesion, user_id, session_id)
 
         files = files or []
         files_uploaded_now = len(files) > 0
 
         # ------------------------------------------------------------
-        # 3) Validación límite 40 archivos por sesión
+        # 3) Validación de tipos permitidos (el límite de 40 archivos por
+        #    sesión se aplica al reservar, en la ingesta)
         # ------------------------------------------------------------
         if files_uploaded_now:
-            existing_files = self.cosmosdb.count_uploaded_files(session_id)
-            if existing_files + len(files) > MAX_FILES_PER_SESSION:
-                raise HTTPException(
-                    status_code=409,
-                    detail=f"Límite de archivos alcanzado ({MAX_FILES_PER_SESSION} máx). Ya tienes {existing_files}."
-                )
+            self._validar_archivos(files)
 
         # ------------------------------------------------------------
         # 4) Detectar si es solo subida (sin pregunta real)
@@ -202,32 +331,25 @@ class Orchestrator:
         # ------------------------------------------------------------
         # 5) Ingesta
         # ------------------------------------------------------------
+        ingest_report: list[dict] = []
         if files_uploaded_now:
-            for f in files:
-                ct = (f.content_type or "").lower()
-                name = f.filename or "archivo"
-
-                if ct not in ALLOWED_CT:
-                    raise HTTPException(status_code=400, detail=f"Tipo no permitido: {name} ({ct})")
-
-                file_bytes = await f.read()
-                try:
-                    await asyncio.to_thread(
-                        self.ingestor.ingest,
-                        file_bytes,
-                        ct,
-                        name,
-                        user_id,
-                        session_id
-                    )
-                finally:
-                    try:
-                        await f.seek(0)
-                    except Exception:
-                        pass
+            spooled = await spool_uploads(files)
+            try:
+                reservas = await self._reservar_archivos(user_id, session_id, spooled)
+                ingest_report = await self._ingest_files(spooled, user_id, session_id, reservas=reservas)
+            finally:
+                for s in spooled:
+                    s.discard()
+
+        ok_names = [r["file_name"] for r in ingest_report if r.get("ok")]
+        failed = [r for r in ingest_report if not r.get("ok")]
+        failed_text = "".join(
+            f"\n- No pude procesar {r['file_name']}: {r.get('error', 'error desconocido')}"
+            for r in failed
+        )
 
         # ------------------------------------------------------------
-        # 6) Bind contexto a Tools (para userdocs por session_id/user_id)
+        # 6) Bind contexto a Tools (por request: ContextVar, lo heredan ainvoke y las tools)
         # ------------------------------------------------------------
         self.tools_class.bind_context(session_id=session_id, user_id=user_id, files=files)
 
@@ -235,17 +357,19 @@ class Orchestrator:
         # 7) Caso: subió archivos sin pregunta -> GPT pregunta “qué hacer”
         # ------------------------------------------------------------
         if only_upload:
-            nombres = ", ".join([f.filename for f in files if f.filename]) or "tus archivos"
-            output = (
-                f"Recibí: {nombres}.\n\n"
-                "¿Qué quieres hacer con estos documentos?\n"
+            nombres = ", ".join(ok_names) or "ningún archivo válido"
+            output = f"Recibí: {nombres}.\n"
+            if failed_text:
+                output += failed_text + "\n"
+            output += (
+                "\n¿Qué quieres hacer con estos documentos?\n"
                 "1) Resumir\n"
                 "2) Buscar algo específico\n"
                 "3) Extraer información clave\n"
                 "4) Generar un Word con un informe\n"
             )
 
-            self.cosmosdb.save_message_chat(
+            await self.cosmosdb.asave_message_chat(
                 session_id=session_id,
                 user_id=user_id,
                 user_question=mensaje_usuario or "(subida de archivos)",
@@ -253,29 +377,111 @@ class Orchestrator:
                 channel="web",
                 extra={"mode": "only_upload"},
             )
+            await self._registrar_turno(session_id, mensaje_usuario or "(subida de archivos)", output)
 
-            return {"reply_text": output, "session_id": session_id}
+            return {"reply_text": output, "session_id": session_id, "files": ingest_report}
 
         # ------------------------------------------------------------
-        # 8) Memoria: recuperar historial de Cosmos
+        # 8) Router local: si el caso es obvio, tool directa sin agente
         # ------------------------------------------------------------
-        historial = self.cosmosdb.get_session_messages(session_id) or []
+        decision = await self._enrutar(mensaje_usuario, user_id, session_id)
+        if decision and decision["tool"]:
+            raw_output = await self.router_tools[decision["tool"]](mensaje_usuario)
+            pasos = f"router:{decision['tool']}"
+        else:
+            # ------------------------------------------------------------
+            # 9) Memoria + instrucción de enrutamiento
+            # ------------------------------------------------------------
+            input_modelo = await asyncio.to_thread(
+                self._input_modelo, session_id, mensaje_usuario, files_uploaded_now, ok_names, failed_text
+            )
 
-        # recorta para no explotar tokens
-        historial = historial[-20:]
+            # ------------------------------------------------------------
+            # 10) Ejecutar agente
+            # ------------------------------------------------------------
+            respuesta = await self.agent.ainvoke({"input": input_modelo})
+            raw_output = respuesta.get("output")
+            pasos = respuesta.get("intermediate_steps")
+        if self.query_cache:
+            logging.info(f"Caché de embeddings de consultas: {self.query_cache.stats()}")
 
-        contexto_chat = ""
-        for m in historial:
-            contexto_chat += f"<usuario>: {m.get('UserQuestion','')}\n"
-            contexto_chat += f"<asistente>: {m.get('IAResponse','')}\n"
+        # si el tool devuelve dict (return_direct=True) aquí llega dict
+        if isinstance(raw_output, str):
+            output = raw_output.strip()
+        else:
+            output = raw_output  # dict u otro tipo
+
+        # ------------------------------------------------------------
+        # 11) Guardar en Cosmos
+        # ------------------------------------------------------------
+        # Cosmos espera string, entonces si viene dict lo serializamos
+        output_to_save = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False)
+
+        await self.cosmosdb.asave_message_chat(
+            session_id=session_id,
+            user_id=user_id,
+            user_question=mensaje_usuario,
+            ia_response=output_to_save,
+            channel="web",
+            extra={"tools": str(pasos), "router": decision},
+        )
+        await self._registrar_turno(session_id, mensaje_usuario, output_to_save)
+
+        return {"reply_text": output, "session_id": session_id, "files": ingest_report}
+
+    async def _enrutar(self, mensaje_usuario: str, user_id: str, session_id: str) -> Optional[dict]:
+        """Decisión del router local (None si está deshabilitado o falla)."""
+        if not self.router or not (mensaje_usuario or "").strip():
+            return None
+        try:
+            files = await asyncio.to_thread(self.manifest.files, user_id, session_id)
+            names = [f.get("file_name") for f in files or [] if f.get("file_name")]
+            decision = await self.router.aroute(mensaje_usuario, names)
+        except Exception:
+            logging.exception("Router local falló; se usa el agente")
+            return None
+        logging.info(f"Router local: {self.router.stats()}")
+        return decision
+
+    async def _registrar_turno(self, session_id: str, mensaje_usuario: str, respuesta: str) -> None:
+        """
+        Agrega el turno a la memoria de la sesión (Cosmos, en un hilo); si hay
+        turnos de más, los pliega en el resumen en segundo plano (la respuesta
+        no espera al LLM).
+        """
+        try:
+            pendiente = await asyncio.to_thread(self.memory.append, session_id, mensaje_usuario, respuesta)
+        except Exception:
+            logging.exception(f"No se pudo agregar el turno a la memoria de {session_id}")
+            return
+        if pendiente:
+            # contexto limpio: el plegado no hereda el emisor SSE ni el contexto de tools
+            task = asyncio.create_task(self.memory.afold(session_id), context=contextvars.Context())
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    def _input_modelo(
+        self,
+        session_id: str,
+        mensaje_usuario: str,
+        files_uploaded_now: bool = False,
+        ok_names: Optional[List[str]] = None,
+        failed_text: str = "",
+    ) -> str:
+        # ------------------------------------------------------------
+        # Memoria: resumen + últimos turnos (presupuesto MEMORY_HISTORY_MAX_TOKENS)
+        # ------------------------------------------------------------
+        contexto_chat = self.memory.history(session_id)
 
         # ------------------------------------------------------------
-        # 9) Instrucción sistema para enrutar tools
+        # Instrucción sistema para enrutar tools
         # ------------------------------------------------------------
         if files_uploaded_now:
-            nombres = ", ".join([f.filename for f in files if f.filename])
+            nombres = ", ".join(ok_names or [])
+            no_indexados = f"Archivos que NO se pudieron indexar:{failed_text}\n" if failed_text else ""
             instruccion_sistema = (
                 f"SISTEMA: El usuario subió archivos: {nombres}. Ya están indexados.\n"
+                f"{no_indexados}"
                 "- Si la pregunta es sobre documentos subidos -> tool_rag_userdocs\n"
                 "- Si es sobre el índice del compa (corpus/jurisprudencia) -> tool_rag_corpus\n"
                 "- Si pide descargar/generar -> tool_generar_word\n"
@@ -290,7 +496,7 @@ class Orchestrator:
                 "- Si es charla -> tool_conversacional\n"
             )
 
-        input_modelo = f"""
+        return f"""
             Historial:
             {contexto_chat}
 
@@ -300,34 +506,336 @@ class Orchestrator:
             <asistente>:
             """
 
-        # ------------------------------------------------------------
-        # 10) Ejecutar agente
-        # ------------------------------------------------------------
-        respuesta = await asyncio.to_thread(self.agent.invoke, {"input": input_modelo})
+#endregion
 
-        raw_output = respuesta.get("output")
+# -----------------------------------------------------------------------------
+# region           MÉTODO STREAMING: EJECUTAR AGENTE CON SSE
+# -----------------------------------------------------------------------------
+    async def ejecutar_agente_stream(
+        self,
+        mensaje_usuario: str,
+        user_id: str,
+        session_id: Optional[str] = None,
+    ) -> tuple[str, AsyncIterator[tuple[str, object]]]:
+        """
+        Variante de ejecutar_agente (sin archivos) que emite eventos a medida
+        que ocurren:
+        - "session"   -> {session_id}
+        - "tool"      -> tool elegida por el agente
+        - "retrieval" -> chunks recuperados (userdocs / corpus)
+        - "token"     -> fragmentos de la respuesta
+        - "done"      -> respuesta final (misma forma que reply_text)
+        - "error"     -> {detail}
+        La sesión se valida antes de abrir el stream (los 401/409 salen como
+        respuesta HTTP normal). El mensaje se guarda en Cosmos al terminar,
+        aunque el cliente se haya desconectado.
+        """
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Usuario no autenticado.")
+        session_id = await asyncio.to_thread(self._resolver_sesion, user_id, session_id)
+        emitter = StreamEmitter()
+
+        async def _run() -> None:
+            token = bind_emitter(emitter)
+            try:
+                emitter.emit("session", {"session_id": session_id})
+                self.tools_class.bind_context(session_id=session_id, user_id=user_id, files=None)
+
+                # ainvoke corre en esta tarea: el agente y las tools ven el emisor
+                decision = await self._enrutar(mensaje_usuario, user_id, session_id)
+                if decision and decision["tool"]:
+                    emitter.emit("tool", {"name": decision["tool"], "input": mensaje_usuario, "router": decision})
+                    raw_output = await self.router_tools[decision["tool"]](mensaje_usuario)
+                    pasos = f"router:{decision['tool']}"
+                else:
+                    input_modelo = await asyncio.to_thread(self._input_modelo, session_id, mensaje_usuario)
+                    respuesta = await self.agent_stream.ainvoke(
+                        {"input": input_modelo},
+                        {"callbacks": [AgentStreamHandler(emitter)]},
+                    )
+                    raw_output = respuesta.get("output")
+                    pasos = respuesta.get("intermediate_steps")
+                output = raw_output.strip() if isinstance(raw_output, str) else raw_output
+                output_to_save = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False)
+
+                await self.cosmosdb.asave_message_chat(
+                    session_id=session_id,
+                    user_id=user_id,
+                    user_question=mensaje_usuario,
+                    ia_response=output_to_save,
+                    channel="web",
+                    extra={"tools": str(pasos), "router": decision, "mode": "stream"},
+                )
+                await self._registrar_turno(session_id, mensaje_usuario, output_to_save)
+                emitter.emit("done", {"reply_text": output, "session_id": session_id})
+            except Exception as e:
+                logging.exception(f"Error en streaming de la sesión {session_id}")
+                emitter.emit("error", {"detail": str(e)})
+            finally:
+                reset_emitter(token)
+                emitter.close()
+
+        # tarea aparte: si el cliente corta el stream, la respuesta igual se guarda
+        task = asyncio.create_task(_run())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return session_id, emitter.events()
 
-        # si el tool devuelve dict (return_direct=True) aquí llega dict
-        if isinstance(raw_output, str):
-            output = raw_output.strip()
-        else:
-            output = raw_output  # dict u otro tipo
+#endregion
 
-        # ------------------------------------------------------------
-        # 11) Guardar en Cosmos
-        # ------------------------------------------------------------
-        # Cosmos espera string, entonces si viene dict lo serializamos
-        output_to_save = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False)
+# -----------------------------------------------------------------------------
+# region           VALIDACIONES DE SESIÓN Y ARCHIVOS
+# -----------------------------------------------------------------------------
+    def _resolver_sesion(self, user_id: str, session_id: Optional[str]) -> str:
+        """
+        Si no viene session_id crea uno nuevo, respetando el límite de
+        conversaciones por usuario.
+        """
+        if session_id:
+            return session_id
+        user_sessions = self.cosmosdb.get_user_sessions(user_id)
+        if len(user_sessions) >= MAX_CONVERSATIONS_PER_USER:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Límite alcanzado: máximo {MAX_CONVERSATIONS_PER_USER} conversaciones por usuario."
+            )
+        return str(uuid.uuid4())
+
+    def _validar_archivos(self, files: List[UploadFile]) -> None:
+        for f in files:
+            ct = (f.content_type or "").lower()
+            name = f.filename or "archivo"
+
+            if ct not in ALLOWED_CT:
+                raise HTTPException(status_code=400, detail=f"Tipo no permitido: {name} ({ct})")
+
+    async def _reservar_archivos(
+        self, user_id: str, session_id: str, files: List[SpooledUpload]
+    ) -> list[dict]:
+        """
+        Reserva en el manifiesto un cupo por archivo antes de aceptar la
+        subida (límite MAX_FILES_PER_SESSION contando terminados + en curso).
+        La reserva es atómica: subidas concurrentes a la misma sesión no
+        pueden pasar el límite. Devuelve, por archivo, {"file_id", "previous"}
+        (previous = registro existente si el contenido ya está en la sesión).
+        """
+        entries = [
+            {"file_id": str(uuid.uuid4()), "file_name": f.filename or "archivo", "hash": f.sha256}
+            for f in files
+        ]
+        try:
+            previous = await asyncio.to_thread(
+                self.manifest.reserve, user_id, session_id, entries, MAX_FILES_PER_SESSION
+            )
+        except SessionFileLimitError as e:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Límite de archivos alcanzado ({MAX_FILES_PER_SESSION} máx). Ya tienes {e.existing}."
+            )
+        return [{"file_id": e["file_id"], "previous": p} for e, p in zip(entries, previous)]
+
+    async def _liberar_reservas(self, user_id: str, session_id: str, reservas: list[dict]) -> None:
+        file_ids = [r["file_id"] for r in reservas if r["previous"] is None]
+        if not file_ids:
+            return
+        try:
+            await asyncio.to_thread(self.manifest.release, user_id, session_id, *file_ids)
+        except Exception:
+            # vencen solas (INGEST_PENDING_TTL_MINUTES)
+            logging.exception(f"No se pudieron liberar las reservas de la sesión {session_id}")
 
-        self.cosmosdb.save_message_chat(
-            session_id=session_id,
-            user_id=user_id,
-            user_question=mensaje_usuario,
-            ia_response=output_to_save,
-            channel="web",
-            extra={"tools": str(respuesta.get("intermediate_steps"))},
+#endregion
+
+# -----------------------------------------------------------------------------
+# region           INGESTA EN SEGUNDO PLANO (JOBS)
+# -----------------------------------------------------------------------------
+    async def iniciar_ingesta(
+        self,
+        user_id: str,
+        session_id: Optional[str],
+        files: List[UploadFile],
+    ) -> dict:
+        """
+        Valida, registra un job y responde de inmediato; la ingesta corre en
+        segundo plano y su progreso se consulta con el job_id.
+        Las preguntas sobre la sesión funcionan para los archivos que ya
+        terminaron, porque cada archivo se indexa apenas se procesa.
+        """
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Usuario no autenticado.")
+        if not files:
+            raise HTTPException(status_code=400, detail="Se requiere al menos un archivo.")
+
+        session_id = await asyncio.to_thread(self._resolver_sesion, user_id, session_id)
+        self._validar_archivos(files)
+
+        # El UploadFile se cierra al terminar el request: copiarlo ya (spool a
+        # disco por encima de UPLOAD_SPOOL_MAX_MEMORY_MB, con límites de tamaño)
+        copies = await spool_uploads(files)
+
+        names = [f.filename for f in copies]
+        output = (
+            f"Recibí: {', '.join(names)}.\n"
+            "Los estoy procesando; te aviso el avance por archivo. "
+            "Mientras tanto puedes preguntar sobre los que ya terminen."
         )
+        reservas: list[dict] = []
+        job: Optional[dict] = None
+        try:
+            # el cupo se toma antes de aceptar el job (409 si no alcanza)
+            reservas = await self._reservar_archivos(user_id, session_id, copies)
+            job = await asyncio.to_thread(
+                self.ingest_jobs.create, user_id=user_id, session_id=session_id, file_names=names
+            )
+            await self.cosmosdb.asave_message_chat(
+                session_id=session_id,
+                user_id=user_id,
+                user_question="(subida de archivos)",
+                ia_response=output,
+                channel="web",
+                extra={"mode": "ingest_job", "job_id": job["id"]},
+            )
+            await self._registrar_turno(session_id, "(subida de archivos)", output)
+        except BaseException:
+            # el job no llegó a arrancar: nada queda pendiente ni en disco
+            if job is not None:
+                await asyncio.to_thread(self.ingest_jobs.set_status, job["id"], "failed")
+            await self._liberar_reservas(user_id, session_id, reservas)
+            for c in copies:
+                c.discard()
+            raise
+        job_id = job["id"]
+
+        task = asyncio.create_task(self._run_ingest_job(job_id, copies, user_id, session_id, reservas))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+        return {
+            "reply_text": output,
+            "session_id": session_id,
+            "job_id": job_id,
+            "status": job["status"],
+            "status_url": f"/api/upload/jobs/{job_id}",
+        }
+
+    async def _run_ingest_job(
+        self,
+        job_id: str,
+        files: List[SpooledUpload],
+        user_id: str,
+        session_id: str,
+        reservas: Optional[list[dict]] = None,
+    ) -> None:
+        jobs = self.ingest_jobs
+        heartbeat = asyncio.create_task(self._job_heartbeat(job_id))
+        try:
+            await asyncio.to_thread(jobs.set_status, job_id, "running")
+            report = await self._ingest_files(files, user_id, session_id, job_id=job_id, reservas=reservas)
+            status = await asyncio.to_thread(jobs.finish, job_id, report)
+            logging.info(f"Job de ingesta {job_id} terminó: {status}")
+        except Exception:
+            logging.exception(f"Job de ingesta {job_id} falló")
+            await asyncio.to_thread(jobs.set_status, job_id, "failed")
+            if reservas:
+                # la ingesta libera sus reservas al fallar; esto cubre lo que no llegó a empezar
+                await self._liberar_reservas(user_id, session_id, reservas)
+        finally:
+            heartbeat.cancel()
+            for f in files:
+                f.discard()
+
+    async def _job_heartbeat(self, job_id: str) -> None:
+        """
+        Mantiene vivo el job mientras corre (un archivo grande puede pasar
+        minutos sin reportar progreso); sin latido, la consulta lo da por
+        huérfano tras INGEST_JOB_STALE_SECONDS.
+        """
+        while True:
+            await asyncio.sleep(settings.INGEST_JOB_HEARTBEAT_SECONDS)
+            await asyncio.to_thread(self.ingest_jobs.touch, job_id)
+
+#endregion
 
-        return {"reply_text": output, "session_id": session_id}
+# -----------------------------------------------------------------------------
+# region           INGESTA CONCURRENTE DE ARCHIVOS
+# -----------------------------------------------------------------------------
+    async def _ingest_files(
+        self,
+        files: List[SpooledUpload],
+        user_id: str,
+        session_id: str,
+        job_id: Optional[str] = None,
+        reservas: Optional[list[dict]] = None,
+    ) -> list[dict]:
+        """
+        Ingesta los archivos en paralelo (extracción, embeddings e indexación).
+        - Máximo INGEST_MAX_CONCURRENCY_PER_REQUEST archivos a la vez por request.
+        - Máximo INGEST_MAX_CONCURRENCY_PROCESS en todo el proceso (ingest_executor).
+        - Un archivo fallido se reporta y no aborta los demás.
+        - Con job_id, el progreso por archivo se escribe en el job.
+        - Con reservas (_reservar_archivos), cada archivo usa su cupo ya
+          reservado y los duplicados de la sesión se omiten sin ingestarlos.
+        Devuelve un reporte por archivo, en el mismo orden de `files`.
+        """
+        sem = asyncio.Semaphore(settings.INGEST_MAX_CONCURRENCY_PER_REQUEST)
+        loop = asyncio.get_running_loop()
+        jobs = self.ingest_jobs
+        if self.summarizer:
+            # los resúmenes que encola la ingesta (desde su pool) corren en este loop
+            self.summarizer.bind_loop(loop)
+
+        async def _one(idx: int, f: SpooledUpload) -> dict:
+            ct = (f.content_type or "").lower()
+            name = f.filename or "archivo"
+            progress = jobs.file_reporter(job_id, idx) if job_id else None
+            reserva = reservas[idx] if reservas else None
+            async with sem:
+                try:
+                    if job_id:
+                        await asyncio.to_thread(jobs.update_file, job_id, idx, status="processing")
+                    if reserva and reserva["previous"] is not None:
+                        previous = reserva["previous"]
+                        res = {
+                            "file_name": name,
+                            "file_id": previous.get("file_id"),
+                            "chunks": previous.get("chunks", 0),
+                            "dedup": "session_duplicate",
+                        }
+                    else:
+                        # el archivo va en spool: la extracción lo lee desde disco
+                        res = await loop.run_in_executor(
+                            self.ingest_executor,
+                            self.ingestor.ingest,
+                            f,
+                            ct,
+                            name,
+                            user_id,
+                            session_id,
+                            progress,
+                            reserva["file_id"] if reserva else None,
+                        )
+                    res = {**res, "ok": True}
+                    if job_id:
+                        await asyncio.to_thread(
+                            jobs.update_file,
+                            job_id, idx,
+                            status="skipped" if res.get("dedup") == "session_duplicate" else "done",
+                            file_id=res.get("file_id"),
+                            chunks=res.get("chunks", 0),
+                            chunks_embedded=res.get("chunks", 0),
+                            docs_indexed=res.get("chunks", 0),
+                        )
+                    return res
+                except Exception as e:
+                    logging.exception(f"Error ingestando {name} en sesión {session_id}")
+                    if reserva:
+                        await self._liberar_reservas(user_id, session_id, [reserva])
+                    if job_id:
+                        await asyncio.to_thread(jobs.update_file, job_id, idx, status="failed", error=str(e))
+                    return {"file_name": name, "file_id": None, "chunks": 0, "ok": False, "error": str(e)}
+
+        report = list(await asyncio.gather(*(_one(i, f) for i, f in enumerate(files))))
+        logging.info(f"Métricas de ingesta: {self.ingestor.metrics()}")
+        return report
 
 #endregion
\ No newline at end of file
@@ -1,5 +1,6 @@
 import re
 from langchain.schema import HumanMessage
+from helpers.rate_limit import llm_limiter
 
 system_prompt_agente = """
 Eres un asistente jurídico especializado en jurisprudencia del Consejo de Estado (Colombia).
@@ -94,12 +95,39 @@ CONTEXTO JURÍDICO DISPONIBLE
 """
 
 
-def generate_session_title(llm, user_question: str) -> str:
-    q = (user_question or "").strip()
-    if not q:
-        return "Nueva conversación"
+system_prompt_resumen_documento = """
+Eres un asistente jurídico. Recibirás un extracto (inicio y final) de un
+documento judicial colombiano. Devuelve SOLO un JSON con estas claves:
+{
+  "resumen": "<3 a 5 líneas: de qué trata, pretensión o asunto y decisión si la hay>",
+  "tipo_documento": "<p. ej. demanda, auto, sentencia, tutela, recurso, concepto>",
+  "radicado": "<número de radicado tal como aparece, o null>",
+  "partes": ["<rol: nombre>", "..."]
+}
+Reglas:
+- Usa ÚNICAMENTE el texto recibido. No inventes nombres, fechas ni radicados.
+- Si un dato no aparece, usa null (o [] para partes).
+- Responde en español.
+"""
+
+
+system_prompt_memoria = """
+Eres un asistente jurídico que mantiene la memoria de una conversación.
+Recibirás el RESUMEN ACTUAL (puede estar vacío) y los TURNOS más antiguos
+que ya no se envían literales. Devuelve SOLO el resumen actualizado.
+Reglas:
+- Conserva lo que se necesite para continuar la conversación: nombre y
+  datos que el usuario dio de sí mismo, documentos y radicados mencionados,
+  preguntas hechas y conclusiones o respuestas clave, tareas pendientes.
+- Omite saludos, fórmulas de cortesía y el detalle de análisis largos
+  (deja solo su conclusión).
+- No inventes nada que no esté en el resumen o en los turnos.
+- Máximo 15 viñetas cortas, en español.
+"""
+
 
-    prompt = (
+def _session_title_prompt(q: str) -> str:
+    return (
         "Genera un título MUY corto (2 a 3 palabras) para nombrar esta conversación.\n"
         "Reglas:\n"
         "- SOLO devuelve el título (sin comillas, sin punto final, sin emojis).\n"
@@ -110,12 +138,8 @@ def generate_session_title(llm, user_question: str) -> str:
         "Título:"
     )
 
-    try:
-        resp = llm.invoke([HumanMessage(content=prompt)])
-        title = (resp.content or "").strip()
-    except Exception:
-        title = "Nueva conversación"
 
+def _clean_session_title(title: str) -> str:
     title = title.replace("\n", " ").strip()
     title = re.sub(r"[\"“”'`]", "", title)
     title = re.sub(r"\b\d+\b", "", title).strip()
@@ -136,6 +160,36 @@ def generate_session_title(llm, user_question: str) -> str:
 
     return title
 
+
+def generate_session_title(llm, user_question: str) -> str:
+    q = (user_question or "").strip()
+    if not q:
+        return "Nueva conversación"
+
+    try:
+        resp = llm.invoke([HumanMessage(content=_session_title_prompt(q))])
+        title = (resp.content or "").strip()
+    except Exception:
+        title = "Nueva conversación"
+
+    return _clean_session_title(title)
+
+
+async def agenerate_session_title(llm, user_question: str) -> str:
+    """Igual que generate_session_title, con ainvoke bajo llm_limiter (para el event loop)."""
+    q = (user_question or "").strip()
+    if not q:
+        return "Nueva conversación"
+
+    try:
+        async with llm_limiter:
+            resp = await llm.ainvoke([HumanMessage(content=_session_title_prompt(q))])
+        title = (resp.content or "").strip()
+    except Exception:
+        title = "Nueva conversación"
+
+    return _clean_session_title(title)
+
 # def build_prompt(section: str, context: str) -> str:
 #     return f"""
 # Eres un magistrado auxiliar de la Corte Suprema de Justicia de Colombia,
@@ -0,0 +1,46 @@
+import time
+import asyncio
+from app.config import settings
+
+
+class AsyncRateLimiter:
+    """
+    Límite para llamadas async a Azure OpenAI:
+    - max_concurrency: llamadas en vuelo a la vez (semáforo)
+    - per_minute: si > 0, espaciado mínimo entre inicios de llamada (60 / per_minute s)
+    Se usa como `async with limiter:`. Con el camino async, lo que acota las
+    conversaciones en paralelo es esto (configurable) y no el número de hilos.
+    """
+
+    def __init__(self, max_concurrency: int, per_minute: int = 0) -> None:
+        self.max_concurrency = max_concurrency
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self._pace_lock = asyncio.Lock()
+        self._next_start = 0.0
+
+    async def __aenter__(self) -> "AsyncRateLimiter":
+        await self._sem.acquire()
+        try:
+            if self.interval:
+                await self._pace()
+        except BaseException:
+            self._sem.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._sem.release()
+
+    async def _pace(self) -> None:
+        async with self._pace_lock:
+            now = time.monotonic()
+            wait = max(0.0, self._next_start - now)
+            self._next_start = max(now, self._next_start) + self.interval
+        if wait:
+            await asyncio.sleep(wait)
+
+
+# Compartidos por todo el proceso (chat: RAG + tools; embeddings de consultas)
+llm_limiter = AsyncRateLimiter(settings.LLM_MAX_CONCURRENCY, settings.LLM_REQUESTS_PER_MINUTE)
+embedding_limiter = AsyncRateLimiter(settings.EMBEDDING_MAX_CONCURRENCY, settings.EMBEDDING_REQUESTS_PER_MINUTE)
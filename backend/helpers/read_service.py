@@ -1,7 +1,47 @@
 import re
+import asyncio
+import logging
+from io import BytesIO
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, Union
+import pymupdf
+from docx import Document
 from azure.core.credentials import AzureKeyCredential
 from azure.ai.documentintelligence import DocumentIntelligenceClient
+from azure.ai.documentintelligence.aio import DocumentIntelligenceClient as AsyncDocumentIntelligenceClient
 from app.config import settings
+from helpers.upload_spool import SpooledUpload
+
+# Un archivo a extraer: bytes en memoria o una subida en spool (memoria/disco)
+FileSource = Union[bytes, SpooledUpload]
+
+
+@contextmanager
+def open_source(source: FileSource) -> Iterator[Union[bytes, BinaryIO]]:
+    """
+    Cuerpo para Document Intelligence / python-docx: los bytes tal cual o,
+    si la subida está en disco, un archivo abierto (se lee por streaming).
+    """
+    if isinstance(source, SpooledUpload):
+        if source.in_memory:
+            yield source.read_bytes()
+            return
+        fh = source.open()
+        try:
+            yield fh
+        finally:
+            fh.close()
+        return
+    yield source
+
+
+def open_pdf(source: FileSource) -> "pymupdf.Document":
+    # desde disco pymupdf carga las páginas a demanda, sin copiar el archivo a memoria
+    if isinstance(source, SpooledUpload) and not source.in_memory:
+        return pymupdf.open(source.path, filetype="pdf")
+    data = source.read_bytes() if isinstance(source, SpooledUpload) else source
+    return pymupdf.open(stream=data, filetype="pdf")
+
 
 class DocumentIntelligenceExtractor:
     def __init__(self) -> None:
@@ -10,31 +50,319 @@ class DocumentIntelligenceExtractor:
             credential=AzureKeyCredential(settings.AZURE_FORM_RECOGNIZER_API_KEY),
         )
 
-    def extract_text(self, file_bytes: bytes, content_type: str) -> str:
+    def extract_text(self, file_bytes: FileSource, content_type: str) -> str:
+        return "\n".join(self.extract_pages(file_bytes, content_type)).strip()
+
+    def route(self, file_bytes: FileSource, content_type: str) -> tuple[str, Iterator[str]]:
+        """
+        PDFs grandes (>= DI_SPLIT_MIN_PAGES) se analizan por rangos de páginas
+        en paralelo; el resto en una sola operación.
+        """
+        page_count = self._pdf_page_count(file_bytes) if content_type == "application/pdf" else 0
+        if page_count >= settings.DI_SPLIT_MIN_PAGES:
+            return (
+                "document_intelligence_segmented",
+                self._extract_pages_segmented(file_bytes, content_type, page_count),
+            )
+        return "document_intelligence", self._extract_pages_single(file_bytes, content_type)
+
+    def extract_pages(self, file_bytes: FileSource, content_type: str) -> Iterator[str]:
+        """
+        Igual que extract_text, pero entrega el texto página por página
+        para que la ingesta pueda ir chunkeando/embebiendo en streaming.
+        """
+        return self.route(file_bytes, content_type)[1]
+
+    def extract_pdf_page_numbers(self, file_bytes: FileSource, page_numbers: list[int]) -> dict[int, str]:
+        """
+        OCR solo de algunas páginas de un PDF (1-based): las junta en un
+        sub-PDF y lo analiza en una operación. Devuelve {página: texto}.
+        """
+        with open_pdf(file_bytes) as src, pymupdf.open() as part:
+            for n in page_numbers:
+                part.insert_pdf(src, from_page=n - 1, to_page=n - 1)
+            body = part.tobytes(garbage=3, deflate=True)
+
         poller = self.client.begin_analyze_document(
             model_id="prebuilt-layout",
-            body=file_bytes,
-            content_type=content_type,
+            body=body,
+            content_type="application/pdf",
         )
-        result = poller.result()
+        texts: dict[int, str] = {}
+        for number, text in self._pages_from_result(poller.result()):
+            # el fallback por párrafos no trae página: va a la primera
+            original = page_numbers[number - 1] if number else page_numbers[0]
+            texts[original] = f"{texts[original]}\n{text}" if original in texts else text
+        return texts
+
+    def _extract_pages_single(self, file_bytes: FileSource, content_type: str) -> Iterator[str]:
+        with open_source(file_bytes) as body:
+            poller = self.client.begin_analyze_document(
+                model_id="prebuilt-layout",
+                body=body,
+                content_type=content_type,
+            )
+            result = poller.result()
 
-        lines: list[str] = []
+        for _, text in self._pages_from_result(result):
+            yield text
+
+    @staticmethod
+    def _pdf_page_count(file_bytes: FileSource) -> int:
+        try:
+            with open_pdf(file_bytes) as doc:
+                return doc.page_count
+        except Exception:
+            return 0
+
+    @staticmethod
+    def _pages_from_result(result) -> list[tuple[int, str]]:
+        """
+        [(número de página, texto)] a partir de un AnalyzeResult.
+        Si no hay líneas por página, usa los párrafos como una sola página.
+        """
+        pages: list[tuple[int, str]] = []
 
         if getattr(result, "pages", None):
             for page in result.pages:
+                lines: list[str] = []
                 if getattr(page, "lines", None):
                     for line in page.lines:
                         t = (line.content or "").strip()
                         if t:
                             lines.append(t)
+                if lines:
+                    pages.append((page.page_number, "\n".join(lines)))
 
-        if not lines and getattr(result, "paragraphs", None):
+        if not pages and getattr(result, "paragraphs", None):
+            lines = []
             for p in result.paragraphs:
                 t = (p.content or "").strip()
                 if t:
                     lines.append(t)
+            if lines:
+                pages.append((0, "\n".join(lines)))
+
+        return pages
+
+    # ------------------------------------------------------------
+    # PDFs grandes: rangos de páginas en paralelo (cliente async)
+    # ------------------------------------------------------------
+    def _extract_pages_segmented(self, file_bytes: FileSource, content_type: str, page_count: int) -> Iterator[str]:
+        """
+        Divide el PDF en rangos de DI_PAGES_PER_SEGMENT páginas y los analiza
+        como operaciones concurrentes (máx. DI_MAX_CONCURRENT_SEGMENTS).
+        Corre su propio event loop en el hilo de ingesta: el polling es
+        asyncio.sleep, no bloquea hilos del executor compartido. Por eso se
+        debe consumir desde un hilo sin loop (executor / asyncio.to_thread):
+        llamado desde un event loop lanza RuntimeError.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError(
+                "La extracción segmentada corre su propio event loop: llamarla desde "
+                "un hilo sin loop (run_in_executor / asyncio.to_thread)."
+            )
+
+        size = settings.DI_PAGES_PER_SEGMENT
+        ranges = [(a, min(a + size - 1, page_count)) for a in range(1, page_count + 1, size)]
+        results = asyncio.run(self._analyze_ranges(file_bytes, content_type, ranges))
+
+        pages: list[tuple[int, str]] = []
+        for (first, _), res in zip(ranges, results):
+            for number, text in self._pages_from_result(res):
+                # cada segmento es un PDF aparte (páginas desde 1); el fallback
+                # por párrafos no trae página: usa el inicio del rango
+                pages.append((first + number - 1 if number else first, text))
+        pages.sort(key=lambda x: x[0])
+        for _, text in pages:
+            yield text
+
+    @staticmethod
+    def _pdf_range(src: "pymupdf.Document", first: int, last: int) -> bytes:
+        """Sub-PDF con las páginas first..last (1-based, inclusivo)."""
+        with pymupdf.open() as part:
+            part.insert_pdf(src, from_page=first - 1, to_page=last - 1)
+            return part.tobytes(garbage=3, deflate=True)
+
+    async def _analyze_ranges(self, file_bytes: FileSource, content_type: str, ranges: list[tuple[int, int]]) -> list:
+        sem = asyncio.Semaphore(settings.DI_MAX_CONCURRENT_SEGMENTS)
+
+        async with AsyncDocumentIntelligenceClient(
+            endpoint=settings.AZURE_FORM_RECOGNIZER_ENDPOINT,
+            credential=AzureKeyCredential(settings.AZURE_FORM_RECOGNIZER_API_KEY),
+        ) as client:
+
+            async def _one(src: "pymupdf.Document", first: int, last: int):
+                async with sem:
+                    # solo las páginas del rango: cada segmento sube su parte,
+                    # no el PDF completo (en memoria, máx. un sub-PDF por segmento activo)
+                    body = self._pdf_range(src, first, last)
+                    poller = await client.begin_analyze_document(
+                        model_id="prebuilt-layout",
+                        body=body,
+                        content_type=content_type,
+                    )
+                    return await poller.result()
+
+            with open_pdf(file_bytes) as src:
+                return await asyncio.gather(*(_one(src, a, b) for a, b in ranges))
+
+
+class LocalTextExtractor:
+    """
+    Extracción en proceso (sin llamadas remotas):
+    - DOCX con python-docx (párrafos y tablas en orden del cuerpo)
+    - PDF con capa de texto con pymupdf (página por página); las páginas
+      que son solo imagen se informan para que el router les haga OCR
+    El formato de salida imita el de Document Intelligence: una línea de
+    texto por renglón y sin líneas vacías.
+    """
+
+    def __init__(
+        self,
+        min_chars_per_page: int | None = None,
+        min_text_page_ratio: float | None = None,
+        docx_paragraphs_per_page: int = 40,
+    ) -> None:
+        self.min_chars_per_page = min_chars_per_page or settings.LOCAL_PDF_MIN_CHARS_PER_PAGE
+        self.min_text_page_ratio = min_text_page_ratio or settings.LOCAL_PDF_MIN_TEXT_PAGE_RATIO
+        self.docx_paragraphs_per_page = docx_paragraphs_per_page
+
+    @staticmethod
+    def _lines(text: str) -> str:
+        return "\n".join(t.strip() for t in (text or "").splitlines() if t.strip())
+
+    def extract_docx_pages(self, file_bytes: FileSource) -> list[str]:
+        """
+        DOCX no tiene páginas: agrupa cada N bloques (párrafo o fila de tabla)
+        en una "página" para que la ingesta siga trabajando en streaming.
+        """
+        with open_source(file_bytes) as body:
+            doc = Document(BytesIO(body) if isinstance(body, bytes) else body)
+        blocks: list[str] = []
+        for el in doc.element.body.iterchildren():
+            tag = el.tag.rsplit("}", 1)[-1]
+            if tag == "p":
+                t = "".join(node.text or "" for node in el.iter() if node.tag.endswith("}t")).strip()
+                if t:
+                    blocks.append(t)
+            elif tag == "tbl":
+                for row in el.iter():
+                    if not row.tag.endswith("}tr"):
+                        continue
+                    cells = []
+                    for cell in row.iterchildren():
+                        if cell.tag.endswith("}tc"):
+                            ct = " ".join(
+                                (node.text or "").strip() for node in cell.iter() if node.tag.endswith("}t")
+                            ).strip()
+                            if ct:
+                                cells.append(ct)
+                    if cells:
+                        blocks.append(" | ".join(cells))
+
+        n = self.docx_paragraphs_per_page
+        return ["\n".join(blocks[i:i + n]) for i in range(0, len(blocks), n)]
+
+    def extract_pdf_pages(self, file_bytes: FileSource) -> Optional[tuple[list[tuple[int, str]], list[int]]]:
+        """
+        Si el PDF tiene una capa de texto usable devuelve
+        ([(página, texto)], [páginas solo imagen]): las segundas no tienen
+        texto pero sí imágenes (escaneadas) y necesitan OCR. Las páginas en
+        blanco se omiten. None si casi todo el PDF parece escaneado (menos de
+        min_text_page_ratio de páginas con texto) o el texto es basura.
+        """
+        with open_pdf(file_bytes) as doc:
+            if doc.page_count == 0:
+                return None
+            pages: list[tuple[int, str]] = []
+            image_only: list[int] = []
+            for page in doc:
+                text = self._lines(page.get_text("text"))
+                if len(text) < self.min_chars_per_page and page.get_images():
+                    image_only.append(page.number + 1)
+                elif text:
+                    pages.append((page.number + 1, text))
+            page_count = doc.page_count
+
+        with_text = [t for _, t in pages if len(t) >= self.min_chars_per_page]
+        if len(with_text) / page_count < self.min_text_page_ratio:
+            return None
+
+        # fuentes sin mapa unicode producen texto ilegible: exigir mayoría de letras/espacios
+        sample = "".join(with_text)[:20000]
+        readable = sum(1 for c in sample if c.isalnum() or c.isspace() or c in ".,;:()-\"'%$/")
+        if readable / max(len(sample), 1) < 0.85:
+            return None
+
+        return pages, image_only
+
+
+class TextExtractionRouter:
+    """
+    Decide cómo extraer el texto de cada archivo:
+    - DOCX                      -> local (python-docx)
+    - PDF con capa de texto     -> local (pymupdf); sus páginas solo imagen,
+                                   OCR con Document Intelligence (solo esas)
+    - PDF escaneado / imagen    -> Document Intelligence (prebuilt-layout)
+    route() devuelve (método usado, páginas).
+    """
+
+    DOCX_CT = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    PDF_CT = "application/pdf"
+
+    def __init__(
+        self,
+        remote: DocumentIntelligenceExtractor,
+        local: LocalTextExtractor | None = None,
+        local_enabled: bool | None = None,
+    ) -> None:
+        self.remote = remote
+        self.local = local or LocalTextExtractor()
+        self.local_enabled = settings.LOCAL_EXTRACTION_ENABLED if local_enabled is None else local_enabled
+
+    def route(self, file_bytes: FileSource, content_type: str) -> tuple[str, Iterator[str]]:
+        ct = (content_type or "").lower()
+        if self.local_enabled:
+            try:
+                if ct == self.DOCX_CT:
+                    return "local_docx", iter(self.local.extract_docx_pages(file_bytes))
+                local_pdf = self.local.extract_pdf_pages(file_bytes) if ct == self.PDF_CT else None
+            except Exception as e:
+                # archivo raro/corrupto para las librerías locales: que lo intente DI
+                logging.warning(f"Extracción local falló ({ct}), se usa Document Intelligence: {e}")
+                local_pdf = None
+            if local_pdf is not None:
+                pages, image_only = local_pdf
+                if not image_only:
+                    return "local_pdf", iter(t for _, t in pages)
+                return "local_pdf+ocr", iter(self._with_ocr(file_bytes, pages, image_only))
+        return self.remote.route(file_bytes, content_type)
+
+    def _with_ocr(self, file_bytes: FileSource, pages: list[tuple[int, str]], image_only: list[int]) -> list[str]:
+        """Completa el texto local con el OCR de las páginas que son solo imagen."""
+        logging.info(
+            f"PDF con {len(image_only)} página(s) sin capa de texto {image_only}: "
+            "se extraen con Document Intelligence"
+        )
+        ocr = self.remote.extract_pdf_page_numbers(file_bytes, image_only)
+        empty = [n for n in image_only if not ocr.get(n)]
+        if empty:
+            logging.warning(f"Páginas sin texto tras el OCR (se omiten): {empty}")
+        merged = pages + [(n, t) for n, t in ocr.items() if t]
+        merged.sort(key=lambda x: x[0])
+        return [t for _, t in merged]
+
+    def extract_pages(self, file_bytes: FileSource, content_type: str) -> Iterator[str]:
+        return self.route(file_bytes, content_type)[1]
+
+    def extract_text(self, file_bytes: FileSource, content_type: str) -> str:
+        return "\n".join(self.extract_pages(file_bytes, content_type)).strip()
 
-        return "\n".join(lines).strip()
 
 class TextCleaner:
     def clean(self, text: str) -> str:
@@ -0,0 +1,324 @@
+import math
+import re
+import asyncio
+import time
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import numpy as np
+from app.config import settings
+
+# Constantes de RRF y BM25 (mismos valores por defecto que Azure AI Search)
+RRF_K = 60
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Caché de índices: segundos que se reutiliza la versión leída del manifiesto
+# (answer_per_document consulta una vez por archivo) y espera antes de
+# reintentar una carga fallida
+VERSION_TTL_SECONDS = 5.0
+RELOAD_BACKOFF_SECONDS = 30.0
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> list[str]:
+    # similar al analizador estándar: minúsculas y palabras unicode
+    return _TOKEN_RE.findall(unicodedata.normalize("NFC", (text or "").lower()))
+
+
+class SessionVectorIndex:
+    """
+    Índice en memoria de los chunks de una sesión:
+    - matriz NumPy de vectores normalizados (coseno = producto punto)
+    - índice BM25 sobre content + file_name
+    - búsqueda híbrida con Reciprocal Rank Fusion, como hybrid_search en Azure
+    """
+
+    def __init__(self, docs: list[dict], version: tuple) -> None:
+        self.version = version
+        self.docs = [
+            {k: d.get(k) for k in ("content", "file_name", "chunk_id", "file_id")}
+            for d in docs
+        ]
+        if docs:
+            vectors = np.asarray([d["content_vector"] for d in docs], dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.matrix = vectors / norms
+        else:
+            # sesión sin chunks: dimensions = 0, nunca se usa para buscar
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.dimensions = self.matrix.shape[1]
+        self.file_ids = np.asarray([d.get("file_id") or "" for d in docs], dtype=object)
+
+        # BM25: postings término -> {doc: tf}
+        self.postings: dict[str, dict[int, int]] = defaultdict(dict)
+        lengths = []
+        for i, d in enumerate(docs):
+            toks = tokenize(f"{d.get('content') or ''} {d.get('file_name') or ''}")
+            lengths.append(len(toks))
+            for t in toks:
+                self.postings[t][i] = self.postings[t].get(i, 0) + 1
+        self.doc_len = np.asarray(lengths, dtype=np.float32)
+        self.avg_len = float(self.doc_len.mean()) if len(lengths) else 0.0
+
+        text_bytes = sum(len(d["content"] or "") for d in self.docs)
+        posting_bytes = sum(len(p) for p in self.postings.values()) * 16
+        self.nbytes = int(self.matrix.nbytes + text_bytes + posting_bytes)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _vector_ranking(self, query_vector: list[float], mask: Optional[np.ndarray], k: int) -> list[int]:
+        if not self.docs:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32)
+        n = np.linalg.norm(q)
+        if n:
+            q = q / n
+        scores = self.matrix @ q
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        k = min(k, int(mask.sum()) if mask is not None else len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])].tolist()
+
+    def _bm25_ranking(self, question: str, mask: Optional[np.ndarray], k: int) -> list[int]:
+        scores: dict[int, float] = defaultdict(float)
+        n_docs = len(self.docs)
+        for term in set(tokenize(question)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for i, tf in posting.items():
+                if mask is not None and not mask[i]:
+                    continue
+                denom = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[i] / (self.avg_len or 1.0))
+                scores[i] += idf * tf * (BM25_K1 + 1) / denom
+        return sorted(scores, key=scores.get, reverse=True)[:k]
+
+    def hybrid_search(
+        self,
+        question: str,
+        query_vector: list[float],
+        top_k: int,
+        file_id: Optional[str] = None,
+    ) -> list[dict]:
+        mask = (self.file_ids == file_id) if file_id else None
+        # Azure fusiona los k vecinos del vector con el ranking de texto
+        rankings = [
+            self._vector_ranking(query_vector, mask, top_k),
+            self._bm25_ranking(question, mask, max(top_k, 50)),
+        ]
+        fused: dict[int, float] = defaultdict(float)
+        for ranking in rankings:
+            for rank, i in enumerate(ranking, start=1):
+                fused[i] += 1.0 / (RRF_K + rank)
+        best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        return [dict(self.docs[i], **{"@search.score": fused[i]}) for i in best]
+
+
+class SessionIndexCache:
+    """
+    Índices en memoria por sesión activa, con LRU por memoria (max_bytes).
+    - Se cargan en segundo plano la primera vez que se consulta la sesión;
+      mientras tanto (o si algo falla) se responde con Azure AI Search.
+    - La versión es (n° de archivos, n° de chunks) del manifiesto de la
+      sesión: si cambia (nueva ingesta), el índice se descarta y se recarga.
+    """
+
+    def __init__(self, indexer, manifest, max_bytes: int, max_chunks: int) -> None:
+        self.indexer = indexer
+        self.manifest = manifest
+        self.max_bytes = max_bytes
+        self.max_chunks = max_chunks
+        self._items: OrderedDict[str, SessionVectorIndex] = OrderedDict()
+        self._loading: set[str] = set()
+        self._versions: dict[str, tuple[float, Optional[tuple]]] = {}
+        self._retry_at: dict[str, float] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="session-index")
+        self._stats = {"local": 0, "remote": 0, "loads": 0, "evictions": 0}
+
+    @staticmethod
+    def _key(user_id: str, session_id: str) -> str:
+        return f"{user_id}\x00{session_id}"
+
+    def _version(self, key: str, user_id: str, session_id: str) -> Optional[tuple]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(key)
+        if cached and now - cached[0] < VERSION_TTL_SECONDS:
+            return cached[1]
+        files = self.manifest.files(user_id, session_id)
+        version = (len(files), sum(int(f.get("chunks") or 0) for f in files)) if files else None
+        with self._lock:
+            if len(self._versions) > 10000:
+                self._versions.clear()
+            self._versions[key] = (now, version)
+        return version
+
+    def get(self, user_id: str, session_id: str) -> Optional[SessionVectorIndex]:
+        """Índice listo para usar, o None (y programa su carga si corresponde)."""
+        key = self._key(user_id, session_id)
+        try:
+            version = self._version(key, user_id, session_id)
+        except Exception:
+            logging.exception("No se pudo leer el manifiesto para el índice local")
+            version = None
+        if version is None or version[1] > self.max_chunks:
+            self._count("remote")
+            return None
+
+        with self._lock:
+            idx = self._items.get(key)
+            if idx is not None and idx.version == version:
+                self._items.move_to_end(key)
+                self._stats["local"] += 1
+                return idx
+            if idx is not None:
+                self._drop(key)
+            self._stats["remote"] += 1
+            if key not in self._loading and self._retry_at.get(key, 0.0) <= time.monotonic():
+                self._loading.add(key)
+                self._pool.submit(self._load, key, user_id, session_id, version)
+        return None
+
+    def _load(self, key: str, user_id: str, session_id: str, version: tuple) -> None:
+        try:
+            docs = self.indexer.get_session_chunks(user_id=user_id, session_id=session_id)
+            # el índice de Search puede ir atrasado respecto al manifiesto
+            if len(docs) != version[1]:
+                logging.info(f"Índice local de {session_id}: {len(docs)} chunks != {version[1]} del manifiesto")
+                with self._lock:
+                    self._retry_at[key] = time.monotonic() + RELOAD_BACKOFF_SECONDS
+                return
+            idx = SessionVectorIndex(docs, version)
+            with self._lock:
+                self._retry_at.pop(key, None)
+                self._drop(key)
+                self._items[key] = idx
+                self._bytes += idx.nbytes
+                self._stats["loads"] += 1
+                while self._bytes > self.max_bytes and len(self._items) > 1:
+                    old_key = next(iter(self._items))
+                    self._drop(old_key)
+                    self._stats["evictions"] += 1
+        except Exception:
+            logging.exception(f"No se pudo cargar el índice local de la sesión {session_id}")
+            with self._lock:
+                self._retry_at[key] = time.monotonic() + RELOAD_BACKOFF_SECONDS
+        finally:
+            with self._lock:
+                self._loading.discard(key)
+
+    def _drop(self, key: str) -> None:
+        # dentro del lock
+        idx = self._items.pop(key, None)
+        if idx is not None:
+            self._bytes -= idx.nbytes
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, sessions=len(self._items), bytes=self._bytes, max_bytes=self.max_bytes)
+
+
+class LocalFirstSearchIndexer:
+    """
+    Misma interfaz de búsqueda que AzureSearchIndexer, pero resuelve
+    hybrid_search / hybrid_search_by_file en memoria cuando la sesión ya
+    está cargada. Azure AI Search sigue siendo la fuente de verdad y el
+    fallback; el resto de métodos se delega al indexer original.
+    """
+
+    def __init__(self, indexer, cache: SessionIndexCache) -> None:
+        self.indexer = indexer
+        self.cache = cache
+
+    def _local(self, user_id: str, session_id: str, query_vector: list[float]) -> Optional[SessionVectorIndex]:
+        idx = self.cache.get(user_id, session_id)
+        if idx is None or idx.dimensions != len(query_vector):
+            return None
+        return idx
+
+    def hybrid_search(self, question: str, query_vector: list[float], user_id: str, session_id: str, top_k: int = 6) -> list[dict]:
+        idx = self._local(user_id, session_id, query_vector)
+        if idx is None:
+            return self.indexer.hybrid_search(
+                question=question, query_vector=query_vector,
+                user_id=user_id, session_id=session_id, top_k=top_k,
+            )
+        return idx.hybrid_search(question, query_vector, top_k)
+
+    def hybrid_search_by_file(
+        self,
+        question: str,
+        query_vector: list[float],
+        user_id: str,
+        session_id: str,
+        file_id: str,
+        top_k: int = 4
+    ) -> list[dict]:
+        idx = self._local(user_id, session_id, query_vector)
+        if idx is None:
+            return self.indexer.hybrid_search_by_file(
+                question=question, query_vector=query_vector,
+                user_id=user_id, session_id=session_id, file_id=file_id, top_k=top_k,
+            )
+        return idx.hybrid_search(question, query_vector, top_k, file_id=file_id)
+
+    # Versiones async: get() puede leer el manifiesto o cargar la sesión desde
+    # Azure (sync), así que va a un hilo; la búsqueda en memoria corre en el loop.
+    async def ahybrid_search(self, question: str, query_vector: list[float], user_id: str, session_id: str, top_k: int = 6) -> list[dict]:
+        idx = await asyncio.to_thread(self._local, user_id, session_id, query_vector)
+        if idx is None:
+            return await self.indexer.ahybrid_search(
+                question=question, query_vector=query_vector,
+                user_id=user_id, session_id=session_id, top_k=top_k,
+            )
+        return idx.hybrid_search(question, query_vector, top_k)
+
+    async def ahybrid_search_by_file(
+        self,
+        question: str,
+        query_vector: list[float],
+        user_id: str,
+        session_id: str,
+        file_id: str,
+        top_k: int = 4
+    ) -> list[dict]:
+        idx = await asyncio.to_thread(self._local, user_id, session_id, query_vector)
+        if idx is None:
+            return await self.indexer.ahybrid_search_by_file(
+                question=question, query_vector=query_vector,
+                user_id=user_id, session_id=session_id, file_id=file_id, top_k=top_k,
+            )
+        return idx.hybrid_search(question, query_vector, top_k, file_id=file_id)
+
+    def __getattr__(self, name):
+        return getattr(self.indexer, name)
+
+
+def build_local_first_indexer(indexer, manifest):
+    """Envuelve el indexer si SESSION_LOCAL_INDEX_ENABLED; si no, lo devuelve tal cual."""
+    if not settings.SESSION_LOCAL_INDEX_ENABLED:
+        return indexer
+    cache = SessionIndexCache(
+        indexer,
+        manifest,
+        max_bytes=settings.SESSION_LOCAL_INDEX_MAX_MB * 1024 * 1024,
+        max_chunks=settings.SESSION_LOCAL_INDEX_MAX_CHUNKS,
+    )
+    return LocalFirstSearchIndexer(indexer, cache)
@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from app.config import settings
+
+
+class SessionFileLimitError(Exception):
+    """La reserva dejaría la sesión con más archivos que el límite."""
+
+    def __init__(self, limit: int, existing: int) -> None:
+        super().__init__(f"Límite de {limit} archivos por sesión (ya hay {existing})")
+        self.limit = limit
+        self.existing = existing
+
+
+class SessionManifest:
+    """
+    Manifiesto de archivos por sesión, guardado en Cosmos (docs container,
+    id "manifest_<session_id>"). Se escribe al terminar cada ingesta y se lee
+    con una lectura puntual, en vez de recorrer los chunks del índice.
+
+    Documento:
+    {
+      "id": "manifest_...", "type": "session_manifest", "user_id", "session_id",
+      "files": [
+        {"file_id", "file_name", "chunks", "hash", "content_type",
+         "extraction", "created_at",
+         "summary_status", "summary", "metadata": {"tipo_documento", "radicado", "partes"}}
+      ],
+      "pending": [
+        {"file_id", "file_name", "hash", "reserved_at"}
+      ]
+    }
+    summary_status: pending | done | failed (lo llena DocumentSummarizer en segundo plano).
+    pending: archivos reservados cuya ingesta está en curso. La reserva es
+    atómica (etag) y detecta el mismo contenido ya presente en la sesión,
+    aunque lo esté ingestando otra réplica. Se borra con la sesión; las
+    reservas de un proceso que murió vencen tras INGEST_PENDING_TTL_MINUTES.
+    """
+
+    def __init__(self, cosmosdb) -> None:
+        self.cosmosdb = cosmosdb
+
+    def get(self, session_id: str) -> Optional[dict]:
+        return self.cosmosdb.get_session_manifest(session_id)
+
+    def files(self, user_id: str, session_id: str) -> Optional[list[dict]]:
+        """
+        Archivos de la sesión; None si la sesión no tiene manifiesto
+        (sesiones anteriores al manifiesto: el llamador decide el fallback).
+        """
+        manifest = self.get(session_id)
+        if manifest is None:
+            return None
+        if manifest.get("user_id") != user_id:
+            return []
+        return manifest.get("files", [])
+
+    def count(self, session_id: str) -> int:
+        manifest = self.get(session_id)
+        return len(manifest.get("files", [])) if manifest else 0
+
+    # ------------------------------------------------------------
+    # Reservas (ingesta en curso)
+    # ------------------------------------------------------------
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    @staticmethod
+    def _live_pending(manifest: dict) -> list[dict]:
+        limit = datetime.now(timezone.utc) - timedelta(minutes=settings.INGEST_PENDING_TTL_MINUTES)
+        live = []
+        for p in manifest.get("pending", []):
+            try:
+                if datetime.fromisoformat(p["reserved_at"]) < limit:
+                    continue
+            except (KeyError, TypeError, ValueError):
+                continue
+            live.append(p)
+        return live
+
+    def reserve(
+        self, user_id: str, session_id: str, entries: list[dict], limit: Optional[int] = None
+    ) -> list[Optional[dict]]:
+        """
+        Reserva archivos antes de ingestarlos. `entries`: [{"file_id", "file_name", "hash"}].
+        Devuelve, por entrada, None si quedó reservada o el registro que ya
+        tiene ese contenido en la sesión (en files o en pending): duplicado.
+        Con `limit`, los archivos terminados + reservados no pueden pasarlo:
+        si pasaría, no reserva nada y lanza SessionFileLimitError. Como la
+        escritura es condicional (etag), dos subidas concurrentes no pueden
+        tomar el mismo cupo.
+        """
+
+        def _mutate(manifest: dict) -> list[Optional[dict]]:
+            pending = self._live_pending(manifest)
+            existing = len(manifest.get("files", [])) + len(pending)
+            known = {f.get("hash"): f for f in manifest.get("files", []) if f.get("hash")}
+            known.update({p.get("hash"): p for p in pending if p.get("hash")})
+            result: list[Optional[dict]] = []
+            for e in entries:
+                previous = known.get(e["hash"])
+                if previous is not None:
+                    result.append(previous)
+                    continue
+                entry = {**e, "reserved_at": self._now()}
+                pending.append(entry)
+                known[e["hash"]] = entry
+                result.append(None)
+            if limit is not None and len(manifest.get("files", [])) + len(pending) > limit:
+                raise SessionFileLimitError(limit, existing)
+            manifest["pending"] = pending
+            return result
+
+        return self.cosmosdb.update_session_manifest(session_id, user_id, _mutate)
+
+    def release(self, user_id: str, session_id: str, *file_ids: str) -> None:
+        """Libera la reserva de archivos cuya ingesta falló, no produjo chunks o no llegó a empezar."""
+
+        def _mutate(manifest: dict) -> None:
+            manifest["pending"] = [p for p in self._live_pending(manifest) if p.get("file_id") not in file_ids]
+
+        self.cosmosdb.update_session_manifest(session_id, user_id, _mutate)
+
+    def add_file(
+        self,
+        user_id: str,
+        session_id: str,
+        file_id: str,
+        file_name: str,
+        chunks: int,
+        file_hash: Optional[str] = None,
+        content_type: Optional[str] = None,
+        extraction: Optional[str] = None,
+        summary_status: Optional[str] = None,
+    ) -> None:
+        """Registra el archivo indexado y quita su reserva (una sola escritura)."""
+        entry = {
+            "file_id": file_id,
+            "file_name": file_name,
+            "chunks": chunks,
+            "hash": file_hash,
+            "content_type": content_type,
+            "extraction": extraction,
+            "summary_status": summary_status,
+            "created_at": self._now(),
+        }
+
+        def _mutate(manifest: dict) -> None:
+            manifest["pending"] = [p for p in self._live_pending(manifest) if p.get("file_id") != file_id]
+            # los archivos solo se agregan al final (update_session_manifest_file usa la posición)
+            manifest.setdefault("files", []).append(entry)
+
+        self.cosmosdb.update_session_manifest(session_id, user_id, _mutate)
+
+    def set_summary(
+        self,
+        session_id: str,
+        file_id: str,
+        status: str,
+        summary: Optional[str] = None,
+        metadata: Optional[dict] = None,
+    ) -> bool:
+        fields = {"summary_status": status}
+        if summary is not None:
+            fields["summary"] = summary
+        if metadata is not None:
+            fields["metadata"] = metadata
+        return self.cosmosdb.update_session_manifest_file(session_id, file_id, fields)
+
+    def delete(self, session_id: str) -> None:
+        self.cosmosdb.delete_session_manifest(session_id)
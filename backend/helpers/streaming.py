@@ -0,0 +1,138 @@
+import json
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from helpers.rate_limit import llm_limiter
+
+# Emisor del request en curso. ainvoke corre en la misma tarea y asyncio.to_thread
+# copia el contexto, así que el agente, las tools y los servicios RAG lo ven
+# sin recibirlo por parámetro.
+_current_emitter: ContextVar[Optional["StreamEmitter"]] = ContextVar("stream_emitter", default=None)
+
+
+class StreamEmitter:
+    """
+    Cola de eventos SSE de un request de streaming.
+    - emit() se puede llamar desde cualquier hilo (el agente corre fuera del loop)
+    - events() los entrega en orden hasta que se llama close()
+    """
+
+    _END = object()
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(self, event: str, data: Any) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, (event, data))
+        except RuntimeError:
+            # loop cerrado (apagado de la app): el evento ya no tiene destino
+            pass
+
+    def close(self) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, self._END)
+        except RuntimeError:
+            pass
+
+    async def events(self) -> AsyncIterator[tuple[str, Any]]:
+        while True:
+            item = await self.queue.get()
+            if item is self._END:
+                return
+            yield item
+
+
+def bind_emitter(emitter: Optional[StreamEmitter]):
+    """Asocia el emisor al contexto actual; devuelve el token para reset."""
+    return _current_emitter.set(emitter)
+
+
+def reset_emitter(token) -> None:
+    _current_emitter.reset(token)
+
+
+def current_emitter() -> Optional[StreamEmitter]:
+    return _current_emitter.get()
+
+
+def emit(event: str, data: Any) -> None:
+    """Emite un evento si hay un request de streaming en curso; si no, no hace nada."""
+    emitter = _current_emitter.get()
+    if emitter is not None:
+        emitter.emit(event, data)
+
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def complete_chat(client, **kwargs) -> str:
+    """
+    chat.completions.create que devuelve el texto de la respuesta.
+    Con un emisor activo pide stream=True y emite cada fragmento como
+    evento "token" a medida que llega.
+    """
+    emitter = _current_emitter.get()
+    if emitter is None:
+        resp = client.chat.completions.create(**kwargs)
+        return resp.choices[0].message.content
+
+    parts: list[str] = []
+    for chunk in client.chat.completions.create(stream=True, **kwargs):
+        # Azure manda chunks sin choices (resultados del filtro de contenido)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            emitter.emit("token", {"text": delta})
+    return "".join(parts)
+
+
+async def acomplete_chat(client, **kwargs) -> str:
+    """complete_chat con AsyncAzureOpenAI, limitado por llm_limiter."""
+    emitter = _current_emitter.get()
+    async with llm_limiter:
+        if emitter is None:
+            resp = await client.chat.completions.create(**kwargs)
+            return resp.choices[0].message.content
+
+        parts: list[str] = []
+        stream = await client.chat.completions.create(stream=True, **kwargs)
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                emitter.emit("token", {"text": delta})
+        return "".join(parts)
+
+
+class AgentStreamHandler(BaseCallbackHandler):
+    """
+    Callbacks del agente -> eventos SSE:
+    - "tool" al iniciar cada tool
+    - "token" con los tokens de la respuesta final del agente (cuando
+      responde sin tool; las llamadas a funciones no traen contenido)
+    """
+
+    # emit() no bloquea: en ainvoke se llama en el loop, sin pasar por un executor
+    run_inline = True
+
+    def __init__(self, emitter: StreamEmitter) -> None:
+        self.emitter = emitter
+
+    def on_tool_start(self, serialized: dict, input_str: str, **kwargs: Any) -> None:
+        self.emitter.emit("tool", {"name": (serialized or {}).get("name"), "input": input_str})
+
+    def on_tool_error(self, error: BaseException, **kwargs: Any) -> None:
+        logging.warning(f"Tool con error durante streaming: {error}")
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token:
+            self.emitter.emit("token", {"text": token})
@@ -5,8 +5,19 @@ from __future__ import annotations
 import os
 import json
 import uuid
+import asyncio
+from contextvars import ContextVar
 from datetime import datetime
 from typing import Optional, List, Any
+from helpers.streaming import current_emitter
+
+# Contexto de la tool por request (user_id, session_id, files). Cada request
+# corre en su propia tarea (ainvoke la hereda y asyncio.to_thread copia el
+# contexto al hilo), así que ejecuciones concurrentes no se pisan.
+_tool_context: ContextVar[Optional[dict]] = ContextVar("tool_context", default=None)
+
+# Config de las llamadas internas al LLM que ya emiten sus propios tokens
+_SIN_CALLBACKS = {"callbacks": []}
 #endregion
 
 # -----------------------------------------------------------------------------
@@ -23,24 +34,65 @@ class Tools:
         self.llm_chat = llm_chat
         self.cosmosdb = cosmosdb
 
-        self.user_id: Optional[str] = None
-        self.session_id: Optional[str] = None
-        self.files: List[Any] = []
-
     # ---------------------------------------------------------------------
     # Funcion de contexto agente
     # ---------------------------------------------------------------------
     def bind_context(self, session_id: str, user_id: str, files=None):
-        self.session_id = session_id
-        self.user_id = user_id
-        self.files = files or []
+        """
+        Asocia el contexto al request actual (ContextVar), no a la instancia:
+        la misma instancia de Tools atiende requests en paralelo.
+        Debe llamarse en la tarea del request, antes de invocar al agente.
+        """
+        return _tool_context.set({
+            "session_id": session_id,
+            "user_id": user_id,
+            "files": list(files or []),
+        })
+
+    @property
+    def user_id(self) -> Optional[str]:
+        return (_tool_context.get() or {}).get("user_id")
+
+    @property
+    def session_id(self) -> Optional[str]:
+        return (_tool_context.get() or {}).get("session_id")
+
+    @property
+    def files(self) -> List[Any]:
+        return (_tool_context.get() or {}).get("files", [])
 
     # ---------------------------------------------------------------------
     # TOOL 1: Conversacional
     # ---------------------------------------------------------------------
     def tool_conversacional(self, query: str) -> str:
-        resp = self.llm_chat.invoke(query)
-        return getattr(resp, "content", str(resp)).strip()
+        emitter = current_emitter()
+        if emitter is None:
+            resp = self.llm_chat.invoke(query)
+            return getattr(resp, "content", str(resp)).strip()
+
+        # /api/ask/stream: se emite cada token a medida que llega. callbacks=[]
+        # evita heredar los del agente (AgentStreamHandler volvería a emitirlos).
+        parts = []
+        for chunk in self.llm_chat.stream(query, config=_SIN_CALLBACKS):
+            text = getattr(chunk, "content", "") or ""
+            if text:
+                parts.append(text)
+                emitter.emit("token", {"text": text})
+        return "".join(parts).strip()
+
+    async def atool_conversacional(self, query: str) -> str:
+        emitter = current_emitter()
+        if emitter is None:
+            resp = await self.llm_chat.ainvoke(query)
+            return getattr(resp, "content", str(resp)).strip()
+
+        parts = []
+        async for chunk in self.llm_chat.astream(query, config=_SIN_CALLBACKS):
+            text = getattr(chunk, "content", "") or ""
+            if text:
+                parts.append(text)
+                emitter.emit("token", {"text": text})
+        return "".join(parts).strip()
 
     # ---------------------------------------------------------------------
     # TOOL 2: RAG sobre documentos adjuntos
@@ -57,6 +109,18 @@ class Tools:
         )
         return (res.get("answer") or "").strip()
 
+    async def atool_rag_userdocs(self, query: str) -> str:
+        if not self.user_id or not self.session_id:
+            return "No tengo user_id/session_id para buscar en documentos adjuntos."
+
+        res = await self.rag_userdocs.aanswer(
+            question=query,
+            user_id=self.user_id,
+            session_id=self.session_id,
+            top_k=12
+        )
+        return (res.get("answer") or "").strip()
+
     # ---------------------------------------------------------------------
     # TOOL 3: RAG sobre índice desde fabric
     # ---------------------------------------------------------------------
@@ -67,6 +131,13 @@ class Tools:
         )
         return (res.get("answer") or "").strip()
 
+    async def atool_rag_fabric(self, query: str) -> str:
+        res = await self.rag_corpus.aanswer(
+            question=query,
+            top_k=12
+        )
+        return (res.get("answer") or "").strip()
+
     # ---------------------------------------------------------------------
     # TOOL 4: Descargar / Generar Word 
     # ---------------------------------------------------------------------
@@ -108,4 +179,9 @@ class Tools:
             "session_id": self.session_id,
             "download_url": f"/api/chat/download/doc/{doc_id}",
         }
+
+    async def atool_word(self, instrucciones: str) -> str:
+        # El generador (secciones en su propio pool) y el guardado en Cosmos son
+        # sync: se ejecutan en un hilo para no bloquear el loop.
+        return await asyncio.to_thread(self.tool_word, instrucciones)
 #endregion
\ No newline at end of file
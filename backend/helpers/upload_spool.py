@@ -0,0 +1,244 @@
+import io
+import os
+import json
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, List, Optional
+from fastapi import UploadFile, HTTPException
+from app.config import settings
+
+# Lectura del UploadFile por bloques (nunca el cuerpo completo)
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class SpooledUpload:
+    """
+    Copia de un archivo subido, independiente del request:
+    - hasta `max_memory` bytes queda en memoria
+    - por encima se escribe en un archivo temporal con nombre (pymupdf y
+      Document Intelligence lo leen desde disco, sin cargarlo entero)
+
+    Memoria pico por archivo mientras se copia: min(tamaño, max_memory) + COPY_CHUNK_BYTES.
+    Ya en disco, cada lector abierto con open() es un archivo propio (seguro
+    entre hilos).
+
+    Expone filename / content_type / size / sha256 (calculado al copiar) y
+    es compatible con el uso que el orquestador hace de UploadFile.
+    """
+
+    def __init__(self, filename: str, content_type: str, max_memory: int, spool_dir: Optional[str] = None) -> None:
+        self.filename = filename
+        self.content_type = content_type
+        self.max_memory = max_memory
+        self.spool_dir = spool_dir
+        self.size = 0
+        self.sha256: Optional[str] = None
+        self.path: Optional[str] = None
+        self._hash = hashlib.sha256()
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._data: Optional[bytes] = None
+        self._disk: Optional[BinaryIO] = None
+
+    # =========================
+    # ESCRITURA (durante el request)
+    # =========================
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        self._hash.update(chunk)
+        if self._disk is None and self.size > self.max_memory:
+            # rollover: pasa lo acumulado a disco y libera el buffer
+            if self.spool_dir:
+                Path(self.spool_dir).mkdir(parents=True, exist_ok=True)
+            self._disk = tempfile.NamedTemporaryFile(
+                prefix="upload_", suffix=Path(self.filename).suffix, dir=self.spool_dir, delete=False
+            )
+            self.path = self._disk.name
+            self._disk.write(self._buffer.getvalue())
+            self._buffer = None
+        if self._disk is not None:
+            self._disk.write(chunk)
+        else:
+            self._buffer.write(chunk)
+
+    def finish(self) -> None:
+        self.sha256 = self._hash.hexdigest()
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+        else:
+            self._data = self._buffer.getvalue()
+            self._buffer = None
+
+    # =========================
+    # LECTURA (ingesta)
+    # =========================
+    @property
+    def in_memory(self) -> bool:
+        return self.path is None
+
+    def open(self) -> BinaryIO:
+        """Lector nuevo, posicionado al inicio. El que lo abre lo cierra."""
+        if self.path:
+            return open(self.path, "rb")
+        return io.BytesIO(self._data or b"")
+
+    def read_bytes(self) -> bytes:
+        """Contenido completo en memoria (solo para librerías que lo exigen)."""
+        if self.path:
+            with open(self.path, "rb") as fh:
+                return fh.read()
+        return self._data or b""
+
+    # compatibilidad con UploadFile (orquestador / tools)
+    async def read(self) -> bytes:
+        return self.read_bytes()
+
+    async def seek(self, offset: int) -> None:
+        return None
+
+    async def close(self) -> None:
+        self.discard()
+
+    def discard(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+        if self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        self._buffer = None
+        self._data = None
+
+
+def _too_large(detail: str) -> HTTPException:
+    return HTTPException(status_code=413, detail=detail)
+
+
+async def spool_uploads(
+    files: List[UploadFile],
+    max_file_bytes: Optional[int] = None,
+    max_request_bytes: Optional[int] = None,
+) -> list[SpooledUpload]:
+    """
+    Copia los UploadFile a SpooledUpload por bloques, validando límites:
+    - si Starlette ya conoce el tamaño (UploadFile.size) se rechaza sin leer
+    - si no, se corta apenas la copia supera el límite (413)
+    Si algo falla, borra lo que ya se había escrito a disco.
+    """
+    max_file = max_file_bytes or settings.UPLOAD_MAX_FILE_MB * 1024 * 1024
+    max_request = max_request_bytes or settings.UPLOAD_MAX_REQUEST_MB * 1024 * 1024
+    max_memory = settings.UPLOAD_SPOOL_MAX_MEMORY_MB * 1024 * 1024
+    file_msg = "{name} supera el máximo de " + f"{max_file // (1024 * 1024)} MB por archivo."
+    request_msg = f"La subida supera el máximo de {max_request // (1024 * 1024)} MB por request."
+
+    declared = 0
+    for f in files:
+        size = getattr(f, "size", None)
+        if size is None:
+            continue
+        if size > max_file:
+            raise _too_large(file_msg.format(name=f.filename))
+        declared += size
+    if declared > max_request:
+        raise _too_large(request_msg)
+
+    spooled: list[SpooledUpload] = []
+    total = 0
+    try:
+        for f in files:
+            out = SpooledUpload(
+                filename=f.filename or "archivo",
+                content_type=(f.content_type or "").lower(),
+                max_memory=max_memory,
+                spool_dir=settings.UPLOAD_SPOOL_DIR,
+            )
+            spooled.append(out)
+            await f.seek(0)
+            while True:
+                chunk = await f.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if out.size + len(chunk) > max_file:
+                    raise _too_large(file_msg.format(name=out.filename))
+                if total > max_request:
+                    raise _too_large(request_msg)
+                out.write(chunk)
+            out.finish()
+    except BaseException:
+        for s in spooled:
+            s.discard()
+        raise
+    return spooled
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Corta los POST de subida que superan UPLOAD_MAX_REQUEST_MB antes de que
+    Starlette parsee el multipart:
+    - Content-Length declarado mayor al límite -> 413 sin leer el cuerpo
+    - sin Content-Length (chunked) -> 413 apenas lo recibido supera el límite
+    """
+
+    def __init__(self, app, paths: tuple[str, ...] = ("/api/upload",), max_bytes: Optional[int] = None) -> None:
+        self.app = app
+        self.paths = paths
+        # margen para los delimitadores/cabeceras del multipart
+        self.max_bytes = (max_bytes or settings.UPLOAD_MAX_REQUEST_MB * 1024 * 1024) + 1024 * 1024
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") != "POST" or scope.get("path") not in self.paths:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        length = headers.get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+        responded = False
+
+        async def _send(message):
+            nonlocal responded
+            if message["type"] == "http.response.start":
+                responded = True
+            await send(message)
+
+        async def _receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # HTTPException: FastAPI la deja pasar al parsear el form y responde 413
+                    raise _BodyTooLarge(
+                        status_code=413,
+                        detail=f"La subida supera el máximo de {settings.UPLOAD_MAX_REQUEST_MB} MB por request.",
+                    )
+            return message
+
+        try:
+            await self.app(scope, _receive, _send)
+        except _BodyTooLarge:
+            if not responded:
+                await self._reject(send)
+
+    async def _reject(self, send) -> None:
+        body = json.dumps(
+            {"detail": f"La subida supera el máximo de {settings.UPLOAD_MAX_REQUEST_MB} MB por request."},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class _BodyTooLarge(HTTPException):
+    pass
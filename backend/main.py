@@ -1,14 +1,29 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from api.chats import chat_router 
 from api.chats import download_router as download
+from api.chats import orchestrator
 from api import auth
+from helpers.upload_spool import UploadSizeLimitMiddleware
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # cierra los clientes async de larga vida (Azure AI Search)
+    await orchestrator.aclose()
+
 
 app = FastAPI(
     title="Agente Jurídico - Resolución de Conflictos",
-    version="0.1.1"
+    version="0.1.1",
+    lifespan=lifespan,
 )
 
+# rechaza subidas demasiado grandes antes de parsear el multipart
+# (se agrega antes que CORS para que el 413 también lleve sus cabeceras)
+app.add_middleware(UploadSizeLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
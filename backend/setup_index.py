@@ -13,20 +13,30 @@ from azure.search.documents.indexes.models import (
     VectorSearch,
     HnswAlgorithmConfiguration,
     VectorSearchProfile,
+    ScalarQuantizationCompression,
+    ScalarQuantizationParameters,
+    BinaryQuantizationCompression,
 )
 
 from app.config import settings
 
 
-def create_or_replace_index() -> None:
-    print("Iniciando setup_index.py ...")
-    print("SEARCH ENDPOINT:", settings.AZURE_SEARCH_ENDPOINT)
-    print("INDEX NAME:", settings.AZURE_SEARCH_INDEX)
+def build_index(
+    name: str,
+    dimensions: int,
+    compression: str = "none",
+    half_precision: bool = False,
+) -> SearchIndex:
+    """
+    Define el índice de documentos de usuario.
+    - dimensions: largo del vector (text-embedding-3 admite vectores recortados)
+    - compression: "none" | "scalar" (int8) | "binary"
+    - half_precision: guarda el vector como Edm.Half (float16) en vez de Single
+    """
+    if compression not in ("none", "scalar", "binary"):
+        raise ValueError(f"compression inválida: {compression}")
 
-    client = SearchIndexClient(
-        endpoint=settings.AZURE_SEARCH_ENDPOINT,
-        credential=AzureKeyCredential(settings.AZURE_SEARCH_KEY),
-    )
+    vector_type = "Edm.Half" if half_precision else SearchFieldDataType.Single
 
     fields = [
         SimpleField(name="id", type=SearchFieldDataType.String, key=True, filterable=True),
@@ -42,9 +52,9 @@ def create_or_replace_index() -> None:
 
         SearchField(
             name="content_vector",
-            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+            type=SearchFieldDataType.Collection(vector_type),
             searchable=True,
-            vector_search_dimensions=3072,
+            vector_search_dimensions=dimensions,
             vector_search_profile_name="vs-profile",
         ),
 
@@ -56,12 +66,56 @@ def create_or_replace_index() -> None:
         ),
     ]
 
+    compressions = []
+    if compression == "scalar":
+        compressions.append(ScalarQuantizationCompression(
+            compression_name="vs-compression",
+            rerank_with_original_vectors=True,
+            default_oversampling=4.0,
+            parameters=ScalarQuantizationParameters(quantized_data_type="int8"),
+        ))
+    elif compression == "binary":
+        compressions.append(BinaryQuantizationCompression(
+            compression_name="vs-compression",
+            rerank_with_original_vectors=True,
+            default_oversampling=10.0,
+        ))
+
     vector_search = VectorSearch(
         algorithms=[HnswAlgorithmConfiguration(name="hnsw-algo")],
-        profiles=[VectorSearchProfile(name="vs-profile", algorithm_configuration_name="hnsw-algo")],
+        profiles=[VectorSearchProfile(
+            name="vs-profile",
+            algorithm_configuration_name="hnsw-algo",
+            compression_name="vs-compression" if compressions else None,
+        )],
+        compressions=compressions or None,
     )
 
-    index = SearchIndex(name=settings.AZURE_SEARCH_INDEX, fields=fields, vector_search=vector_search)
+    return SearchIndex(name=name, fields=fields, vector_search=vector_search)
+
+
+def create_or_replace_index() -> None:
+    print("Iniciando setup_index.py ...")
+    print("SEARCH ENDPOINT:", settings.AZURE_SEARCH_ENDPOINT)
+    print("INDEX NAME:", settings.AZURE_SEARCH_INDEX)
+    print(
+        "VECTOR:",
+        f"dims={settings.EMBEDDING_DIMENSIONS}",
+        f"compression={settings.SEARCH_VECTOR_COMPRESSION}",
+        f"half={settings.SEARCH_VECTOR_HALF_PRECISION}",
+    )
+
+    client = SearchIndexClient(
+        endpoint=settings.AZURE_SEARCH_ENDPOINT,
+        credential=AzureKeyCredential(settings.AZURE_SEARCH_KEY),
+    )
+
+    index = build_index(
+        settings.AZURE_SEARCH_INDEX,
+        dimensions=settings.EMBEDDING_DIMENSIONS,
+        compression=settings.SEARCH_VECTOR_COMPRESSION,
+        half_precision=settings.SEARCH_VECTOR_HALF_PRECISION,
+    )
 
     # borrar si existe
     try:
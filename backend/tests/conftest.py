@@ -0,0 +1,46 @@
+import os
+import sys
+from pathlib import Path
+
+# Los tests corren sin red ni credenciales: variables mínimas para importar app.config
+BACKEND = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND))
+
+for key, value in {
+    "CLIENT_ID": "test",
+    "CLIENT_SECRET": "test",
+    "TENANT_ID": "common",
+    "REDIRECT_URI": "http://localhost",
+    "AZURE_OPENAI_ENDPOINT": "https://test.openai.azure.com",
+    "AZURE_OPENAI_KEY": "test",
+    "AZURE_OPENAI_CHAT_DEPLOYMENT": "chat",
+    "AZURE_OPENAI_EMBEDDING_DEPLOYMENT": "emb",
+    "AZURE_OPENAI_OPENAI_VERSION": "2024-06-01",
+    "AZURE_SEARCH_ENDPOINT": "https://test.search.windows.net",
+    "AZURE_SEARCH_KEY": "test",
+    "AZURE_SEARCH_INDEX": "idx",
+    "AZURE_SEARCH_INDEX_FABRIC": "fab",
+    "AZURE_FORM_RECOGNIZER_ENDPOINT": "https://test.cognitiveservices.azure.com",
+    "AZURE_FORM_RECOGNIZER_API_KEY": "test",
+}.items():
+    os.environ.setdefault(key, value)
+
+# MSAL consulta el authority al construirse y tiktoken descarga el encoding:
+# sin red se reemplazan por dobles locales (solo en los tests).
+import msal  # noqa: E402
+import tiktoken  # noqa: E402
+
+
+class _CharEncoding:
+    """Un token por carácter: suficiente para probar presupuestos de tokens."""
+
+    def encode(self, text, **kwargs):
+        return [ord(c) for c in text]
+
+    def decode(self, tokens):
+        return "".join(chr(t) for t in tokens)
+
+
+msal.ConfidentialClientApplication = lambda *args, **kwargs: None
+tiktoken.get_encoding = lambda name: _CharEncoding()
+tiktoken.encoding_for_model = lambda name: _CharEncoding()
@@ -0,0 +1,58 @@
+import copy
+import threading
+import uuid
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from core.ai_services import AIServices
+from utils.functions import Functions
+
+
+class FakeContainer:
+    """Contenedor en memoria con la semántica de etag de Cosmos (create / replace condicional)."""
+
+    def __init__(self) -> None:
+        self.items: dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def _stored(self, body: dict) -> dict:
+        doc = copy.deepcopy(body)
+        doc["_etag"] = uuid.uuid4().hex
+        return doc
+
+    def read_item(self, item, partition_key):
+        with self.lock:
+            if item not in self.items:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message="not found")
+            return copy.deepcopy(self.items[item])
+
+    def create_item(self, body):
+        with self.lock:
+            if body["id"] in self.items:
+                raise exceptions.CosmosResourceExistsError(status_code=409, message="exists")
+            self.items[body["id"]] = self._stored(body)
+            return copy.deepcopy(self.items[body["id"]])
+
+    def replace_item(self, item, body, etag=None, match_condition=None):
+        with self.lock:
+            if item not in self.items:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message="not found")
+            if match_condition == MatchConditions.IfNotModified and self.items[item]["_etag"] != etag:
+                raise exceptions.CosmosAccessConditionFailedError(status_code=412, message="etag")
+            self.items[item] = self._stored(body)
+            return copy.deepcopy(self.items[item])
+
+    def delete_item(self, item, partition_key):
+        with self.lock:
+            if item not in self.items:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message="not found")
+            del self.items[item]
+
+
+def fake_cosmosdb() -> "AIServices.AzureCosmosDB":
+    """AzureCosmosDB real (lógica del manifiesto) sobre un docs container en memoria."""
+    db = AIServices.AzureCosmosDB.__new__(AIServices.AzureCosmosDB)
+    db.function = Functions()
+    db.docs_container = FakeContainer()
+    return db
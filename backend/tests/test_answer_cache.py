@@ -0,0 +1,28 @@
+from helpers.answer_cache import SemanticAnswerCache
+
+
+def _cache() -> SemanticAnswerCache:
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.put([1.0, 0.0, 0.0], "¿En qué estado está el radicado 2021-00123?", {"answer": "Archivado"}, "v1", 10, 900.0)
+    return cache
+
+
+def test_acierto_con_la_misma_pregunta_reformulada():
+    cache = _cache()
+    hit = cache.lookup([0.99, 0.05, 0.0], "en que ESTADO esta el radicado 2021-00123", "v1", 10)
+    assert hit["answer"] == "Archivado"
+    assert hit["cache"]["hit"] is True
+    assert cache._entries[0]["question"] == "¿en que estado esta el radicado 2021-00123?"
+
+
+def test_otro_radicado_no_es_acierto_aunque_el_vector_coincida():
+    cache = _cache()
+    assert cache.lookup([1.0, 0.0, 0.0], "¿En qué estado está el radicado 2021-00124?", "v1", 10) is None
+    assert cache.lookup([1.0, 0.0, 0.0], "¿En qué estado está el radicado?", "v1", 10) is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_identificadores_con_prefijo_y_orden_cuentan():
+    assert SemanticAnswerCache._key_tokens("sentencia t-123 de 2020") == ("t-123", "2020")
+    assert SemanticAnswerCache._key_tokens("sentencia c-123 de 2020") != ("t-123", "2020")
+    assert SemanticAnswerCache._key_tokens("articulo 5 de la ley 100.") == ("5", "100")
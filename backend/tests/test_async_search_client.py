@@ -0,0 +1,160 @@
+import asyncio
+import threading
+from types import SimpleNamespace as NS
+
+import pytest
+from azure.core.exceptions import HttpResponseError
+
+import helpers.indexacion as indexacion
+from helpers.indexacion import _AsyncSearchClient
+
+
+class FakeAioSearchClient:
+    instances: list["FakeAioSearchClient"] = []
+
+    def __init__(self, **kwargs) -> None:
+        self.closed_in = None
+        FakeAioSearchClient.instances.append(self)
+
+    async def close(self) -> None:
+        self.closed_in = asyncio.get_running_loop()
+
+
+@pytest.fixture(autouse=True)
+def fake_client(monkeypatch):
+    FakeAioSearchClient.instances = []
+    monkeypatch.setattr(indexacion, "AsyncSearchClient", FakeAioSearchClient)
+
+
+def _loop_in_thread() -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def test_un_cliente_por_loop_y_close_los_cierra_todos_en_su_loop():
+    clients = _AsyncSearchClient("idx")
+    other = _loop_in_thread()
+
+    async def _get():
+        return clients.get(), asyncio.get_running_loop()
+
+    en_otro, _ = asyncio.run_coroutine_threadsafe(_get(), other).result()
+
+    async def _main():
+        a, _ = await _get()
+        b, loop = await _get()
+        assert a is b  # mismo loop -> mismo cliente
+        assert a is not en_otro  # otro loop -> cliente propio, el del otro sigue vivo
+        assert en_otro.closed_in is None
+        await clients.close()
+        return a, loop
+
+    propio, main_loop = asyncio.run(_main())
+    assert propio.closed_in is main_loop
+    assert en_otro.closed_in is other
+    other.call_soon_threadsafe(other.stop)
+
+
+def test_cliente_de_un_loop_terminado_se_descarta(caplog):
+    clients = _AsyncSearchClient("idx")
+
+    async def _get():
+        return clients.get()
+
+    viejo = asyncio.run(_get())  # el loop de asyncio.run ya cerró
+
+    async def _main():
+        nuevo = clients.get()
+        await clients.close()
+        return nuevo
+
+    nuevo = asyncio.run(_main())
+    assert nuevo is not viejo
+    assert nuevo.closed_in is not None
+    assert len(clients._clients) == 0
+    assert "sin cerrar" in caplog.text
+
+
+class ThrottlingAioSearchClient(FakeAioSearchClient):
+    """Responde 429 a las primeras `throttle` llamadas y registra la concurrencia."""
+
+    def __init__(self, throttle: int = 0, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.throttle = throttle
+        self.calls = 0
+        self.active = 0
+        self.started_with: list[int] = []
+        self.threads: set[str] = set()
+
+    async def upload_documents(self, documents):
+        self.calls += 1
+        self.active += 1
+        self.started_with.append(self.active)
+        self.threads.add(threading.current_thread().name)
+        call = self.calls
+        try:
+            await asyncio.sleep(0.02)
+            if call <= self.throttle:
+                e = HttpResponseError(message="throttled")
+                e.status_code = 429
+                e.response = NS(headers={"retry-after-ms": "10"})
+                raise e
+            return [NS(key=d["id"], succeeded=True, status_code=201) for d in documents]
+        finally:
+            self.active -= 1
+
+
+def _indexer(concurrency: int) -> indexacion.AzureSearchIndexer:
+    indexer = indexacion.AzureSearchIndexer.__new__(indexacion.AzureSearchIndexer)
+    indexer.max_batch_bytes = 10 * 1024 * 1024
+    indexer.max_batch_docs = 1  # un lote por documento
+    indexer.concurrency = concurrency
+    indexer.aclient = _AsyncSearchClient("idx")
+    indexer._alimiter = indexacion._AsyncAdaptiveLimiter(concurrency)
+    indexer._upload_loop = indexacion._BackgroundLoop("search-upload")
+    return indexer
+
+
+def test_aupload_usa_el_limite_adaptativo_en_el_loop_de_uploads(monkeypatch):
+    client = ThrottlingAioSearchClient(throttle=4)
+    monkeypatch.setattr(indexacion, "AsyncSearchClient", lambda **kwargs: client)
+    indexer = _indexer(concurrency=4)
+    docs = [{"id": f"d{i}"} for i in range(8)]
+
+    stats = asyncio.run(indexer.aupload(docs))
+    # otro asyncio.run (otro loop del llamador): mismo loop de uploads y mismo límite
+    asyncio.run(indexer.aupload([{"id": "extra"}]))
+
+    assert stats["succeeded"] == 8 and stats["failed"] == 0
+    assert stats["throttled"] == 4
+    assert max(client.started_with) <= 4
+    # tras los cuatro 429 el límite baja a 1: el siguiente lote sale solo
+    assert client.started_with[4] == 1
+    assert client.threads == {"search-upload"}
+    assert len(FakeAioSearchClient.instances) == 1
+
+    asyncio.run(indexer.aclose())
+    assert client.closed_in is not None
+    assert indexer._upload_loop._loop is None
+
+
+def test_upload_sync_desde_varios_hilos_comparte_el_loop_y_el_limite(monkeypatch):
+    client = ThrottlingAioSearchClient(throttle=2)
+    monkeypatch.setattr(indexacion, "AsyncSearchClient", lambda **kwargs: client)
+    indexer = _indexer(concurrency=3)
+    results = []
+
+    def _pipeline(n: int) -> None:
+        results.append(indexer.upload([{"id": f"{n}-{i}"} for i in range(6)]))
+
+    threads = [threading.Thread(target=_pipeline, args=(n,)) for n in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(r["succeeded"] for r in results) == 18
+    assert max(client.started_with) <= 3  # un solo límite para los tres hilos
+    assert client.threads == {"search-upload"}
+    indexer._upload_loop.stop()
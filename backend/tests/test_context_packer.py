@@ -0,0 +1,72 @@
+from helpers.context_packer import ContextPacker, chunk_label
+
+
+def _hit(file_name: str, chunk_id, content: str) -> dict:
+    return {"file_name": file_name, "chunk_id": chunk_id, "content": content}
+
+
+def _label(hit: dict, first, last) -> str:
+    return chunk_label(hit["file_name"], first, last)
+
+
+def _packer(max_tokens: int = 1000, min_block_tokens: int = 5) -> ContextPacker:
+    # en los tests el encoding es de un token por carácter (conftest)
+    return ContextPacker(max_tokens=max_tokens, min_block_tokens=min_block_tokens)
+
+
+def test_strip_overlap_quita_el_texto_repetido():
+    prev = "El juez de primera instancia declaró su falta de competencia territorial."
+    nxt = "su falta de competencia territorial. Remitió el expediente al juzgado de Cali."
+    assert ContextPacker.strip_overlap(prev, nxt, probe=10) == " Remitió el expediente al juzgado de Cali."
+
+
+def test_strip_overlap_sin_overlap_o_vacio():
+    assert ContextPacker.strip_overlap("Primer párrafo completo.", "Otro texto distinto.") is None
+    assert ContextPacker.strip_overlap("", "algo") is None
+    assert ContextPacker.strip_overlap("algo", "") is None
+
+
+OVERLAP = " el despacho remitió el expediente a la oficina de reparto"
+
+
+def test_blocks_une_chunks_consecutivos_y_corta_en_los_huecos():
+    hits = [
+        _hit("a.pdf", 4, "Cuarto chunk."),                      # rank 0, separado por un hueco
+        _hit("a.pdf", 1, "Primero:" + OVERLAP),                 # rank 1
+        _hit("b.pdf", 0, "Otro archivo."),                      # rank 2
+        _hit("a.pdf", 2, OVERLAP.strip() + ". Segundo."),       # rank 3, continúa el 1 con overlap
+        _hit("a.pdf", 1, "Primero:" + OVERLAP),                 # chunk repetido
+    ]
+    blocks = _packer()._blocks(hits, "content", "file_name", "chunk_id")
+
+    assert [(b["hits"][0]["file_name"], b["first"], b["last"], b["rank"]) for b in blocks] == [
+        ("a.pdf", 4, 4, 0),
+        ("a.pdf", 1, 2, 1),
+        ("b.pdf", 0, 0, 2),
+    ]
+    assert blocks[1]["text"] == "Primero:" + OVERLAP + ". Segundo."
+
+
+def test_blocks_sin_overlap_separa_con_salto_de_linea():
+    hits = [_hit("a.pdf", 0, "Hechos."), _hit("a.pdf", 1, "Pretensiones.")]
+    (block,) = _packer()._blocks(hits, "content", "file_name", "chunk_id")
+    assert block["text"] == "Hechos.\nPretensiones."
+
+
+def test_pack_recorta_el_bloque_que_llega_al_presupuesto():
+    hits = [_hit("a.pdf", 0, "x" * 50), _hit("b.pdf", 0, "y" * 100)]
+    # cada encabezado "[a.pdf | chunk 0] " + separador cuesta 20 tokens
+    context, used = _packer(max_tokens=100).pack(
+        hits, text_field="content", label=_label, group_field="file_name", order_field="chunk_id",
+    )
+    assert context == f"[a.pdf | chunk 0] {'x' * 50}\n\n[b.pdf | chunk 0] {'y' * 10}"
+    assert used == hits
+
+
+def test_pack_omite_el_bloque_si_no_cabe_el_minimo():
+    hits = [_hit("a.pdf", 0, "x" * 50), _hit("b.pdf", 0, "y" * 100)]
+    context, used = _packer(max_tokens=100, min_block_tokens=20).pack(
+        hits, text_field="content", label=_label, group_field="file_name", order_field="chunk_id",
+    )
+    assert context == f"[a.pdf | chunk 0] {'x' * 50}"
+    assert used == hits[:1]
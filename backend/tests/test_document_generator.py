@@ -0,0 +1,58 @@
+import json
+from types import SimpleNamespace as NS
+
+import pytest
+
+from helpers.document_generator import CAMPOS_ENCABEZADO, DocumentGeneratorService
+
+
+class FakeLLM:
+    def __init__(self, responses: list[dict]) -> None:
+        self.responses = list(responses)
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        return NS(content=json.dumps(self.responses.pop(0), ensure_ascii=False))
+
+
+def _generator(responses: list[dict]) -> DocumentGeneratorService:
+    gen = DocumentGeneratorService.__new__(DocumentGeneratorService)
+    gen.llm_chat = FakeLLM(responses)
+    gen.section_retries = 1
+    gen.section_context_tokens = 1000
+    gen._retrieve_context = lambda **kwargs: ("contexto", [])
+    return gen
+
+
+def _encabezado(**fields) -> dict:
+    return {**{k: "" for k in CAMPOS_ENCABEZADO}, **fields}
+
+
+def test_listas_del_encabezado_se_unen_con_coma():
+    gen = _generator([_encabezado(partes=["Ana Pérez", " Banco X ", ""], numero_unico=11001)])
+    fields, _, ok = gen._generate_section_with_retry(
+        "encabezado", instrucciones="auto", user_id="u", session_id="s", source="userdocs"
+    )
+    assert ok
+    assert fields["partes"] == "Ana Pérez, Banco X"
+    assert fields["numero_unico"] == "11001"
+
+
+def test_tipo_invalido_reintenta_la_seccion():
+    gen = _generator([
+        _encabezado(partes={"demandante": "Ana"}),
+        _encabezado(partes="Ana Pérez contra Banco X"),
+    ])
+    fields, _, ok = gen._generate_section_with_retry(
+        "encabezado", instrucciones="auto", user_id="u", session_id="s", source="userdocs"
+    )
+    assert ok
+    assert gen.llm_chat.calls == 2
+    assert fields["partes"] == "Ana Pérez contra Banco X"
+
+
+@pytest.mark.parametrize("value", [{"a": 1}, [["a"]], [{"nombre": "Ana"}], True])
+def test_texto_campo_rechaza_tipos_no_textuales(value):
+    with pytest.raises(ValueError):
+        DocumentGeneratorService._texto_campo("partes", value)
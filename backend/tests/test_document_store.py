@@ -0,0 +1,39 @@
+import sqlite3
+
+from helpers.document_store import DocumentHashStore
+
+
+def _store_doc(store: DocumentHashStore, file_hash: str, n_chunks: int = 4) -> None:
+    rows = [(i, "x" * 100, [0.0] * 25) for i in range(n_chunks)]  # 100 B de texto + 100 B de vector
+    store.add_chunks(file_hash, "m", rows)
+    store.complete_document(file_hash, "m", "t" * 200, n_chunks)
+
+
+def test_expulsa_los_documentos_menos_usados_al_pasar_el_maximo(tmp_path):
+    store = DocumentHashStore(str(tmp_path / "dedup.sqlite3"), max_bytes=2500)  # cada doc = 1000 B
+    _store_doc(store, "a")
+    _store_doc(store, "b")
+    assert store.stats()["bytes"] == 2000
+
+    assert store.get_document("a", "m")  # "a" pasa a ser el más reciente
+    _store_doc(store, "c")
+
+    assert store.get_document("b", "m") is None
+    assert list(store.iter_chunks("b", "m", 4, 10)) == []
+    assert store.get_document("a", "m") and store.get_document("c", "m")
+    assert store.stats() == {"entries": 2, "bytes": 2000, "max_bytes": 2500}
+
+
+def test_no_borra_tablas_de_una_base_existente(tmp_path):
+    path = tmp_path / "dedup.sqlite3"
+    with sqlite3.connect(path) as con:
+        con.execute("CREATE TABLE documents (hash TEXT, model TEXT, text TEXT, n_chunks INTEGER, "
+                    "complete INTEGER, created_at TEXT, PRIMARY KEY (hash, model))")
+        con.execute("INSERT INTO documents VALUES ('viejo', 'm', 'texto', 0, 1, NULL)")
+        con.execute("CREATE TABLE session_files (session_id TEXT)")
+
+    store = DocumentHashStore(str(path), max_bytes=10_000)
+    assert store.get_document("viejo", "m") == {"text": "texto", "n_chunks": 0}
+    with sqlite3.connect(path) as con:
+        tables = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert "session_files" in tables
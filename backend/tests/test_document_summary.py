@@ -0,0 +1,82 @@
+import asyncio
+import json
+from types import SimpleNamespace as NS
+
+from helpers.document_summary import DocumentSummarizer, format_summary
+from helpers.rate_limit import llm_limiter
+
+
+class FakeManifest:
+    def __init__(self) -> None:
+        self.summaries: list[tuple] = []
+
+    def set_summary(self, session_id, file_id, status, summary=None, metadata=None):
+        self.summaries.append((status, summary, metadata))
+
+
+class FakeChat:
+    def __init__(self, answer: dict) -> None:
+        self.answer = answer
+        self.prompts: list[str] = []
+        self.slots_in_use: list[int] = []
+        self.chat = NS(completions=NS(create=self.create))
+
+    async def create(self, **kwargs):
+        self.prompts.append(kwargs["messages"][-1]["content"])
+        self.slots_in_use.append(llm_limiter.max_concurrency - llm_limiter._sem._value)
+        return NS(choices=[NS(message=NS(content=json.dumps(self.answer)))])
+
+
+def _summarizer(answer: dict, max_input_tokens: int = 6000) -> DocumentSummarizer:
+    summarizer = DocumentSummarizer(FakeManifest(), max_input_tokens=max_input_tokens, max_workers=2)
+    summarizer.achat = FakeChat(answer)
+    return summarizer
+
+
+def _summarize_from_thread(summarizer: DocumentSummarizer, text: str) -> None:
+    async def _main():
+        summarizer.bind_loop(asyncio.get_running_loop())
+        # la ingesta encola desde su propio pool
+        fut = await asyncio.to_thread(summarizer.submit, "u", "s", "f1", "a.pdf", text)
+        await asyncio.wrap_future(fut)
+
+    asyncio.run(_main())
+
+
+def test_resumen_en_el_loop_bajo_llm_limiter_y_con_extracto_acotado():
+    answer = {"resumen": "Tutela", "tipo_documento": "Sentencia", "radicado": "2021-00123", "partes": ["A", "B"]}
+    summarizer = _summarizer(answer, max_input_tokens=100)
+    _summarize_from_thread(summarizer, "x" * 10_000)
+
+    (prompt,) = summarizer.achat.prompts
+    assert len(prompt) < 200  # solo el extracto, no los 10.000 caracteres
+    assert summarizer.achat.slots_in_use == [1]
+    assert summarizer.manifest.summaries == [
+        ("done", "Tutela", {"tipo_documento": "Sentencia", "radicado": "2021-00123", "partes": ["A", "B"]}),
+    ]
+
+
+def test_metadatos_con_tipos_inesperados_se_normalizan():
+    summarizer = _summarizer({"resumen": "Auto", "tipo_documento": {"x": 1}, "radicado": 123, "partes": "Juan Pérez"})
+    _summarize_from_thread(summarizer, "texto")
+
+    (status, _, metadata) = summarizer.manifest.summaries[0]
+    assert status == "done"
+    assert metadata == {"tipo_documento": None, "radicado": "123", "partes": ["Juan Pérez"]}
+
+
+def test_format_summary_con_partes_como_string():
+    block = format_summary({
+        "file_name": "a.pdf",
+        "summary": "Resumen",
+        "metadata": {"partes": "Juan Pérez", "radicado": "2021-00123"},
+    })
+    assert "Partes: Juan Pérez" in block
+    assert "J; u" not in block
+
+
+def test_submit_sin_loop_marca_el_resumen_fallido():
+    summarizer = _summarizer({})
+    fut = summarizer.submit("u", "s", "f1", "a.pdf", "texto")
+    assert fut.exception() is not None
+    assert summarizer.manifest.summaries == [("failed", None, None)]
@@ -0,0 +1,98 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace as NS
+
+from helpers.embedding_cache import EmbeddingCache
+from helpers.indexacion import EmbeddingService
+
+LOCK_SECONDS = 0.5
+
+
+class FakeAsyncEmbeddings:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.embeddings = self
+
+    async def create(self, model, input, **kwargs):
+        self.calls += 1
+        return NS(data=[NS(embedding=[0.5, 0.25, 0.125])])
+
+
+def _service(tmp_path) -> tuple[EmbeddingService, EmbeddingCache]:
+    cache = EmbeddingCache(str(tmp_path / "emb.sqlite"), max_bytes=10 * 1024 * 1024)
+    service = EmbeddingService(cache=cache, dimensions=3)
+    service.aclient = FakeAsyncEmbeddings()
+    return service, cache
+
+
+def _hold_write_lock(db_path: str, seconds: float) -> threading.Event:
+    """Otra conexión (como un hilo de ingesta) toma el lock de escritura de SQLite."""
+    locked = threading.Event()
+
+    def _run():
+        con = sqlite3.connect(db_path, isolation_level=None)
+        con.execute("BEGIN IMMEDIATE")
+        locked.set()
+        time.sleep(seconds)
+        con.execute("COMMIT")
+        con.close()
+
+    threading.Thread(target=_run, daemon=True).start()
+    locked.wait()
+    return locked
+
+
+async def _with_heartbeat(coro) -> tuple[object, int, float]:
+    """Ejecuta coro y cuenta cuántas veces alcanzó a correr otra corrutina mientras tanto."""
+    beats = 0
+    done = asyncio.Event()
+
+    async def _beat():
+        nonlocal beats
+        while not done.is_set():
+            beats += 1
+            await asyncio.sleep(0.01)
+
+    beat = asyncio.create_task(_beat())
+    t0 = time.perf_counter()
+    try:
+        result = await coro
+    finally:
+        done.set()
+        await beat
+    return result, beats, time.perf_counter() - t0
+
+
+def test_aembed_hit_con_escritura_concurrente_no_bloquea_el_loop(tmp_path):
+    service, cache = _service(tmp_path)
+    key = service._cache_key("pregunta")
+    cache.put(key, [1.0, 2.0, 3.0])
+
+    async def _run():
+        _hold_write_lock(cache.db_path, LOCK_SECONDS)
+        return await _with_heartbeat(service.aembed("pregunta"))
+
+    vec, beats, elapsed = asyncio.run(_run())
+    assert vec == [1.0, 2.0, 3.0]
+    assert service.aclient.calls == 0
+    # el "touch" LRU esperó el lock en un hilo: el loop siguió atendiendo
+    assert elapsed >= LOCK_SECONDS * 0.8
+    assert beats >= 10
+
+
+def test_aembed_miss_no_espera_la_escritura_en_cache(tmp_path):
+    service, cache = _service(tmp_path)
+
+    async def _run():
+        _hold_write_lock(cache.db_path, LOCK_SECONDS)
+        result = await _with_heartbeat(service.aembed("otra pregunta"))
+        # la escritura queda en segundo plano hasta que se libera el lock
+        await asyncio.sleep(LOCK_SECONDS * 2)
+        return result
+
+    (vec, beats, elapsed) = asyncio.run(_run())
+    assert vec == [0.5, 0.25, 0.125]
+    assert elapsed < LOCK_SECONDS / 2
+    assert cache.get(service._cache_key("otra pregunta")) == [0.5, 0.25, 0.125]
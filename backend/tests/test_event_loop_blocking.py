@@ -0,0 +1,136 @@
+import asyncio
+import time
+from types import SimpleNamespace as NS
+
+from azure.cosmos import exceptions
+
+from core.ai_services import AIServices
+from helpers.orchestrator import Orchestrator
+from utils.functions import Functions
+
+BLOCK_SECONDS = 0.3
+
+
+async def _with_heartbeat(coro) -> tuple[object, int]:
+    """Ejecuta coro y cuenta cuántas veces alcanzó a correr otra corrutina mientras tanto."""
+    beats = 0
+    done = asyncio.Event()
+
+    async def _beat():
+        nonlocal beats
+        while not done.is_set():
+            beats += 1
+            await asyncio.sleep(0.01)
+
+    beat = asyncio.create_task(_beat())
+    try:
+        result = await coro
+    finally:
+        done.set()
+        await beat
+    return result, beats
+
+
+class SlowContainer:
+    """Contenedor de Cosmos cuyas llamadas bloquean el hilo (como el SDK sync)."""
+
+    def __init__(self) -> None:
+        self.items: dict[str, dict] = {}
+
+    def read_item(self, item, partition_key):
+        time.sleep(BLOCK_SECONDS)
+        if item not in self.items:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message="not found")
+        return self.items[item]
+
+    def create_item(self, body):
+        time.sleep(BLOCK_SECONDS)
+        self.items[body["id"]] = body
+        return body
+
+    def upsert_item(self, body):
+        return self.create_item(body)
+
+    def patch_item(self, item, partition_key, patch_operations):
+        time.sleep(BLOCK_SECONDS)
+
+    def query_items(self, **kwargs):
+        time.sleep(BLOCK_SECONDS)
+        return iter([])
+
+
+class FakeTitleLLM:
+    def __init__(self) -> None:
+        self.sync_calls = 0
+
+    def invoke(self, messages):
+        self.sync_calls += 1
+        time.sleep(BLOCK_SECONDS)
+        return NS(content="Título bloqueante")
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(BLOCK_SECONDS)
+        return NS(content="Conflicto de competencia")
+
+
+def _cosmosdb() -> AIServices.AzureCosmosDB:
+    db = AIServices.AzureCosmosDB.__new__(AIServices.AzureCosmosDB)
+    db.function = Functions()
+    db.llm = FakeTitleLLM()
+    db.modelo_ia = "chat"
+    db.version_api_ia = "v"
+    db.sessions_container = SlowContainer()
+    db.messages_container = SlowContainer()
+    return db
+
+
+def test_asave_message_chat_sesion_nueva_no_bloquea_el_loop():
+    db = _cosmosdb()
+    _, beats = asyncio.run(_with_heartbeat(db.asave_message_chat(
+        session_id="s1", user_id="u", user_question="¿Quién conoce del conflicto?", ia_response="La Sala Plena",
+    )))
+    # 5 llamadas de ~0.3 s (lectura, título, creación, mensaje, touch): el loop siguió atendiendo
+    assert beats >= 60
+    assert db.llm.sync_calls == 0
+    assert db.sessions_container.items["s1"]["name_session"] == "Conflicto de competencia"
+
+
+def test_stream_resuelve_la_sesion_nueva_fuera_del_loop():
+    orch = Orchestrator.__new__(Orchestrator)
+    orch.cosmosdb = _cosmosdb()  # get_user_sessions = consulta cross-partition lenta
+    orch._background_tasks = set()
+
+    async def _open_stream():
+        session_id, events = await orch.ejecutar_agente_stream("hola", "u", None)
+        for task in list(orch._background_tasks):
+            task.cancel()
+        return session_id
+
+    session_id, beats = asyncio.run(_with_heartbeat(_open_stream()))
+    assert session_id
+    assert beats >= 15
+
+
+def test_registrar_turno_no_bloquea_el_loop():
+    class SlowMemory:
+        def __init__(self) -> None:
+            self.folded = []
+
+        def append(self, session_id, user_question, ia_response) -> bool:
+            time.sleep(BLOCK_SECONDS)  # get_session + patch (o el seed de una sesión antigua)
+            return True
+
+        async def afold(self, session_id) -> None:
+            self.folded.append(session_id)
+
+    orch = Orchestrator.__new__(Orchestrator)
+    orch.memory = SlowMemory()
+    orch._background_tasks = set()
+
+    async def _run():
+        await orch._registrar_turno("s", "pregunta", "respuesta")
+        await asyncio.gather(*orch._background_tasks)
+
+    _, beats = asyncio.run(_with_heartbeat(_run()))
+    assert beats >= 15
+    assert orch.memory.folded == ["s"]
@@ -0,0 +1,175 @@
+import asyncio
+import io
+import os
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace as NS
+
+import pytest
+from azure.cosmos import exceptions
+from starlette.datastructures import Headers, UploadFile
+
+from app.config import settings
+from helpers.ingest_jobs import IngestJobTracker
+from helpers.orchestrator import Orchestrator
+from helpers.session_manifest import SessionManifest
+from tests.cosmos_fakes import fake_cosmosdb
+
+
+def _iso(seconds_ago: float = 0) -> str:
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)).isoformat()
+
+
+class FakeJobsCosmos:
+    """create/get/patch de jobs con el filter_predicate sobre updated_at que usa el tracker."""
+
+    def __init__(self) -> None:
+        self.jobs: dict[str, dict] = {}
+        self.patch_threads: set[str] = set()
+
+    def create_ingest_job(self, job):
+        item = {**job, "created_at": _iso(), "updated_at": _iso()}
+        self.jobs[job["id"]] = item
+        return dict(item)
+
+    def get_ingest_job(self, job_id):
+        job = self.jobs.get(job_id)
+        return dict(job) if job else None
+
+    def patch_ingest_job(self, job_id, fields, filter_predicate=None):
+        self.patch_threads.add(threading.current_thread().name)
+        job = self.jobs[job_id]
+        if filter_predicate:
+            expected = re.search(r"c\.updated_at = '([^']+)'", filter_predicate).group(1)
+            if job["updated_at"] != expected:
+                raise exceptions.CosmosAccessConditionFailedError(status_code=412, message="precondition")
+        for k, v in fields.items():
+            job[k] = v
+        job["updated_at"] = _iso()
+
+
+def _tracker(stale_seconds: float = 60) -> IngestJobTracker:
+    return IngestJobTracker(FakeJobsCosmos(), stale_seconds=stale_seconds)
+
+
+def test_job_sin_latido_se_marca_failed():
+    jobs = _tracker()
+    job = jobs.create("u", "s", ["a.pdf"])
+    jobs.cosmosdb.jobs[job["id"]].update(status="running", updated_at=_iso(120))
+
+    expired = jobs.expire_if_stale(jobs.get(job["id"]))
+    assert expired["status"] == "failed"
+    assert expired["error"]
+
+
+def test_job_con_latido_reciente_o_terminado_no_se_toca():
+    jobs = _tracker()
+    vivo = jobs.create("u", "s", ["a.pdf"])
+    jobs.set_status(vivo["id"], "running")
+    assert jobs.expire_if_stale(jobs.get(vivo["id"]))["status"] == "running"
+
+    terminado = jobs.create("u", "s", ["b.pdf"])
+    jobs.cosmosdb.jobs[terminado["id"]].update(status="done", updated_at=_iso(3600))
+    assert jobs.expire_if_stale(jobs.get(terminado["id"]))["status"] == "done"
+
+
+def test_latido_concurrente_gana_al_vencimiento():
+    jobs = _tracker()
+    job = jobs.create("u", "s", ["a.pdf"])
+    jobs.cosmosdb.jobs[job["id"]].update(status="running", updated_at=_iso(120))
+    leido = jobs.get(job["id"])
+
+    jobs.touch(job["id"])  # el worker escribe entre la lectura y el vencimiento
+    assert jobs.expire_if_stale(leido)["status"] == "running"
+
+
+def test_run_ingest_job_late_y_escribe_fuera_del_loop(monkeypatch):
+    monkeypatch.setattr(settings, "INGEST_JOB_HEARTBEAT_SECONDS", 0.05)
+    orch = Orchestrator.__new__(Orchestrator)
+    orch.ingest_jobs = _tracker(stale_seconds=0.2)
+    touches = []
+    original_touch = orch.ingest_jobs.touch
+    orch.ingest_jobs.touch = lambda job_id: (touches.append(job_id), original_touch(job_id))
+
+    async def _ingest_files(files, user_id, session_id, job_id=None, reservas=None):
+        # un archivo que tarda más que stale_seconds sin reportar progreso
+        for _ in range(6):
+            await asyncio.sleep(0.1)
+            assert not orch.ingest_jobs.is_stale(orch.ingest_jobs.get(job_id))
+        return [{"file_name": "a.pdf", "ok": True}]
+
+    orch._ingest_files = _ingest_files
+
+    async def _run():
+        job = orch.ingest_jobs.create("u", "s", ["a.pdf"])
+        await orch._run_ingest_job(job["id"], [], "u", "s")
+        return job["id"]
+
+    job_id = asyncio.run(_run())
+    assert orch.ingest_jobs.get(job_id)["status"] == "done"
+    assert len(touches) >= 5
+    # ninguna escritura en Cosmos corrió en el hilo del event loop
+    assert "MainThread" not in orch.ingest_jobs.cosmosdb.patch_threads
+
+
+def _upload_orchestrator(tmp_path, monkeypatch, save_error: Exception | None = None) -> Orchestrator:
+    monkeypatch.setattr(settings, "UPLOAD_SPOOL_MAX_MEMORY_MB", 0)  # todo a disco
+    monkeypatch.setattr(settings, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    orch = Orchestrator.__new__(Orchestrator)
+    orch.ingest_jobs = _tracker()
+    orch.manifest = SessionManifest(fake_cosmosdb())
+    orch._background_tasks = set()
+    orch.started = []
+
+    async def _save(**kwargs):
+        await asyncio.sleep(0)
+        if save_error:
+            raise save_error
+
+    async def _registrar_turno(*args):
+        return None
+
+    async def _run_ingest_job(job_id, files, user_id, session_id, reservas=None):
+        orch.started.append(job_id)
+        for f in files:
+            f.discard()
+
+    orch.cosmosdb = NS(asave_message_chat=_save)
+    orch._registrar_turno = _registrar_turno
+    orch._run_ingest_job = _run_ingest_job
+    return orch
+
+
+def _pdf_upload(name: str) -> UploadFile:
+    return UploadFile(
+        file=io.BytesIO(b"%PDF-1.4 " + name.encode()),
+        filename=name,
+        headers=Headers({"content-type": "application/pdf"}),
+    )
+
+
+def test_iniciar_ingesta_acepta_el_job_y_lo_arranca(tmp_path, monkeypatch):
+    orch = _upload_orchestrator(tmp_path, monkeypatch)
+
+    async def _run():
+        res = await orch.iniciar_ingesta("u", "s", [_pdf_upload("a.pdf")])
+        await asyncio.gather(*orch._background_tasks)
+        return res
+
+    res = asyncio.run(_run())
+    assert orch.started == [res["job_id"]]
+    assert len(orch.manifest.get("s")["pending"]) == 1
+
+
+def test_iniciar_ingesta_si_falla_el_mensaje_no_deja_nada_pendiente(tmp_path, monkeypatch):
+    orch = _upload_orchestrator(tmp_path, monkeypatch, save_error=RuntimeError("cosmos caído"))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(orch.iniciar_ingesta("u", "s", [_pdf_upload("a.pdf"), _pdf_upload("b.pdf")]))
+
+    assert orch.started == []
+    assert os.listdir(tmp_path) == []  # spools borrados
+    assert orch.manifest.get("s")["pending"] == []  # cupos devueltos
+    (job,) = orch.ingest_jobs.cosmosdb.jobs.values()
+    assert job["status"] == "failed"
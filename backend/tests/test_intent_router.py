@@ -0,0 +1,51 @@
+import pytest
+
+from helpers.intent_router import (
+    TOOL_CONVERSACIONAL,
+    TOOL_USERDOCS,
+    TOOL_WORD,
+    IntentRouter,
+)
+
+FILES = ["Demanda_Ejecutiva.pdf", "auto.pdf"]
+
+
+def _rule(question: str, file_names=None):
+    decision = IntentRouter(embedder=None)._rule_decision(question, file_names or [])
+    return decision and (decision["tool"], decision["reason"])
+
+
+@pytest.mark.parametrize("question", ["Hola", "buenas tardes!", "Muchas gracias.", "adiós"])
+def test_saludos(question):
+    assert _rule(question) == (TOOL_CONVERSACIONAL, "saludo")
+
+
+def test_saludo_con_pregunta_no_es_saludo():
+    assert _rule("hola, qué dice la jurisprudencia sobre tutela") is None
+
+
+@pytest.mark.parametrize("question", ["Genera el Word con el análisis", "descarga el docx", "hazme un word"])
+def test_word(question):
+    assert _rule(question) == (TOOL_WORD, "word")
+
+
+def test_word_sin_verbo_no_dispara():
+    assert _rule("qué es un archivo word") is None
+
+
+@pytest.mark.parametrize("question", ["y qué más?", "¿Cómo me llamo?", "explica lo anterior", "eso aplica a mi caso?"])
+def test_historial_va_al_agente(question):
+    assert _rule(question, FILES) == (None, "historial")
+
+
+def test_cada_documento_solo_con_archivos():
+    assert _rule("resume cada documento", FILES) == (TOOL_USERDOCS, "por_documento")
+    assert _rule("resume cada documento") is None
+
+
+def test_pregunta_que_nombra_un_archivo():
+    assert _rule("qué pide demanda_ejecutiva sobre intereses", FILES) == (
+        TOOL_USERDOCS, "archivo:Demanda_Ejecutiva.pdf",
+    )
+    # nombres de menos de 4 letras no cuentan como mención
+    assert _rule("qué dice el acta sobre la audiencia", ["act.pdf"]) is None
@@ -0,0 +1,51 @@
+import asyncio
+
+from helpers.embedding_cache import QueryEmbeddingCache
+
+
+def test_cancelar_al_que_calcula_no_cancela_a_los_que_esperan():
+    cache = QueryEmbeddingCache()
+    calls = []
+
+    async def _compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [float(len(calls))]
+
+    async def _run():
+        owner = asyncio.create_task(cache.aget_or_compute("k", _compute))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(cache.aget_or_compute("k", _compute)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        results = await asyncio.gather(*waiters)
+        return owner, results
+
+    owner, results = asyncio.run(_run())
+    assert owner.cancelled()
+    # uno de los que esperaban recalculó y los otros se unieron a ese cálculo
+    assert results == [[2.0]] * 3
+    assert len(calls) == 2
+    assert cache._inflight == {}
+
+
+def test_cancelar_a_uno_que_espera_no_afecta_el_calculo():
+    cache = QueryEmbeddingCache()
+
+    async def _compute():
+        await asyncio.sleep(0.05)
+        return [1.0]
+
+    async def _run():
+        owner = asyncio.create_task(cache.aget_or_compute("k", _compute))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.aget_or_compute("k", _compute))
+        other = asyncio.create_task(cache.aget_or_compute("k", _compute))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        return await owner, await other, waiter
+
+    vec, other_vec, waiter = asyncio.run(_run())
+    assert vec == other_vec == [1.0]
+    assert waiter.cancelled()
+    assert cache.stats()["coalesced"] == 2
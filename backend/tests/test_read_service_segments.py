@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace as NS
+
+import pymupdf
+import pytest
+
+import helpers.read_service as read_service
+from app.config import settings
+from helpers.read_service import DocumentIntelligenceExtractor
+
+N_PAGES = 23
+
+
+def _pdf(n_pages: int) -> bytes:
+    doc = pymupdf.open()
+    for i in range(1, n_pages + 1):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"pagina {i}")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+class FakeAsyncDI:
+    """Cliente async de DI: "analiza" el cuerpo recibido leyendo su capa de texto."""
+
+    bodies: list[dict] = []
+
+    def __init__(self, **kwargs) -> None:
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return None
+
+    async def begin_analyze_document(self, model_id, body, content_type, **kwargs):
+        with pymupdf.open(stream=body, filetype="pdf") as doc:
+            pages = [
+                NS(page_number=i + 1, lines=[NS(content=page.get_text("text").strip())])
+                for i, page in enumerate(doc)
+            ]
+            FakeAsyncDI.bodies.append({"pages": doc.page_count, "size": len(body), "kwargs": kwargs})
+
+        async def _result():
+            await asyncio.sleep(0)
+            return NS(pages=pages, paragraphs=None)
+
+        return NS(result=_result)
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    FakeAsyncDI.bodies = []
+    monkeypatch.setattr(read_service, "AsyncDocumentIntelligenceClient", FakeAsyncDI)
+    monkeypatch.setattr(settings, "DI_SPLIT_MIN_PAGES", 10)
+    monkeypatch.setattr(settings, "DI_PAGES_PER_SEGMENT", 5)
+    monkeypatch.setattr(settings, "DI_MAX_CONCURRENT_SEGMENTS", 2)
+    return DocumentIntelligenceExtractor.__new__(DocumentIntelligenceExtractor)
+
+
+def test_cada_segmento_sube_solo_sus_paginas(extractor):
+    data = _pdf(N_PAGES)
+    method, pages = extractor.route(data, "application/pdf")
+    assert method == "document_intelligence_segmented"
+
+    # texto en orden y con la numeración del PDF original
+    assert list(pages) == [f"pagina {i}" for i in range(1, N_PAGES + 1)]
+
+    assert sorted(b["pages"] for b in FakeAsyncDI.bodies) == [3, 5, 5, 5, 5]
+    assert all("pages" not in b["kwargs"] for b in FakeAsyncDI.bodies)
+    assert max(b["size"] for b in FakeAsyncDI.bodies) < len(data)
+
+
+def test_segmentado_dentro_de_un_event_loop_falla_con_mensaje_claro(extractor):
+    async def _run():
+        _, pages = extractor.route(_pdf(N_PAGES), "application/pdf")
+        return list(pages)
+
+    with pytest.raises(RuntimeError, match="hilo sin loop"):
+        asyncio.run(_run())
+
+
+def test_segmentado_desde_un_hilo_del_loop(extractor):
+    async def _run():
+        _, pages = extractor.route(_pdf(N_PAGES), "application/pdf")
+        return await asyncio.to_thread(list, pages)
+
+    assert len(asyncio.run(_run())) == N_PAGES
@@ -0,0 +1,60 @@
+from types import SimpleNamespace as NS
+
+from helpers.session_index import RRF_K, SessionIndexCache, SessionVectorIndex
+
+
+def test_indice_de_sesion_sin_chunks():
+    idx = SessionVectorIndex([], version=(1, 0))
+    assert (len(idx), idx.dimensions, idx.nbytes) == (0, 0, 0)
+    assert idx.hybrid_search("competencia", [1.0, 0.0], top_k=3) == []
+
+
+def test_carga_de_sesion_vacia_no_falla():
+    manifest = NS(files=lambda user_id, session_id: [{"file_id": "f", "chunks": 0}])
+    indexer = NS(get_session_chunks=lambda user_id, session_id: [])
+    cache = SessionIndexCache(indexer, manifest, max_bytes=1 << 20, max_chunks=1000)
+
+    cache._load(cache._key("u", "s"), "u", "s", (1, 0))
+
+    assert cache.stats()["loads"] == 1
+    assert cache._retry_at == {}
+
+
+def _index() -> SessionVectorIndex:
+    docs = [
+        {"content": "competencia territorial del juez", "file_name": "a.pdf", "file_id": "f1", "chunk_id": 0,
+         "content_vector": [1.0, 0.0]},
+        {"content": "pensión de sobrevivientes", "file_name": "b.pdf", "file_id": "f2", "chunk_id": 0,
+         "content_vector": [0.0, 1.0]},
+        {"content": "competencia competencia funcional", "file_name": "a.pdf", "file_id": "f1", "chunk_id": 1,
+         "content_vector": [0.7, 0.7]},
+    ]
+    return SessionVectorIndex(docs, version=(2, 3))
+
+
+def test_bm25_prefiere_mas_frecuencia_en_documentos_cortos():
+    idx = _index()
+    assert idx._bm25_ranking("Competencia", None, 10) == [2, 0]
+    assert idx._bm25_ranking("tutela", None, 10) == []
+
+
+def test_ranking_vectorial_por_coseno_y_con_filtro_de_archivo():
+    idx = _index()
+    assert idx._vector_ranking([2.0, 0.0], None, 3) == [0, 2, 1]
+    assert idx._vector_ranking([2.0, 0.0], idx.file_ids == "f2", 3) == [1]
+
+
+def test_rrf_suma_los_dos_rankings():
+    idx = _index()
+    hits = idx.hybrid_search("pensión", [1.0, 0.0], top_k=3)
+
+    # b.pdf: 3.º por vector y 1.º por texto; a.pdf chunk 0: 1.º solo por vector
+    assert [(h["file_name"], h["chunk_id"]) for h in hits] == [("b.pdf", 0), ("a.pdf", 0), ("a.pdf", 1)]
+    assert hits[0]["@search.score"] == 1 / (RRF_K + 3) + 1 / (RRF_K + 1)
+    assert hits[1]["@search.score"] == 1 / (RRF_K + 1)
+
+
+def test_busqueda_por_archivo():
+    hits = _index().hybrid_search("competencia", [0.0, 1.0], top_k=5, file_id="f1")
+    assert {h["file_id"] for h in hits} == {"f1"}
+    assert [h["chunk_id"] for h in hits] == [1, 0]
@@ -0,0 +1,147 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace as NS
+
+import pytest
+from fastapi import HTTPException
+
+from helpers.document_store import DocumentHashStore
+from helpers.ingestion import IngestionService
+from helpers.orchestrator import MAX_FILES_PER_SESSION, Orchestrator
+from helpers.session_manifest import SessionFileLimitError, SessionManifest
+from tests.cosmos_fakes import fake_cosmosdb
+
+
+def _entry(n: int, file_hash: str = None) -> dict:
+    return {"file_id": f"file-{n}", "file_name": f"doc-{n}.pdf", "hash": file_hash or f"hash-{n}"}
+
+
+def _ingestor(manifest: SessionManifest, extractor=None) -> IngestionService:
+    return IngestionService(
+        extractor=extractor,
+        cleaner=None,
+        chunker=None,
+        embedder=NS(deployment="emb", dimensions=3),
+        indexer=None,
+        manifest=manifest,
+    )
+
+
+def test_reserva_detecta_duplicado_en_pending_y_en_files():
+    manifest = SessionManifest(fake_cosmosdb())
+    assert manifest.reserve("u", "s", [_entry(1)]) == [None]
+
+    # mismo contenido mientras se ingesta -> duplicado de la reserva
+    previous = manifest.reserve("u", "s", [_entry(2, file_hash="hash-1")])[0]
+    assert previous["file_id"] == "file-1"
+
+    # terminado -> duplicado del archivo registrado (con sus chunks)
+    manifest.add_file("u", "s", "file-1", "doc-1.pdf", chunks=7, file_hash="hash-1")
+    doc = manifest.get("s")
+    assert doc["pending"] == []
+    previous = manifest.reserve("u", "s", [_entry(3, file_hash="hash-1")])[0]
+    assert (previous["file_id"], previous["chunks"]) == ("file-1", 7)
+
+
+def test_borrar_sesion_libera_el_contenido_para_volver_a_subirlo():
+    cosmosdb = fake_cosmosdb()
+    manifest = SessionManifest(cosmosdb)
+    manifest.reserve("u", "s", [_entry(1)])
+    manifest.add_file("u", "s", "file-1", "doc-1.pdf", chunks=3, file_hash="hash-1")
+
+    cosmosdb.delete_session_manifest("s")  # lo que hace delete_session
+
+    assert manifest.reserve("u", "s", [_entry(2, file_hash="hash-1")]) == [None]
+
+
+def test_reservas_concurrentes_entre_replicas_solo_una_gana():
+    cosmosdb = fake_cosmosdb()
+    # cada "réplica" con su propio SessionManifest sobre el mismo Cosmos
+    replicas = [SessionManifest(cosmosdb) for _ in range(8)]
+    results = [None] * len(replicas)
+    barrier = threading.Barrier(len(replicas))
+
+    def _reserve(i: int) -> None:
+        barrier.wait()
+        results[i] = replicas[i].reserve("u", "s", [_entry(i, file_hash="mismo")])[0]
+
+    threads = [threading.Thread(target=_reserve, args=(i,)) for i in range(len(replicas))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(r is None for r in results) == 1
+    assert len(replicas[0].get("s")["pending"]) == 1
+
+
+def test_reserva_vencida_no_bloquea(monkeypatch):
+    manifest = SessionManifest(fake_cosmosdb())
+    manifest.reserve("u", "s", [_entry(1)])
+    later = datetime.now(timezone.utc) + timedelta(days=1)
+    monkeypatch.setattr(SessionManifest, "_now", staticmethod(lambda: later.isoformat()))
+    monkeypatch.setattr(
+        "helpers.session_manifest.datetime",
+        type("dt", (datetime,), {"now": staticmethod(lambda tz=None: later)}),
+    )
+    assert manifest.reserve("u", "s", [_entry(2, file_hash="hash-1")]) == [None]
+
+
+def test_ingesta_duplicada_se_omite_y_la_fallida_libera_la_reserva():
+    manifest = SessionManifest(fake_cosmosdb())
+    manifest.reserve("u", "s", [_entry(1, file_hash=DocumentHashStore.hash_bytes(b"contenido"))])
+
+    res = _ingestor(manifest).ingest(b"contenido", "application/pdf", "copia.pdf", "u", "s")
+    assert res["dedup"] == "session_duplicate"
+    assert res["file_id"] == "file-1"
+
+    class Failing:
+        def route(self, source, content_type):
+            raise RuntimeError("extracción falló")
+
+    with pytest.raises(RuntimeError):
+        _ingestor(manifest, Failing()).ingest(b"otro", "application/pdf", "otro.pdf", "u", "s")
+    assert [p["file_id"] for p in manifest.get("s")["pending"]] == ["file-1"]
+
+
+def test_limite_de_archivos_cuenta_terminados_y_reservados():
+    manifest = SessionManifest(fake_cosmosdb())
+    manifest.reserve("u", "s", [_entry(i) for i in range(3)], limit=5)
+    manifest.add_file("u", "s", "file-0", "doc-0.pdf", chunks=1, file_hash="hash-0")
+
+    with pytest.raises(SessionFileLimitError) as exc:
+        manifest.reserve("u", "s", [_entry(i) for i in range(10, 13)], limit=5)
+    assert exc.value.existing == 3
+    # nada quedó reservado y los duplicados no gastan cupo
+    result = manifest.reserve("u", "s", [_entry(0), _entry(1), _entry(10), _entry(11)], limit=5)
+    assert [r["file_id"] if r else None for r in result] == ["file-0", "file-1", None, None]
+    assert len(manifest.get("s")["files"]) + len(manifest.get("s")["pending"]) == 5
+
+
+def test_subidas_concurrentes_no_pasan_el_limite_de_la_sesion():
+    orch = Orchestrator.__new__(Orchestrator)
+    orch.manifest = SessionManifest(fake_cosmosdb())
+
+    def _spooled(request: int) -> list:
+        return [NS(filename=f"r{request}-{i}.pdf", sha256=f"r{request}-{i}") for i in range(25)]
+
+    async def _upload(request: int):
+        try:
+            return await orch._reservar_archivos("u", "s", _spooled(request))
+        except HTTPException as e:
+            return e
+
+    async def _all():
+        return await asyncio.gather(*(_upload(r) for r in range(4)))
+
+    results = asyncio.run(_all())
+    accepted = [r for r in results if not isinstance(r, HTTPException)]
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(accepted) == 1
+    assert {r.status_code for r in rejected} == {409}
+    assert len(orch.manifest.get("s")["pending"]) == 25 <= MAX_FILES_PER_SESSION
+
+    # si el job no llega a crearse, el cupo se devuelve
+    asyncio.run(orch._liberar_reservas("u", "s", accepted[0]))
+    assert orch.manifest.get("s")["pending"] == []
@@ -0,0 +1,69 @@
+import asyncio
+
+from langchain.agents import AgentType, Tool, initialize_agent
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from helpers.streaming import AgentStreamHandler, StreamEmitter, bind_emitter, reset_emitter
+from helpers.tools import Tools
+
+RESPUESTA = "Hola, ¿en qué te puedo ayudar hoy?"
+
+
+def _agent(tools: Tools):
+    # el agente elige tool_conversacional; la tool responde con su propio LLM en streaming
+    llm_agente = GenericFakeChatModel(messages=iter([
+        AIMessage(
+            content="",
+            additional_kwargs={"function_call": {"name": "tool_conversacional", "arguments": '{"__arg1": "hola"}'}},
+        )
+    ]))
+    return initialize_agent(
+        tools=[
+            Tool.from_function(
+                func=tools.tool_conversacional,
+                coroutine=tools.atool_conversacional,
+                name="tool_conversacional",
+                description="charla",
+                return_direct=True,
+            )
+        ],
+        llm=llm_agente,
+        agent=AgentType.OPENAI_FUNCTIONS,
+    )
+
+
+def _tools() -> Tools:
+    llm_chat = GenericFakeChatModel(messages=iter([AIMessage(content=RESPUESTA)]))
+    return Tools(rag_userdocs=None, rag_corpus=None, llm_chat=llm_chat, doc_generator=None, cosmosdb=None)
+
+
+async def _stream(use_async: bool) -> tuple[str, str]:
+    emitter = StreamEmitter()
+    agent = _agent(_tools())
+    config = {"callbacks": [AgentStreamHandler(emitter)]}
+
+    token = bind_emitter(emitter)
+    try:
+        if use_async:
+            result = await agent.ainvoke({"input": "hola"}, config)
+        else:
+            result = await asyncio.to_thread(agent.invoke, {"input": "hola"}, config)
+    finally:
+        reset_emitter(token)
+        emitter.close()
+
+    streamed = "".join([data["text"] async for event, data in emitter.events() if event == "token"])
+    return streamed, result["output"]
+
+
+def test_stream_agente_sync_emite_cada_token_una_vez():
+    streamed, output = asyncio.run(_stream(use_async=False))
+    assert output == RESPUESTA
+    assert streamed.strip() == output
+
+
+def test_stream_agente_async_emite_cada_token_una_vez():
+    streamed, output = asyncio.run(_stream(use_async=True))
+    assert output == RESPUESTA
+    assert streamed.strip() == output
@@ -0,0 +1,95 @@
+from types import SimpleNamespace as NS
+
+import pymupdf
+
+from helpers.read_service import DocumentIntelligenceExtractor, LocalTextExtractor, TextExtractionRouter
+
+PDF_CT = "application/pdf"
+TEXT = "Texto de la página {n} con suficiente contenido para la capa de texto."
+
+
+def _pdf(kinds: str) -> bytes:
+    """Una página por letra: t = texto, i = solo imagen (escaneada), b = en blanco."""
+    doc = pymupdf.open()
+    pix = pymupdf.Pixmap(pymupdf.csRGB, pymupdf.IRect(0, 0, 8, 8), 0)
+    pix.clear_with(200)
+    for n, kind in enumerate(kinds, start=1):
+        page = doc.new_page()
+        if kind == "t":
+            page.insert_text((72, 72), TEXT.format(n=n))
+        elif kind == "i":
+            page.insert_image(pymupdf.Rect(72, 72, 300, 300), pixmap=pix)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+class FakeRemote:
+    def __init__(self) -> None:
+        self.ocr_calls: list[list[int]] = []
+        self.full_calls = 0
+
+    def extract_pdf_page_numbers(self, file_bytes, page_numbers):
+        self.ocr_calls.append(list(page_numbers))
+        return {n: f"OCR página {n}" for n in page_numbers}
+
+    def route(self, file_bytes, content_type):
+        self.full_calls += 1
+        return "document_intelligence", iter(["DI completo"])
+
+
+def _router(remote: FakeRemote) -> TextExtractionRouter:
+    local = LocalTextExtractor(min_chars_per_page=20, min_text_page_ratio=0.5)
+    return TextExtractionRouter(remote=remote, local=local, local_enabled=True)
+
+
+def test_pdf_con_texto_se_extrae_local_sin_ocr():
+    remote = FakeRemote()
+    method, pages = _router(remote).route(_pdf("ttbt"), PDF_CT)
+    assert method == "local_pdf"
+    assert list(pages) == [TEXT.format(n=1), TEXT.format(n=2), TEXT.format(n=4)]
+    assert remote.ocr_calls == [] and remote.full_calls == 0
+
+
+def test_paginas_solo_imagen_van_a_ocr_y_conservan_el_orden(caplog):
+    remote = FakeRemote()
+    with caplog.at_level("INFO"):
+        method, pages = _router(remote).route(_pdf("titit"), PDF_CT)
+    assert method == "local_pdf+ocr"
+    assert list(pages) == [
+        TEXT.format(n=1), "OCR página 2", TEXT.format(n=3), "OCR página 4", TEXT.format(n=5),
+    ]
+    # solo las páginas escaneadas, en una sola llamada
+    assert remote.ocr_calls == [[2, 4]]
+    assert "[2, 4]" in caplog.text
+
+
+def test_pdf_mayormente_escaneado_va_completo_a_document_intelligence():
+    remote = FakeRemote()
+    method, pages = _router(remote).route(_pdf("tiii"), PDF_CT)
+    assert method == "document_intelligence"
+    assert list(pages) == ["DI completo"]
+    assert remote.ocr_calls == []
+
+
+def test_ocr_de_paginas_sueltas_envia_un_sub_pdf_y_renumera():
+    sent = {}
+
+    def _analyze(model_id, body, content_type):
+        with pymupdf.open(stream=body, filetype="pdf") as doc:
+            sent["pages"] = doc.page_count
+        result = NS(
+            pages=[
+                NS(page_number=1, lines=[NS(content="uno")]),
+                NS(page_number=2, lines=[NS(content="dos")]),
+            ],
+            paragraphs=None,
+        )
+        return NS(result=lambda: result)
+
+    extractor = DocumentIntelligenceExtractor.__new__(DocumentIntelligenceExtractor)
+    extractor.client = NS(begin_analyze_document=_analyze)
+
+    texts = extractor.extract_pdf_page_numbers(_pdf("titit"), [2, 4])
+    assert sent["pages"] == 2
+    assert texts == {2: "uno", 4: "dos"}
@@ -0,0 +1,168 @@
+import asyncio
+import io
+import json
+import random
+import re
+
+from langchain.agents import AgentType, initialize_agent
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, FunctionMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from starlette.datastructures import Headers, UploadFile
+
+from helpers.orchestrator import Orchestrator
+from helpers.prompts import system_prompt_agente
+from helpers.tools import Tools
+from utils.functions import Functions
+
+N_REQUESTS = 100
+
+
+class FunctionCallingFake(BaseChatModel):
+    """Llama a tool_rag_userdocs con el marcador del request y devuelve su resultado."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-function-calling"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        last = messages[-1]
+        if isinstance(last, FunctionMessage):
+            message = AIMessage(content=last.content)
+        else:
+            pregunta = next(m.content for m in reversed(messages) if isinstance(m, HumanMessage))
+            marcador = re.findall(r"req-\d+", pregunta)[-1]
+            message = AIMessage(
+                content="",
+                additional_kwargs={
+                    "function_call": {"name": "tool_rag_userdocs", "arguments": json.dumps({"__arg1": marcador})}
+                },
+            )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(random.uniform(0, 0.01))
+        return self._generate(messages, stop, run_manager, **kwargs)
+
+
+class FakeRAG:
+    """Registra lo que la tool ve del contexto del request en el momento de buscar."""
+
+    def __init__(self) -> None:
+        self.tools: Tools | None = None
+        self.seen: list[dict] = []
+
+    async def aanswer(self, question, user_id, session_id, top_k=6):
+        await asyncio.sleep(random.uniform(0, 0.01))
+        seen = {
+            "q": question,
+            "user": user_id,
+            "session": session_id,
+            "files": sorted(f.filename for f in self.tools.files),
+        }
+        self.seen.append(seen)
+        return {"answer": json.dumps(seen), "chunks_used": []}
+
+
+class FakeCosmos:
+    def __init__(self) -> None:
+        self.saved: list[dict] = []
+
+    async def asave_message_chat(self, **kwargs) -> None:
+        self.saved.append(kwargs)
+
+
+class FakeManifest:
+    def reserve(self, user_id, session_id, entries, limit=None) -> list:
+        return [None] * len(entries)
+
+    def release(self, user_id, session_id, *file_ids) -> None:
+        pass
+
+
+class FakeMemory:
+    def history(self, session_id: str) -> str:
+        return ""
+
+    def append(self, session_id: str, user_question: str, ia_response: str) -> bool:
+        return False
+
+
+def _orchestrator() -> tuple[Orchestrator, FakeRAG, FakeCosmos]:
+    # solo lo que usa ejecutar_agente; sin clientes de Azure
+    orch = Orchestrator.__new__(Orchestrator)
+    rag = FakeRAG()
+    orch.tools_class = Tools(rag_userdocs=rag, rag_corpus=rag, llm_chat=None, doc_generator=None, cosmosdb=None)
+    rag.tools = orch.tools_class
+    orch.cosmosdb = FakeCosmos()
+    orch.manifest = FakeManifest()
+    orch.memory = FakeMemory()
+    orch.function = Functions()
+    orch.router = None
+    orch.query_cache = None
+    orch._background_tasks = set()
+
+    async def _ingest_files(spooled, user_id, session_id, reservas=None):
+        await asyncio.sleep(random.uniform(0, 0.01))
+        return [{"file_name": s.filename, "ok": True} for s in spooled]
+
+    orch._ingest_files = _ingest_files
+    orch.agent = initialize_agent(
+        tools=orch._build_tools(),
+        llm=FunctionCallingFake(),
+        agent=AgentType.OPENAI_FUNCTIONS,
+        agent_kwargs={"system_message": system_prompt_agente},
+    )
+    return orch, rag, orch.cosmosdb
+
+
+def _files(i: int) -> list[UploadFile]:
+    if i % 2:
+        return []
+    return [
+        UploadFile(
+            file=io.BytesIO(b"%PDF-1.4 contenido " + str(i).encode()),
+            filename=f"doc-{i}.pdf",
+            headers=Headers({"content-type": "application/pdf"}),
+        )
+    ]
+
+
+def _expected(i: int) -> dict:
+    return {
+        "q": f"req-{i}",
+        "user": f"user-{i}",
+        "session": f"session-{i}",
+        "files": [f"doc-{i}.pdf"] if i % 2 == 0 else [],
+    }
+
+
+def test_ejecutar_agente_concurrente_no_mezcla_contexto_de_tools():
+    orch, rag, cosmos = _orchestrator()
+
+    async def _one(i: int) -> dict:
+        return await orch.ejecutar_agente(
+            mensaje_usuario=f"¿Qué dice el documento sobre las pretensiones? req-{i}",
+            user_id=f"user-{i}",
+            session_id=f"session-{i}",
+            files=_files(i),
+        )
+
+    async def _all():
+        return await asyncio.gather(*(_one(i) for i in range(N_REQUESTS)))
+
+    results = asyncio.run(_all())
+
+    # cada tool vio exactamente el contexto de su propio request
+    assert len(rag.seen) == N_REQUESTS
+    for seen in rag.seen:
+        i = int(seen["q"].split("-")[1])
+        assert seen == _expected(i)
+
+    # y cada respuesta llegó a su request y se guardó en su sesión
+    for i, result in enumerate(results):
+        assert result["session_id"] == f"session-{i}"
+        assert json.loads(result["reply_text"]) == _expected(i)
+    assert {m["session_id"] for m in cosmos.saved} == {f"session-{i}" for i in range(N_REQUESTS)}
+    for m in cosmos.saved:
+        assert m["user_id"] == m["session_id"].replace("session", "user")
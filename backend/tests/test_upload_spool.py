@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import os
+import tracemalloc
+
+import pytest
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from helpers.upload_spool import COPY_CHUNK_BYTES, SpooledUpload, UploadSizeLimitMiddleware, spool_uploads
+
+MB = 1024 * 1024
+
+
+class StreamingUpload:
+    """UploadFile que genera el contenido por bloques (nunca lo tiene completo en memoria)."""
+
+    def __init__(self, filename: str, total: int, size: int | None = None) -> None:
+        self.filename = filename
+        self.content_type = "application/pdf"
+        self.size = size
+        self.total = total
+        self.sent = 0
+        self.sha256 = hashlib.sha256()
+
+    async def seek(self, offset: int) -> None:
+        self.sent = offset
+
+    async def read(self, n: int = -1) -> bytes:
+        n = min(n, self.total - self.sent)
+        if n <= 0:
+            return b""
+        chunk = bytes([self.sent // MB % 251]) * n
+        self.sent += n
+        self.sha256.update(chunk)
+        return chunk
+
+
+@pytest.fixture
+def spool_settings(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "UPLOAD_SPOOL_MAX_MEMORY_MB", 1)
+    monkeypatch.setattr(settings, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_debajo_del_umbral_queda_en_memoria(spool_settings):
+    (out,) = asyncio.run(spool_uploads([StreamingUpload("a.pdf", MB // 2)]))
+    assert out.in_memory
+    assert out.size == MB // 2
+    assert os.listdir(spool_settings) == []
+
+
+def test_sobre_el_umbral_pasa_a_disco_con_sha256_correcto(spool_settings):
+    upload = StreamingUpload("grande.pdf", 5 * MB + 123)
+    (out,) = asyncio.run(spool_uploads([upload]))
+    try:
+        assert not out.in_memory
+        assert os.path.dirname(out.path) == str(spool_settings)
+        assert os.path.getsize(out.path) == out.size == 5 * MB + 123
+        assert out.sha256 == upload.sha256.hexdigest()
+        with out.open() as fh:
+            assert hashlib.sha256(fh.read()).hexdigest() == out.sha256
+    finally:
+        out.discard()
+    assert os.listdir(spool_settings) == []
+
+
+def test_memoria_acotada_al_copiar_un_archivo_grande(spool_settings):
+    size = 32 * MB
+    tracemalloc.start()
+    try:
+        (out,) = asyncio.run(spool_uploads([StreamingUpload("enorme.pdf", size)]))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    out.discard()
+    # buffer en memoria (hasta el umbral) + copia al pasar a disco + un bloque de lectura
+    assert peak < settings.UPLOAD_SPOOL_MAX_MEMORY_MB * MB * 2 + COPY_CHUNK_BYTES * 2
+    assert peak < size / 8
+
+
+def test_archivo_sobre_el_limite_da_413_y_limpia_el_disco(spool_settings):
+    uploads = [StreamingUpload("ok.pdf", 3 * MB), StreamingUpload("grande.pdf", 6 * MB)]
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(spool_uploads(uploads, max_file_bytes=5 * MB))
+    assert exc.value.status_code == 413
+    assert "grande.pdf" in exc.value.detail
+    # el corte es durante la copia, sin leer el resto del archivo
+    assert uploads[1].sent <= 5 * MB + COPY_CHUNK_BYTES
+    assert os.listdir(spool_settings) == []
+
+
+def test_request_sobre_el_limite_da_413(spool_settings):
+    uploads = [StreamingUpload(f"{i}.pdf", 3 * MB) for i in range(3)]
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(spool_uploads(uploads, max_file_bytes=5 * MB, max_request_bytes=8 * MB))
+    assert exc.value.status_code == 413
+    assert "por request" in exc.value.detail
+    assert os.listdir(spool_settings) == []
+
+
+def test_tamano_declarado_se_rechaza_sin_leer(spool_settings):
+    upload = StreamingUpload("declarado.pdf", 6 * MB, size=6 * MB)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(spool_uploads([upload], max_file_bytes=5 * MB))
+    assert exc.value.status_code == 413
+    assert upload.sent == 0
+
+
+def _app(max_bytes: int) -> TestClient:
+    app = FastAPI()
+
+    @app.post("/api/upload")
+    async def upload(files: list[UploadFile] = File(...)):
+        return {"n": len(files)}
+
+    app.add_middleware(UploadSizeLimitMiddleware, max_bytes=max_bytes)
+    return TestClient(app)
+
+
+def test_middleware_rechaza_por_content_length():
+    client = _app(max_bytes=1)  # + 1 MB de margen para el multipart
+    res = client.post("/api/upload", files={"files": ("a.pdf", b"x" * (3 * MB), "application/pdf")})
+    assert res.status_code == 413
+
+
+def test_middleware_rechaza_cuerpo_chunked_sin_content_length():
+    client = _app(max_bytes=1)
+
+    def _body():
+        for _ in range(4):
+            yield b"x" * MB
+
+    res = client.post(
+        "/api/upload",
+        content=_body(),
+        headers={"content-type": "multipart/form-data; boundary=b"},
+    )
+    assert res.status_code == 413
+
+
+def test_middleware_deja_pasar_subidas_dentro_del_limite():
+    client = _app(max_bytes=1)
+    res = client.post("/api/upload", files={"files": ("a.pdf", b"x" * 1024, "application/pdf")})
+    assert res.status_code == 200
+    assert res.json() == {"n": 1}
+
+
+def test_discard_es_idempotente(spool_settings):
+    out = SpooledUpload("a.pdf", "application/pdf", max_memory=10, spool_dir=str(spool_settings))
+    out.write(b"x" * 100)
+    out.finish()
+    out.discard()
+    out.discard()
+    assert os.listdir(spool_settings) == []
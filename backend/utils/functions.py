@@ -2,7 +2,6 @@
 # region           IMPORTACIONES
 # -----------------------------------------------------------------------------
 import json
-import asyncio
 from datetime import datetime, timezone
 #endregion
 
@@ -44,7 +43,7 @@ class Functions:
             Mensaje:
             {t}
             """
-        resp = await asyncio.to_thread(llm.invoke, prompt)
+        resp = await llm.ainvoke(prompt)
         raw = (getattr(resp, "content", "") or "").strip()
         try:
             data = json.loads(raw)